@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+description: Measures decompilation throughput of a large generated program,
+    sequentially and with PrgmCompiler.decompile_parallel, and checks that
+    both give the same result.
+
+    Run from the repository root:
+
+        python benchmarks/decompile.py
+        python benchmarks/decompile.py --lines 400000 -j 4
+        python benchmarks/decompile.py --line-cache 4096
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from basically_ti_basic.compiler import PrgmCompiler, LineCache
+
+PROGRAM = [
+    'ClrHome\n',
+    'For I,1,10\n',
+    'Disp "HELLO WORLD",I\n',
+    'If A>B:Then\n',
+    'Output(3,4,"HI")\n',
+    'End\n',
+    'End\n',
+    ]
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=140000,
+        help="Roughly how many lines the generated program has.")
+    parser.add_argument('-j', type=int, default=None,
+        help="Number of processes, defaults to the CPU count.")
+    parser.add_argument('--line-cache', type=int, default=None,
+        help="Also time decompiling with a line cache of this many lines.")
+    args = parser.parse_args()
+
+    compiler = PrgmCompiler()
+    tifile = compiler.compile(PROGRAM * (args.lines // len(PROGRAM)))
+    tifile.prgmdata = b"".join(tifile.prgmdata)
+    size = len(tifile.prgmdata) / 1e6
+
+    sequential, sequential_time = timed(compiler.decompile, tifile)
+    parallel, parallel_time = timed(compiler.decompile_parallel, tifile, None, args.j)
+
+    print("program:     {0:8.2f} MB".format(size))
+    print("sequential:  {0:8.2f} MB/s".format(size / sequential_time))
+    print("parallel:    {0:8.2f} MB/s ({1} processes)".format(
+        size / parallel_time, args.j or os.cpu_count()))
+
+    if sequential != parallel:
+        print("Parallel result differs from the sequential one")
+        sys.exit(1)
+
+    if args.line_cache is not None:
+        cached_compiler = PrgmCompiler(None, LineCache(args.line_cache))
+        cached, cached_time = timed(cached_compiler.decompile, tifile)
+        cache = cached_compiler.line_cache
+        print("line cache:  {0:8.2f} MB/s ({1:.1%} hits)".format(
+            size / cached_time, cache.hits / float(cache.hits + cache.misses)))
+
+        if sequential != cached:
+            print("Cached result differs from the sequential one")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
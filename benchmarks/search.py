@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+description: Measures searching a generated library of .8Xp files with
+    ProgramSearcher against decompiling every file and searching the text,
+    and checks that both find the same lines.
+
+    Run from the repository root:
+
+        python benchmarks/search.py
+        python benchmarks/search.py --programs 2000 -s 'Output(3,'
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from basically_ti_basic.compiler import PrgmCompiler
+from basically_ti_basic.files import TIPrgmFile
+from basically_ti_basic.search import ProgramSearcher
+
+LINES = [
+    'ClrHome\n',
+    'For I,1,10\n',
+    'Disp "HELLO WORLD",I\n',
+    'If A>B:Then\n',
+    'Output(4,4,"HI")\n',
+    'A+B→C\n',
+    'End\n',
+    'End\n',
+    ]
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def decompile_and_grep(directory, patterns):
+    compiler = PrgmCompiler()
+    found = []
+    for fname in sorted(os.listdir(directory)):
+        for number, line in enumerate(compiler.decompile(TIPrgmFile(os.path.join(directory, fname))), 1):
+            if any(pattern in line for pattern in patterns):
+                found.append((fname, number))
+    return found
+
+def search(directory, patterns):
+    return [
+        (os.path.basename(hit.filename), hit.line)
+        for hit in ProgramSearcher(patterns).search_paths([directory])
+        ]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--programs', type=int, default=500,
+        help="How many programs the generated library has.")
+    parser.add_argument('--lines', type=int, default=400,
+        help="How many lines each program has.")
+    parser.add_argument('-s', action='append', default=None,
+        help="What to search for, 'Output(3,' by default.")
+    args = parser.parse_args()
+    patterns = args.s or ['Output(3,']
+
+    compiler = PrgmCompiler()
+    random.seed(0)
+    directory = tempfile.mkdtemp()
+    try:
+        for number in range(args.programs):
+            lines = [random.choice(LINES) for _ in range(args.lines)]
+            # One program in ten has something to find
+            if number % 10 == 0:
+                lines[random.randrange(args.lines)] = 'Output(3,1,"FOUND")\n'
+            compiler.compile(lines).writeOut(os.path.join(directory, "P{0}.8Xp".format(number)))
+
+        grepped, grep_time = timed(decompile_and_grep, directory, patterns)
+        searched, search_time = timed(search, directory, patterns)
+    finally:
+        shutil.rmtree(directory)
+
+    print("decompile and grep: {0:8.3f} s".format(grep_time))
+    print("search:             {0:8.3f} s ({1:.1f}x)".format(search_time, grep_time / search_time))
+
+    if sorted(set(grepped)) != sorted(set(searched)):
+        print("The search found different lines than decompiling and grepping")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+description: Measures the cold start cost of the basically-ti-basic command
+    line utility. Reports the median wall time of running the utility in a
+    fresh interpreter, and the import time of each basically_ti_basic module
+    as reported by python -X importtime.
+
+    Run from the repository root:
+
+        python benchmarks/startup.py
+        python benchmarks/startup.py -i FIBO.8Xp --max-ms 80
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+def _environment():
+    env = dict(os.environ)
+    # Cold start is measured the way an installed package runs, with its
+    # bytecode already cached.
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = SRC + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+def wall_times(command, runs):
+    """
+    Runs a command in a fresh interpreter several times.
+
+    Returns:
+        Array[float]: the wall time of each run, in milliseconds
+    """
+    env = _environment()
+    # One untimed run to write out any missing bytecode
+    subprocess.run(command, env=env, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return times
+
+def import_times(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: cumulative import time in microseconds of each
+            basically_ti_basic module
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        env=_environment(), check=True, capture_output=True, text=True)
+
+    found = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'basically_ti_basic' not in line:
+            continue
+        parts = line.split('|')
+        found[parts[2].strip()] = int(parts[1])
+
+    return found
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20, help="Number of runs.")
+    parser.add_argument('-i', default=None,
+        help="Optional .8Xp file to decompile on each run. Without one, "
+            "only the utility's --help is timed.")
+    parser.add_argument('--max-ms', type=float, default=None,
+        help="Exit with an error if the median cold start is above this.")
+    args = parser.parse_args()
+
+    command = [sys.executable, '-m', 'basically_ti_basic']
+    if args.i is not None:
+        command += ['-d', '-i', args.i, '-o', os.devnull]
+    else:
+        command += ['--help']
+
+    baseline = statistics.median(wall_times([sys.executable, '-c', 'pass'], args.n))
+    median = statistics.median(wall_times(command, args.n))
+
+    print("interpreter start:  {0:8.2f} ms".format(baseline))
+    print("cold start:         {0:8.2f} ms".format(median))
+    print("over interpreter:   {0:8.2f} ms".format(median - baseline))
+    print("")
+    for module, usec in sorted(import_times('basically_ti_basic.__main__').items()):
+        print("import {0:<34} {1:8.2f} ms".format(module, usec / 1000))
+
+    if args.max_ms is not None and median > args.max_ms:
+        print("")
+        print("Cold start of {0:.2f} ms is over the limit of {1:.2f} ms".format(median, args.max_ms))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
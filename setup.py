@@ -31,8 +31,15 @@ setup(name='basically_ti_basic',
     package_dir={'':'src'},
     packages=[
         'basically_ti_basic',
+        'basically_ti_basic.batch',
+        'basically_ti_basic.catalog',
         'basically_ti_basic.compiler',
+        'basically_ti_basic.diff',
         'basically_ti_basic.files',
+        'basically_ti_basic.search',
+        'basically_ti_basic.server',
+        'basically_ti_basic.simulator',
+        'basically_ti_basic.store',
         'basically_ti_basic.tokens'
         ],
     data_files=data_files,
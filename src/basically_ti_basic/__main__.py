@@ -1,26 +1,79 @@
-from basically_ti_basic.compiler import PrgmCompiler
-from basically_ti_basic.files import TIPrgmFile
 import argparse
+import os
+import sys
 
-def compile_file(inputfile, outputfile):
+# The compiler, files and catalog modules are imported inside the functions
+# that use them, so that each invocation only pays for what it runs.
+
+def report_diagnostics(diagnostics, name):
+    """
+    Prints a summary of the problems found in a file, and each of them,
+    to standard error.
+    """
+    if not diagnostics and diagnostics.error is None:
+        return
+
+    print(diagnostics.summary(name), file=sys.stderr)
+    for diagnostic in diagnostics:
+        print("    " + str(diagnostic), file=sys.stderr)
+
+def compile_file(inputfile, outputfile, model=None, on_error='raise', size_report=False, budget=None):
+    from basically_ti_basic.compiler import PrgmCompiler, Diagnostics, BudgetError, TokenError
 
     file_lines = []
     with open(inputfile, 'r') as f:
         for line in f:
             file_lines.append(line)
 
-    compiler = PrgmCompiler()
-    compiled_file = compiler.compile(file_lines)
+    compiler = PrgmCompiler(model)
+    diagnostics = Diagnostics(on_error)
+    try:
+        compiled_file = compiler.compile(file_lines, diagnostics)
+    except (TokenError, RuntimeError) as e:
+        sys.exit(inputfile + ": " + str(e))
+    report_diagnostics(diagnostics, inputfile)
+
+    if size_report or budget is not None:
+        name = outputfile if outputfile != "stdout" else inputfile
+        report = compiler.size_report(
+            compiled_file.prgmdata, os.path.splitext(os.path.basename(name))[0].upper()[:8])
+        if size_report:
+            print(report, file=sys.stderr)
+        try:
+            report.check(budget)
+        except BudgetError as e:
+            sys.exit(inputfile + ": " + str(e))
+
     if outputfile == "stdout":
         print("".join(compiled_file.prgmdata))
     else:
         compiled_file.writeOut(outputfile)
 
-def decompile_file(inputfile, outputfile):
-    tifile = TIPrgmFile(inputfile)
+def decompile_file(inputfile, outputfile, model=None, entry=None, on_error='skip', jobs=None, line_cache=None):
+    from basically_ti_basic.compiler import PrgmCompiler, Diagnostics, LineCache, TokenError
+    from basically_ti_basic.files import TIPrgmFile, TIVarContainer
+
+    compiler = PrgmCompiler(model, None if line_cache is None else LineCache(line_cache))
+    diagnostics = Diagnostics(on_error)
+
+    def decompile(tifile):
+        if jobs is None:
+            return compiler.decompile(tifile, diagnostics)
+        return compiler.decompile_parallel(tifile, diagnostics, jobs)
+
+    try:
+        if entry is None:
+            decompiled = decompile(TIPrgmFile(inputfile))
+        else:
+            with TIVarContainer(inputfile) as container:
+                tifile = container.find(entry)
+                if tifile is None or tifile.prgmdata is None:
+                    sys.exit("No program named " + entry + " in " + inputfile)
+                decompiled = decompile(tifile)
+    except (TokenError, RuntimeError) as e:
+        sys.exit(inputfile + ": " + str(e))
+    report_diagnostics(diagnostics, inputfile)
 
-    compiler = PrgmCompiler()
-    decompiled = compiler.decompile(tifile)
     if outputfile == 'stdout':
         print("\n".join(decompiled))
     else:
@@ -28,6 +81,231 @@ def decompile_file(inputfile, outputfile):
             for line in decompiled:
                 out.write(line+"\n")
 
+def batch_decompile(inputpath, outputdir, model=None, on_error='skip', jobs=None, line_cache=None):
+    from basically_ti_basic.batch import BatchDecompiler
+
+    batch = BatchDecompiler(model, jobs, on_error, line_cache)
+    if os.path.isdir(inputpath):
+        filenames = []
+        for root, dirs, files in os.walk(inputpath):
+            for fname in files:
+                if fname.lower().endswith('.8xp'):
+                    filenames.append(os.path.join(root, fname))
+        results = batch.decompile_files(sorted(filenames))
+    else:
+        try:
+            results = batch.decompile_container(inputpath)
+        except RuntimeError as e:
+            sys.exit(inputpath + ": " + str(e))
+
+    written = set()
+    for name, decompiled, diagnostics in results:
+        report_diagnostics(diagnostics, name)
+        if decompiled is None:
+            continue
+
+        # Files keep their place under the input directory, so programs
+        # with the same name in different directories don't collide
+        if os.path.isdir(inputpath):
+            name = os.path.relpath(name, inputpath)
+        outputfile = os.path.join(outputdir, os.path.splitext(name)[0] + ".txt")
+        if os.path.normcase(outputfile) in written:
+            print(name + ": not written, another program was already written to " + outputfile, file=sys.stderr)
+            continue
+        written.add(os.path.normcase(outputfile))
+
+        os.makedirs(os.path.dirname(outputfile) or ".", exist_ok=True)
+        with open(outputfile, 'w') as out:
+            for line in decompiled:
+                out.write(line+"\n")
+
+def list_entries(inputfile):
+    from basically_ti_basic.files import TIVarContainer
+
+    try:
+        with TIVarContainer(inputfile) as container:
+            for entry in container:
+                print("{0:<8} {1:<18} {2:>6}".format(entry.name, entry.type, len(entry.data)))
+    except RuntimeError as e:
+        sys.exit(inputfile + ": " + str(e))
+
+def catalog_directory(directory, index_file, uses=None, largest=None, model=None):
+    from basically_ti_basic.catalog import ProgramCatalog
+
+    if index_file is None:
+        index_file = os.path.join(directory, ProgramCatalog.DEFAULT_INDEX)
+
+    catalog = ProgramCatalog(index_file, model)
+    catalog.update(directory)
+    catalog.save()
+
+    if uses is not None:
+        entries = catalog.uses(uses)
+    else:
+        entries = catalog.largest(largest)
+
+    for entry in entries:
+        print("{0:<8} {1:>6} {2}".format(entry['name'], entry['size'], entry['path']))
+
+def size_reports(inputpath, model=None, budget=None):
+    """
+    Prints the sizes of the programs in a directory of .8Xp files and
+    TI-Basic text files (which are compiled first), or in a group file,
+    biggest first.
+    """
+    from basically_ti_basic.compiler import PrgmCompiler, Diagnostics, TokenError
+    from basically_ti_basic.files import TIPrgmFile, TIVarContainer
+
+    compiler = PrgmCompiler(model)
+    reports = []
+
+    if os.path.isdir(inputpath):
+        for root, dirs, files in os.walk(inputpath):
+            for fname in files:
+                path = os.path.join(root, fname)
+                name, extension = os.path.splitext(fname)
+                if extension.lower() == '.8xp':
+                    tifile = TIPrgmFile(path)
+                    if tifile.header is not None:
+                        name = tifile.header.name
+                    prgm_data = tifile.prgmdata or []
+                elif extension.lower() == '.txt':
+                    with open(path, 'r') as f:
+                        try:
+                            prgm_data = compiler.compile(f.readlines(), Diagnostics('raise')).prgmdata
+                        except TokenError as e:
+                            print(path + ": " + str(e), file=sys.stderr)
+                            continue
+                else:
+                    continue
+                reports.append((path, compiler.size_report(prgm_data, name.upper()[:8])))
+    else:
+        try:
+            with TIVarContainer(inputpath) as container:
+                for entry in container:
+                    prgmdata = entry.prgmdata
+                    if prgmdata is None:
+                        continue
+                    reports.append((inputpath, compiler.size_report(prgmdata, entry.name)))
+                    prgmdata.release()
+        except RuntimeError as e:
+            sys.exit(inputpath + ": " + str(e))
+
+    reports.sort(key=lambda item: item[1].ram_size, reverse=True)
+    print("{0:>7} {1:>7} {2:>7}  {3:<8} {4}".format("RAM", "FILE", "TOKENS", "NAME", "PATH"))
+    for path, report in reports:
+        print("{0:>7} {1:>7} {2:>7}  {3:<8} {4}".format(
+            report.ram_size, report.file_size, report.size, report.name, path))
+
+    if budget is not None:
+        over = [report for path, report in reports if report.ram_size > budget]
+        if over:
+            sys.exit("{0} program{1} over the budget of {2} bytes: {3}".format(
+                len(over), "" if len(over) == 1 else "s", budget,
+                ", ".join(report.name for report in over)))
+
+def search_programs(inputpath, patterns, model=None):
+    from basically_ti_basic.compiler import TokenError
+    from basically_ti_basic.search import ProgramSearcher
+
+    try:
+        searcher = ProgramSearcher(patterns, model)
+    except TokenError as e:
+        sys.exit("Can't search for that: " + str(e))
+
+    for hit in searcher.search_paths([inputpath]):
+        print(hit)
+
+    for filename, reason in searcher.unreadable:
+        print(filename + ": skipped, " + reason, file=sys.stderr)
+
+def run_program(inputfile, model=None, max_steps=None):
+    from basically_ti_basic.compiler import PrgmCompiler
+    from basically_ti_basic.files import TIPrgmFile
+    from basically_ti_basic.simulator import PrgmSimulator, SimulatorError
+
+    tifile = TIPrgmFile(inputfile)
+    simulator = PrgmSimulator(model, max_steps or 1000000)
+    try:
+        print(simulator.run(tifile.prgmdata or []))
+    except SimulatorError as e:
+        sys.exit(inputfile + ": " + str(e))
+
+    lines = PrgmCompiler(model).decompile(tifile)
+    print("{0} tokens executed".format(simulator.steps), file=sys.stderr)
+    for line, count in simulator.profile():
+        print("{0:>8} {1:>5}: {2}".format(count, line, lines[line - 1]), file=sys.stderr)
+
+def diff_programs(oldfile, newfile, outputfile, model=None):
+    from basically_ti_basic.diff import PrgmDiffer, read_program
+
+    differ = PrgmDiffer(model)
+    old_data = read_program(oldfile)
+    new_data = read_program(newfile)
+
+    if outputfile != 'stdout':
+        with open(outputfile, 'wb') as out:
+            out.write(differ.make_patch(old_data, new_data))
+        return
+
+    for tag, old_text, new_text in differ.changes(old_data, new_data):
+        if old_text:
+            print("- " + repr(old_text))
+        if new_text:
+            print("+ " + repr(new_text))
+
+def patch_program(inputfile, patchfile, outputfile):
+    from basically_ti_basic.diff import PatchError, patch_file
+
+    with open(patchfile, 'rb') as f:
+        patch = f.read()
+
+    try:
+        patch_file(inputfile, patch, outputfile)
+    except PatchError as e:
+        sys.exit(patchfile + ": " + str(e))
+
+def run_on_worker(op, inputfile, outputfile, socket_path, model=None, entry=None, on_error=None):
+    """
+    Hands a request to a running worker, if there is one. Returns False
+    if no worker is listening, so the caller can do the work itself.
+    """
+    from basically_ti_basic.server import forward
+
+    # The worker names the program the same way a local compile would,
+    # from the path as it was passed rather than the absolute one
+    name = outputfile.split(".")[0].upper()
+    if outputfile != 'stdout':
+        outputfile = os.path.abspath(outputfile)
+
+    response = forward(
+        {
+            'op': op,
+            'input': os.path.abspath(inputfile),
+            'output': outputfile,
+            'name': name,
+            'model': model,
+            'entry': entry,
+            'on_error': on_error
+            },
+        socket_path
+        )
+    if response is None:
+        return False
+
+    if not response['ok']:
+        sys.exit(inputfile + ": " + response['error'])
+
+    if response.get('diagnostics'):
+        print(response['summary'], file=sys.stderr)
+        for diagnostic in response['diagnostics']:
+            print("    " + diagnostic, file=sys.stderr)
+
+    if response['output'] is not None:
+        print(response['output'])
+
+    return True
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -44,6 +322,126 @@ def main():
         default=False,
         help="Compile the passed file."
         )
+    parser.add_argument(
+        '-m',
+        required=False,
+        default=None,
+        help="Calculator model whose tokens to use: TI-83 (the default), TI-83+, TI-84+ or TI-84+CE."
+        )
+    parser.add_argument(
+        '--on-error',
+        required=False,
+        choices=('raise', 'skip', 'placeholder'),
+        default=None,
+        help="What to do with input that can't be converted: stop, leave it out, or leave a placeholder such as [?XX] in its place. Defaults to raise when compiling and skip when decompiling."
+        )
+    parser.add_argument(
+        '-j',
+        required=False,
+        type=int,
+        default=None,
+        help="With -d, split large programs at newlines and decompile the pieces in this many processes."
+        )
+    parser.add_argument(
+        '--batch',
+        required=False,
+        action="store_true",
+        default=False,
+        help="Decompile every .8Xp file in the passed directory, or every program in the passed group file, into the directory passed with -o. Uses -j processes."
+        )
+    parser.add_argument(
+        '--line-cache',
+        required=False,
+        type=int,
+        default=None,
+        help="With -d or --batch, cache this many decompiled lines (per process), which speeds up programs that repeat lines."
+        )
+    parser.add_argument(
+        '--entry',
+        required=False,
+        default=None,
+        help="With -d, decompile the program of this name from a group file."
+        )
+    parser.add_argument(
+        '--entries',
+        required=False,
+        action="store_true",
+        default=False,
+        help="List the variables in the passed group file."
+        )
+    parser.add_argument(
+        '-l',
+        required=False,
+        action="store_true",
+        default=False,
+        help="Update the catalog of the .8Xp files in the passed directory and list them, biggest first."
+        )
+    parser.add_argument(
+        '--index',
+        required=False,
+        default=None,
+        help="Catalog index file to use. Defaults to .tibc-index.json in the cataloged directory."
+        )
+    parser.add_argument(
+        '--uses',
+        required=False,
+        default=None,
+        help="Only list the cataloged programs that use this token, e.g. 'Output('."
+        )
+    parser.add_argument(
+        '--largest',
+        required=False,
+        type=int,
+        default=None,
+        help="Only list this many of the biggest cataloged programs."
+        )
+    parser.add_argument(
+        '-s',
+        required=False,
+        action='append',
+        default=None,
+        help="Search the passed .8Xp or group file, or all of them in the passed directory, for TI-Basic such as 'Output(3,' without decompiling them. Can be given more than once."
+        )
+    parser.add_argument(
+        '--size-report',
+        required=False,
+        action="store_true",
+        default=False,
+        help="With -c, print the size of the program, its biggest lines and its biggest strings to standard error. Without -c, list the sizes of the programs in the passed directory or group file, biggest first."
+        )
+    parser.add_argument(
+        '--budget',
+        required=False,
+        type=int,
+        default=None,
+        help="Fail if a program takes more than this many bytes of RAM on the calculator. With -c, checks the compiled program; otherwise checks the programs in the passed directory or group file, as --size-report lists them."
+        )
+    parser.add_argument(
+        '--run',
+        required=False,
+        action="store_true",
+        default=False,
+        help="Run the passed .8Xp file in the simulator, print its home screen, and print the number of tokens run on each line to standard error."
+        )
+    parser.add_argument(
+        '--max-steps',
+        required=False,
+        type=int,
+        default=None,
+        help="With --run, stop with an error after running this many tokens. Defaults to 1000000."
+        )
+    parser.add_argument(
+        '--diff',
+        required=False,
+        default=None,
+        help="Compare the passed .8Xp file token by token with this newer one. Writes a binary patch to the file passed with -o, if there is one."
+        )
+    parser.add_argument(
+        '--patch',
+        required=False,
+        default=None,
+        help="Apply this patch, made with --diff, to the passed .8Xp file and write the result to the file passed with -o."
+        )
     parser.add_argument(
         '-o',
         required=False,
@@ -52,17 +450,111 @@ def main():
         )
     parser.add_argument(
         '-i',
-        required=True,
+        required=False,
         help="Input file."
         )
+    parser.add_argument(
+        '--serve',
+        required=False,
+        action="store_true",
+        default=False,
+        help="Run a worker that keeps the compiler loaded and answers requests on a Unix socket. While it runs, -c and -d are handed to it."
+        )
+    parser.add_argument(
+        '--stdio',
+        required=False,
+        action="store_true",
+        default=False,
+        help="Run a worker that answers JSON requests, one per line, on standard in and out."
+        )
+    parser.add_argument(
+        '--socket',
+        required=False,
+        default=None,
+        help="Socket for the worker to listen on. Defaults to one per user in $XDG_RUNTIME_DIR or the temp directory."
+        )
+    parser.add_argument(
+        '--no-server',
+        required=False,
+        action="store_true",
+        default=False,
+        help="Don't hand -c or -d to a running worker."
+        )
 
     args = parser.parse_args()
 
+    if args.serve:
+        from basically_ti_basic.server import serve_socket
+        import signal
+        # Stopping the worker with a signal should still clean up the socket
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            serve_socket(args.socket)
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError as e:
+            sys.exit(str(e))
+        return
+
+    if args.stdio:
+        from basically_ti_basic.server import serve_stdio
+        serve_stdio(sys.stdin, sys.stdout)
+        return
+
+    if args.i is None:
+        parser.error("the following arguments are required: -i")
+
+    if args.budget is not None and not args.c and (
+            args.d or args.batch or args.s is not None or args.run or
+            args.diff is not None or args.patch is not None or args.entries or args.l):
+        parser.error("--budget only checks programs compiled with -c or listed by --size-report")
+
+    if args.batch:
+        if args.o == 'stdout':
+            parser.error("--batch needs an output directory passed with -o")
+        batch_decompile(args.i, args.o, args.m, args.on_error or 'skip', args.j, args.line_cache)
+        return
+
+    if args.s is not None:
+        search_programs(args.i, args.s, args.m)
+        return
+
+    if (args.size_report or args.budget is not None) and not args.c:
+        size_reports(args.i, args.m, args.budget)
+        return
+
+    if args.run:
+        run_program(args.i, args.m, args.max_steps)
+        return
+
+    if args.diff is not None:
+        diff_programs(args.i, args.diff, args.o, args.m)
+        return
+
+    if args.patch is not None:
+        if args.o == 'stdout':
+            parser.error("--patch needs an output file passed with -o")
+        patch_program(args.i, args.patch, args.o)
+        return
+
+    # Compiling to standard out isn't something the worker does
+    use_worker = not args.no_server and args.j is None and args.line_cache is None and \
+        not args.size_report and args.budget is None and \
+        (args.d or (args.c and args.o != 'stdout'))
+    if use_worker and run_on_worker('compile' if args.c else 'decompile', args.i, args.o, args.socket, args.m, args.entry, args.on_error):
+        return
+
     if args.c:
-        compile_file(args.i, args.o)
+        compile_file(args.i, args.o, args.m, args.on_error or 'raise', args.size_report, args.budget)
 
     elif args.d:
-        decompile_file(args.i, args.o)
+        decompile_file(args.i, args.o, args.m, args.entry, args.on_error or 'skip', args.j, args.line_cache)
+
+    elif args.entries:
+        list_entries(args.i)
+
+    elif args.l:
+        catalog_directory(args.i, args.index, args.uses, args.largest, args.m)
 
 if __name__ == "__main__":
     main()
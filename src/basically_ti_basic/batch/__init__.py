@@ -0,0 +1,254 @@
+"""
+description: Decompiles many programs at once in a pool of processes without
+    pickling program data or results between them. Program data is read
+    straight into a shared memory input arena (or, for the programs in a
+    group, left in the memory mapped file), each worker is handed
+    only an (offset, length) descriptor, and writes its encoded plaintext
+    into its own slot of a shared memory output arena.
+"""
+from basically_ti_basic.compiler import PrgmCompiler, Diagnostics, LineCache, TokenError
+from basically_ti_basic.files import TIPrgmHeader, TIVarContainer
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import mmap
+import os
+
+class BatchDecompiler(object):
+
+    """
+    Decompiles batches of .8Xp files, or the programs of a group file, in
+    a pool of processes that share their input and output through shared
+    memory.
+    """
+
+    # The most bytes of shared memory the decompiled text of a window of
+    # programs is written to
+    OUTPUT_ARENA = 64 * 1024 * 1024
+
+    def __init__(self, model=None, workers=None, on_error='skip', line_cache=None):
+        """
+        Parameters:
+            string model: The calculator model whose tokens to use
+            int workers: The number of processes, defaults to the CPU count
+            string on_error: The Diagnostics policy for each program
+            int line_cache: If given, each process keeps a LineCache of
+                this many lines, for batches of programs sharing lines
+        """
+        self.model = model
+        self.workers = workers
+        self.on_error = on_error
+        self.line_cache = line_cache
+        self._compiler = PrgmCompiler(model)
+
+    def decompile_files(self, filenames):
+        """
+        Decompiles .8Xp files.
+
+        Parameters:
+            Array[string] filenames: The files to decompile
+        Returns:
+            Array[(string, Array[string], Diagnostics)]: For each file, in
+                order, its name, the decompiled lines and what was found.
+                The lines are None if it stopped under the raise policy,
+                or if the file couldn't be read, which is then given as
+                the error of the Diagnostics.
+        """
+        spans = []
+        unreadable = dict()
+        total = 0
+        for filename in filenames:
+            try:
+                start, end = TIPrgmHeader.fromFile(filename).programSpan(os.path.getsize(filename))
+            except (OSError, RuntimeError) as e:
+                # One bad file doesn't stop the batch
+                unreadable[filename] = str(e)
+                continue
+            spans.append((filename, start, total, end - start))
+            total += end - start
+
+        arena = shared_memory.SharedMemory(create=True, size=max(total, 1))
+        try:
+            # Read each program straight into its place in the arena
+            for filename, file_offset, offset, length in spans:
+                with open(filename, "rb") as inStream:
+                    inStream.seek(file_offset)
+                    inStream.readinto(arena.buf[offset:offset + length])
+
+            descriptors = [(None, offset, length) for _, _, offset, length in spans]
+            results = self._run(arena.name, descriptors)
+        finally:
+            arena.close()
+            arena.unlink()
+
+        decompiled = dict((span[0], result) for span, result in zip(spans, results))
+        for filename, error in unreadable.items():
+            diagnostics = Diagnostics(self.on_error)
+            diagnostics.error = error
+            decompiled[filename] = (None, diagnostics)
+
+        return [(filename,) + decompiled[filename] for filename in filenames]
+
+    def decompile_container(self, filename):
+        """
+        Decompiles the programs in a group file. The programs are
+        read by the workers from their own mapping of the file, so they are
+        never copied into the pool.
+
+        Parameters:
+            string filename: The group file
+        Returns:
+            Array[(string, Array[string], Diagnostics)]: For each program, in
+                order, its name, the decompiled lines and what was found.
+                The lines are None if it stopped under the raise policy.
+        """
+        names = []
+        descriptors = []
+        with TIVarContainer(filename) as container:
+            for entry in container:
+                prgmdata = entry.prgmdata
+                if prgmdata is None:
+                    continue
+                # The tokens follow the two byte program length
+                names.append(entry.name)
+                descriptors.append(
+                    (os.path.abspath(filename), entry.dataOffset + 2, len(prgmdata)))
+                prgmdata.release()
+
+        results = self._run(None, descriptors)
+        return [(name,) + result for name, result in zip(names, results)]
+
+    def _run(self, input_name, descriptors):
+        """
+        Runs the workers over a list of descriptors. They're handled in
+        windows that fit in one output arena, which is reused by each
+        window in turn, so the shared memory used is bounded however big
+        the batch is.
+
+        Returns:
+            Array[(Array[string], Diagnostics)]: The results, in order
+        """
+        # Each program gets a slot big enough for the longest plaintext it
+        # could possibly decompile to.
+        expansion = _expansion(self._compiler.table)
+        needed = [length * expansion for _, _, length in descriptors]
+        size = max(min(sum(needed), BatchDecompiler.OUTPUT_ARENA), max(needed, default=0), 1)
+
+        output = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            results = []
+            with ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_attach,
+                    initargs=(input_name, output.name, self.model, self.on_error, self.line_cache)
+                    ) as pool:
+                start = 0
+                while start < len(descriptors):
+                    jobs = []
+                    total = 0
+                    for descriptor, slot_size in zip(descriptors[start:], needed[start:]):
+                        if jobs and total + slot_size > size:
+                            break
+                        jobs.append(descriptor + (total,))
+                        total += slot_size
+                    start += len(jobs)
+
+                    written = list(pool.map(_decompile_span, jobs, chunksize=max(1, len(jobs) // 64)))
+                    results.extend(self._collect(output, jobs, written))
+        finally:
+            output.close()
+            output.unlink()
+
+        return results
+
+    def _collect(self, output, jobs, written):
+        """
+        Reads the results of a window of jobs out of the output arena.
+
+        Returns:
+            Array[(Array[string], Diagnostics)]: The results, in order
+        """
+        results = []
+        for job, (size, found) in zip(jobs, written):
+            slot = job[3]
+            text = bytes(output.buf[slot:slot + size]).decode('utf-8')
+            diagnostics = Diagnostics(self.on_error)
+            try:
+                for offset, value, line, column in found:
+                    diagnostics.record(offset, value, line, column)
+            except TokenError:
+                # One program stopping doesn't stop the batch
+                results.append((None, diagnostics))
+                continue
+            results.append((text.split("\n"), diagnostics))
+
+        return results
+
+def _expansion(table):
+    """
+    Returns the most bytes of encoded plaintext a byte of program data can
+    decompile to, including the [?XX] placeholder.
+    """
+    most = len("[?XX]")
+    for token, text in table.get_tokens().items():
+        most = max(most, -(-len(text.encode('utf-8')) // len(token)))
+    return most
+
+# The shared memory, mapped archives and compiler of each worker process
+_worker = dict()
+
+def _attach(input_name, output_name, model, policy, line_cache):
+    """
+    Sets up a worker process, attaching it to the shared memory arenas.
+    """
+    _worker['input'] = None
+    if input_name is not None:
+        _worker['input'] = shared_memory.SharedMemory(name=input_name)
+    _worker['output'] = shared_memory.SharedMemory(name=output_name)
+    _worker['archives'] = dict()
+    _worker['compiler'] = PrgmCompiler(
+        model, None if line_cache is None else LineCache(line_cache))
+    _worker['policy'] = policy
+
+def _source(path):
+    """
+    Returns the buffer a descriptor points into, the input arena or the
+    worker's own mapping of an archive.
+    """
+    if path is None:
+        return _worker['input'].buf
+
+    archive = _worker['archives'].get(path)
+    if archive is None:
+        with open(path, "rb") as inStream:
+            archive = mmap.mmap(inStream.fileno(), 0, access=mmap.ACCESS_READ)
+        _worker['archives'][path] = archive
+    return archive
+
+def _decompile_span(job):
+    """
+    Decompiles one program in a worker process and writes its encoded
+    plaintext into its slot of the output arena.
+
+    Returns:
+        (int, Array[tuple]): The number of bytes written, and the offset,
+            value, line and column of each problem found
+    """
+    from basically_ti_basic.files import TIPrgmFile
+
+    source, offset, length, slot = job
+
+    tifile = TIPrgmFile()
+    with memoryview(_source(source)) as view:
+        tifile.prgmdata = view[offset:offset + length]
+        diagnostics = Diagnostics(_worker['policy'])
+        try:
+            text = "\n".join(_worker['compiler'].decompile(tifile, diagnostics))
+        except TokenError:
+            text = ""
+        tifile.prgmdata.release()
+
+    encoded = text.encode('utf-8')
+    _worker['output'].buf[slot:slot + len(encoded)] = encoded
+
+    found = [(d.offset, d.value, d.line, d.column) for d in diagnostics]
+    return len(encoded), found
@@ -0,0 +1,158 @@
+"""
+description: Builds and queries a persistent index of a directory of
+    TI-Basic .8Xp files, so that questions like "which programs use X"
+    don't need every file to be read and decompiled again.
+"""
+from basically_ti_basic.compiler import PrgmCompiler
+from basically_ti_basic.files import TIPrgmFile
+import json
+import os
+import zlib
+
+class ProgramCatalog(object):
+
+    """
+    An index of .8Xp files holding the name, size, checksum, mtime and
+    token histogram of each program. The index is stored as JSON and
+    updated incrementally: only files whose mtime or size changed since
+    the last update are read again.
+    """
+
+    # Bump this if the layout of the entries changes, older indexes
+    # are then rebuilt from scratch.
+    VERSION = 1
+
+    DEFAULT_INDEX = ".tibc-index.json"
+
+    def __init__(self, index_file, model=None):
+        """
+        Loads the index from disk if it exists and can be read.
+
+        Parameters:
+            string index_file: The path of the index file
+            string model: The calculator model whose tokens to count
+        """
+        self.index_file = index_file
+        self.entries = {}
+        self._compiler = PrgmCompiler(model)
+        self._model = self._compiler.table.name
+
+        # An index that can't be read is rebuilt, like an older one
+        stored = None
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, 'r') as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+        if isinstance(stored, dict) and \
+                stored.get('version') == ProgramCatalog.VERSION and \
+                stored.get('model') == self._model and \
+                isinstance(stored.get('entries'), dict):
+            self.entries = stored['entries']
+
+    def update(self, directory):
+        """
+        Brings the index up to date with the .8Xp files in a directory.
+
+        Parameters:
+            string directory: The directory to index
+        Returns:
+            int: The number of files that had to be read
+        """
+        seen = set()
+        files_read = 0
+
+        for root, dirs, files in os.walk(directory):
+            for fname in files:
+                if not fname.lower().endswith('.8xp'):
+                    continue
+
+                path = os.path.abspath(os.path.join(root, fname))
+                seen.add(path)
+                stat = os.stat(path)
+
+                entry = self.entries.get(path)
+                if entry is not None and \
+                        entry['mtime'] == stat.st_mtime_ns and \
+                        entry['filesize'] == stat.st_size:
+                    continue
+
+                self.entries[path] = self._index_file(path, stat)
+                files_read += 1
+
+        for path in list(self.entries):
+            if path not in seen:
+                del self.entries[path]
+
+        return files_read
+
+    def save(self):
+        """
+        Writes the index to disk.
+        """
+        with open(self.index_file, 'w') as f:
+            json.dump(
+                {
+                    'version': ProgramCatalog.VERSION,
+                    'model': self._model,
+                    'entries': self.entries
+                    },
+                f
+                )
+
+    def uses(self, token):
+        """
+        Finds the programs that use a token.
+
+        Parameters:
+            string token: The plaintext of the token, e.g. "Output("
+        Returns:
+            Array[dict]: The matching entries, with the most uses first
+        """
+        found = [e for e in self.entries.values() if token in e['tokens']]
+        return sorted(found, key=lambda e: e['tokens'][token], reverse=True)
+
+    def largest(self, count=None):
+        """
+        Lists the programs by size.
+
+        Parameters:
+            int count: How many programs to return, all by default
+        Returns:
+            Array[dict]: The entries, biggest program first
+        """
+        by_size = sorted(
+            self.entries.values(),
+            key=lambda e: e['size'],
+            reverse=True
+            )
+        return by_size[:count]
+
+    def _index_file(self, path, stat):
+        """
+        Reads a file and builds its index entry.
+        """
+        tifile = TIPrgmFile(path)
+        prgm_data = b"".join(tifile.prgmdata or [])
+
+        histogram = {}
+        for offset, token, plaintext in self._compiler.tokenize(prgm_data):
+            if plaintext is not None:
+                histogram[plaintext] = histogram.get(plaintext, 0) + 1
+
+        if tifile.header is not None:
+            name = tifile.header.name
+        else:
+            name = os.path.splitext(os.path.basename(path))[0].upper()
+
+        return {
+            'path': path,
+            'name': name,
+            'size': len(prgm_data),
+            'checksum': zlib.crc32(prgm_data),
+            'mtime': stat.st_mtime_ns,
+            'filesize': stat.st_size,
+            'tokens': histogram
+            }
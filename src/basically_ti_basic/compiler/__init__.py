@@ -1,6 +1,325 @@
-from basically_ti_basic.tokens import get_tokens, get_inverse_tokens
+from basically_ti_basic.tokens import get_table
 from basically_ti_basic.files import TIPrgmFile
 
+# The byte of the newline token, which starts every line but the first
+NEWLINE = 0x3F
+
+class TokenError(Exception):
+
+    """
+    Raised for a byte that can't be decompiled or text that can't be
+    compiled, when diagnostics are collected with the raise policy.
+    """
+
+    def __init__(self, diagnostic):
+        Exception.__init__(self, str(diagnostic))
+        self.diagnostic = diagnostic
+
+class Diagnostic(object):
+
+    """
+    Where a byte that can't be decompiled, or a character that can't be
+    compiled, was found.
+    """
+    __slots__ = ('offset', 'value', 'line', 'column')
+
+    def __init__(self, offset, value, line, column):
+        """
+        Parameters:
+            int offset: The offset into the program data or text
+            bytes|string value: The byte or character
+            int line: The line, counted from 1
+            int column: The column of the plaintext, counted from 1
+        """
+        self.offset = offset
+        self.value = value
+        self.line = line
+        self.column = column
+
+    def __str__(self):
+        if isinstance(self.value, bytes):
+            problem = "could not decode byte 0x" + self.value.hex().upper()
+        else:
+            problem = "could not compile " + repr(self.value)
+
+        return "line {0}, column {1} (offset {2}): {3}".format(
+            self.line, self.column, self.offset, problem)
+
+class Diagnostics(object):
+
+    """
+    Collects the problems found while compiling or decompiling a program
+    and decides what to do about them. The policies are:
+
+        raise: raise a TokenError at the first problem
+        skip: leave out what can't be handled and carry on
+        placeholder: carry on, but leave a placeholder in its place. When
+            decompiling the placeholder is [?XX], with XX the byte in hex.
+            When compiling it is the ? token.
+
+    Nothing is done with a collector unless a problem is found, so passing
+    one costs nothing on clean input.
+    """
+
+    POLICIES = ('raise', 'skip', 'placeholder')
+
+    def __init__(self, policy='skip'):
+        """
+        Parameters:
+            string policy: One of POLICIES
+        """
+        if policy not in Diagnostics.POLICIES:
+            raise ValueError("Unknown policy: " + str(policy) + ", known policies: " + ", ".join(Diagnostics.POLICIES))
+
+        self.policy = policy
+        self.found = []
+        # Why the whole program couldn't be handled, if it couldn't
+        self.error = None
+
+    def record(self, offset, value, line, column):
+        """
+        Records a problem and applies the policy to it.
+
+        Returns:
+            string: The placeholder to use, or None if it should be skipped
+        """
+        diagnostic = Diagnostic(offset, value, line, column)
+        self.found.append(diagnostic)
+
+        if self.policy == 'raise':
+            raise TokenError(diagnostic)
+
+        if self.policy == 'skip':
+            return None
+
+        if isinstance(value, bytes):
+            return "[?" + value.hex().upper() + "]"
+        return "?"
+
+    def summary(self, name=None):
+        """
+        Returns a one line summary of the problems found.
+
+        Parameters:
+            string name: What was being processed, e.g. the file name
+        """
+        prefix = "" if name is None else name + ": "
+        if self.error is not None:
+            return prefix + self.error
+        if not self.found:
+            return prefix + "no problems"
+
+        first = self.found[0]
+        return prefix + "{0} problem{1}, first at line {2}, column {3}".format(
+            len(self.found), "" if len(self.found) == 1 else "s", first.line, first.column)
+
+    def __len__(self):
+        return len(self.found)
+
+    def __iter__(self):
+        return iter(self.found)
+
+class LineCache(object):
+
+    """
+    A bounded, least recently used cache of decompiled lines, keyed by the
+    token bytes of the line (including its newline). Lines are looked up
+    through a memoryview of the program data, so a hit copies nothing.
+    Not safe to share between threads.
+    """
+
+    def __init__(self, maxsize=4096, max_line=1024):
+        """
+        Parameters:
+            int maxsize: The most lines to keep
+            int max_line: Lines longer than this many bytes aren't cached
+        """
+        from collections import OrderedDict
+
+        self.maxsize = maxsize
+        self.max_line = max_line
+        self.hits = 0
+        self.misses = 0
+        self._lines = OrderedDict()
+
+    def get(self, line_data):
+        """
+        Returns the plaintext of a line, or None if it isn't cached.
+
+        Parameters:
+            bytes|memoryview line_data: The token bytes of the line
+        """
+        text = self._lines.get(line_data)
+        if text is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._lines.move_to_end(line_data)
+        return text
+
+    def put(self, line_data, text):
+        """
+        Caches the plaintext of a line, dropping the least recently used
+        line if the cache is full.
+        """
+        if len(line_data) > self.max_line:
+            return
+
+        self._lines[bytes(line_data)] = text
+        if len(self._lines) > self.maxsize:
+            self._lines.popitem(last=False)
+
+    def clear(self):
+        """
+        Empties the cache and resets the counters.
+        """
+        self._lines.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._lines)
+
+class BudgetError(Exception):
+
+    """
+    Raised when a program is bigger than its size budget.
+    """
+
+    def __init__(self, report, budget):
+        over = report.ram_size - budget
+        message = "{0} takes {1} bytes of RAM, {2} bytes over its budget of {3}".format(
+            report.name, report.ram_size, over, budget)
+        largest = report.largest_lines(3)
+        if largest:
+            message += "; largest lines: " + ", ".join(
+                "{0} ({1} bytes)".format(line, size) for line, size, text in largest)
+        Exception.__init__(self, message)
+        self.report = report
+        self.budget = budget
+
+class SizeReport(object):
+
+    """
+    What a compiled program costs: its tokens, the RAM it takes on the
+    calculator and the size of its .8Xp file, and the bytes taken by each
+    line (counting its newline) and string literal.
+    """
+
+    # A program in RAM is its tokens, a two byte length, and a VAT entry of
+    # 7 bytes plus its name
+    RAM_OVERHEAD = 9
+
+    # A .8Xp file is a 74 byte header (with a 13 byte variable header)
+    # before the tokens and a two byte checksum after them
+    FILE_OVERHEAD = 76
+
+    def __init__(self, name, tokens):
+        """
+        Parameters:
+            string name: The name of the program
+            Iterable[(int, bytes, string)] tokens: The program's tokens, as
+                PrgmCompiler.tokenize returns them
+        """
+        self.name = name
+        self.size = 0
+        self.lines = []
+        self.strings = []
+
+        line = 1
+        line_size = 0
+        line_text = []
+        # The line, size and plaintext of the string literal being read
+        string = None
+        for offset, token, plaintext in tokens:
+            self.size += len(token)
+            line_size += len(token)
+
+            # A string ends at its closing quote, a store arrow or the end
+            # of the line
+            if string is not None and plaintext in ('→', "\n"):
+                self.strings.append((string[0], string[1], "".join(string[2])))
+                string = None
+
+            if plaintext == "\n":
+                self.lines.append((line, line_size, "".join(line_text)))
+                line += 1
+                line_size = 0
+                line_text = []
+                continue
+
+            if plaintext is None:
+                plaintext = "[?" + token.hex().upper() + "]"
+            line_text.append(plaintext)
+
+            if string is not None:
+                string[1] += len(token)
+                string[2].append(plaintext)
+                if plaintext == '"':
+                    self.strings.append((string[0], string[1], "".join(string[2])))
+                    string = None
+            elif plaintext == '"':
+                string = [line, len(token), [plaintext]]
+
+        if string is not None:
+            self.strings.append((string[0], string[1], "".join(string[2])))
+        if line_text or line > 1:
+            self.lines.append((line, line_size, "".join(line_text)))
+
+    @property
+    def ram_size(self):
+        """
+        The bytes of RAM the program takes on the calculator, as the
+        memory management menu shows it.
+        """
+        return self.size + SizeReport.RAM_OVERHEAD + len(self.name[:8])
+
+    @property
+    def file_size(self):
+        """
+        The size of the program's .8Xp file.
+        """
+        return self.size + SizeReport.FILE_OVERHEAD
+
+    def largest_lines(self, count=5):
+        """
+        Returns the biggest lines as (line, bytes, plaintext), biggest first.
+        """
+        return sorted(
+            (line for line in self.lines if line[1]),
+            key=lambda line: (-line[1], line[0]))[:count]
+
+    def largest_strings(self, count=5):
+        """
+        Returns the biggest string literals as (line, bytes, plaintext),
+        biggest first.
+        """
+        return sorted(self.strings, key=lambda string: (-string[1], string[0]))[:count]
+
+    def check(self, budget):
+        """
+        Raises a BudgetError if the program takes more than budget bytes of RAM.
+        """
+        if budget is not None and self.ram_size > budget:
+            raise BudgetError(self, budget)
+
+    def __str__(self):
+        report = ["{0}: {1} bytes of tokens, {2} bytes of RAM, {3} byte .8Xp file".format(
+            self.name, self.size, self.ram_size, self.file_size)]
+
+        if self.lines:
+            report.append("  largest lines (line: bytes):")
+            for line, size, text in self.largest_lines():
+                report.append("    {0:>5}: {1:>5}  {2}".format(line, size, text))
+
+        if self.strings:
+            report.append("  largest strings (line: bytes):")
+            for line, size, text in self.largest_strings():
+                report.append("    {0:>5}: {1:>5}  {2}".format(line, size, text))
+
+        return "\n".join(report)
+
 class PrgmCompiler(object):
 
     """
@@ -8,13 +327,26 @@ class PrgmCompiler(object):
     program files
     """
 
-    def compile(self, raw_text=None):
+    def __init__(self, model=None, line_cache=None):
+        """
+        Parameters:
+            string model: The calculator model whose tokens to use,
+                defaults to the TI-83
+            LineCache line_cache: Optional cache of decompiled lines, for
+                decompiling many programs that share lines
+        """
+        self.table = get_table(model)
+        self.line_cache = line_cache
+
+    def compile(self, raw_text=None, diagnostics=None):
         """
         Compiles to 8Xp format. This logic works, but the TIFile class is
         incomplete so the file may not work properly on the TI calculator.
 
         Parameters:
             Array[string]
+            Diagnostics diagnostics: Collects text that can't be compiled,
+                raising at the first problem by default
         Returns:
             TIFile
         """
@@ -24,41 +356,66 @@ class PrgmCompiler(object):
         # as a static method or not.
         # FIXME
         if not isinstance(self, PrgmCompiler):
+            if raw_text is not None:
+                diagnostics = raw_text
             raw_text = self
 
+        if diagnostics is None:
+            diagnostics = Diagnostics('raise')
+
+        compiler = self if isinstance(self, PrgmCompiler) else PrgmCompiler()
         tifile = TIPrgmFile()
         tifile.prgmdata = []
-        tokens = get_inverse_tokens()
+        trie = compiler.table.get_trie()
         prgm_string = "".join(raw_text)
-        longest_prgm_string = max(len(k) for k in tokens.keys())
+        prgm_len = len(prgm_string)
+
+        # Where in the text the last problem was found, so the line count
+        # only needs to be brought up to date from there
+        scanned = 0
+        line = 1
 
         current_char = 0
-        while current_char < len(prgm_string):
-            found = False
-            chars_further = longest_prgm_string
-            # Greedily start with the maximum size string we have and back
-            # down until we get to something that we can create a token from.
-            while not found and chars_further > 0:
-                try:
-                    token = tokens[prgm_string[current_char:current_char+chars_further]]
-                    found = True
-                    tifile.prgmdata.append(token)
-                    current_char += chars_further
-                except:
-                    chars_further -= 1
+        while current_char < prgm_len:
+            # Greedily walk down the trie as far as the text allows, keeping
+            # the longest string we passed that we can create a token from.
+            node = trie
+            token = None
+            next_char = current_char
+            while next_char < prgm_len:
+                node = node.get(prgm_string[next_char])
+                if node is None:
+                    break
+                next_char += 1
+                if None in node:
+                    token = node[None]
+                    token_end = next_char
 
-                if chars_further <= 0:
-                    raise Exception("Something went horribly wrong while compiling.")
+            if token is None:
+                line += prgm_string.count("\n", scanned, current_char)
+                scanned = current_char
+                column = current_char - prgm_string.rfind("\n", 0, current_char)
+                placeholder = diagnostics.record(
+                    current_char, prgm_string[current_char], line, column)
+                if placeholder is not None:
+                    tifile.prgmdata.append(compiler.table.get_inverse_tokens()[placeholder])
+                current_char += 1
+                continue
+
+            tifile.prgmdata.append(token)
+            current_char = token_end
 
         return tifile
 
 
-    def decompile(self, tifile=None):
+    def decompile(self, tifile=None, diagnostics=None):
         """
         Decompiles to plaintext.
 
         Parameters:
             TIFile tifile: An open ti file to decompile
+            Diagnostics diagnostics: Collects bytes that can't be decoded,
+                which are skipped by default
         Returns:
             Array[string]
         """
@@ -69,43 +426,259 @@ class PrgmCompiler(object):
         # as a static method or not.
         # FIXME
         if not isinstance(self, PrgmCompiler):
+            if tifile is not None:
+                diagnostics = tifile
             tifile = self
 
-        prgm_data = tifile.prgmdata
+        if diagnostics is None:
+            diagnostics = Diagnostics('skip')
+
+        compiler = self if isinstance(self, PrgmCompiler) else PrgmCompiler()
+        if compiler.line_cache is None:
+            plaintext = compiler._decode(tifile.prgmdata, diagnostics)
+        else:
+            plaintext = compiler._decode_cached(tifile.prgmdata, diagnostics)
+
+        return plaintext.split("\n")
+
+    def _decode(self, prgm_data, diagnostics):
+        """
+        Decodes program data to a single string of plaintext.
+        """
         plaintext = []
-        tokens = get_tokens()
 
-        byte_num = 0
-        # Iterate until we hit the end of the program data
-        while byte_num < len(prgm_data):
+        # How much of the plaintext had been looked at when the last problem
+        # was found, so the position only needs to be brought up to date
+        # from there
+        scanned = 0
+        line = 1
+        column = 0
 
-            curr_byte = prgm_data[byte_num]
-            found_plaintext = ''
+        for offset, token, found_plaintext in self.tokenize(prgm_data):
+            # Hand anything we can't decode to the diagnostics, but do the rest.
+            if found_plaintext is None:
+                for piece in plaintext[scanned:]:
+                    newlines = piece.count("\n")
+                    if newlines:
+                        line += newlines
+                        column = len(piece) - piece.rfind("\n") - 1
+                    else:
+                        column += len(piece)
+                scanned = len(plaintext)
 
-            # If the current byte exists in the tokens, see if we
-            # can find a more specific one (2 bytes) that matches. If not, use
-            # the first. We only need to worry about up to 2 bytes.
-            if curr_byte in tokens.keys():
+                found_plaintext = diagnostics.record(offset, token, line, column + 1)
+                if found_plaintext is None:
+                    continue
+
+            plaintext.append(found_plaintext)
+
+        return "".join(plaintext)
+
+    def _decode_cached(self, prgm_data, diagnostics):
+        """
+        Decodes program data to a single string of plaintext a line at a
+        time, looking each line up in the line cache first. Lines with
+        problems in them are never cached, so the diagnostics come out the
+        same as without the cache.
+        """
+        prgm_data = _as_bytes(prgm_data)
+        view = memoryview(prgm_data)
+        cache = self.line_cache
+        plaintext = []
+        lines_before = 0
+
+        starts = [0] + self.split_lines(prgm_data, 1)
+        ends = starts[1:] + [len(prgm_data)]
+        for start, end in zip(starts, ends):
+            line_data = view[start:end]
+            text = cache.get(line_data)
+            if text is None:
+                found = Diagnostics(diagnostics.policy)
                 try:
-                    found_plaintext = tokens[curr_byte + prgm_data[byte_num+1]]
-                    byte_num += 2
-                except:
-                    found_plaintext = tokens[curr_byte]
-                    byte_num += 1
+                    text = self._decode(line_data, found)
+                except TokenError:
+                    text = ""
+
+                if not found:
+                    cache.put(line_data, text)
+
+                # Each line after the first starts right after a newline,
+                # so only the line of a problem needs to move.
+                for diagnostic in found:
+                    diagnostics.record(
+                        start + diagnostic.offset,
+                        diagnostic.value,
+                        lines_before + diagnostic.line,
+                        diagnostic.column
+                        )
+
+            plaintext.append(text)
+            lines_before += text.count("\n")
+
+        return "".join(plaintext)
 
-                plaintext.append(found_plaintext)
+    def decompile_parallel(self, tifile, diagnostics=None, workers=None, chunk_size=1 << 16):
+        """
+        Decompiles to plaintext like decompile, but splits the program data
+        at newlines into chunks that are decompiled by a pool of processes.
+        The result, and anything recorded in the diagnostics, is the same
+        as with decompile. Programs too short to be worth splitting are
+        decompiled in this process.
+
+        Parameters:
+            TIFile tifile: An open ti file to decompile
+            Diagnostics diagnostics: Collects bytes that can't be decoded,
+                which are skipped by default
+            int workers: The number of processes, defaults to the CPU count
+            int chunk_size: Roughly how many bytes to hand each process
+        Returns:
+            Array[string]
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        if diagnostics is None:
+            diagnostics = Diagnostics('skip')
+
+        prgm_data = _as_bytes(tifile.prgmdata)
+        boundaries = self.split_lines(prgm_data, chunk_size)
+        if len(boundaries) < 2:
+            return self.decompile(tifile, diagnostics)
+
+        starts = [0] + boundaries
+        ends = boundaries + [len(prgm_data)]
+        jobs = [
+            (self.table.name, diagnostics.policy, prgm_data[start:end])
+            for start, end in zip(starts, ends)
+            ]
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_decompile_chunk, jobs))
+
+        # Stitch the chunks back together in order, moving what was found in
+        # each chunk to where it sits in the whole program. Every chunk after
+        # the first starts a line, so only the line needs to move.
+        plaintext = []
+        lines_before = 0
+        for start, (text, found) in zip(starts, results):
+            for offset, value, line, column in found:
+                diagnostics.record(start + offset, value, lines_before + line, column)
+            plaintext.append(text)
+            lines_before += text.count("\n")
+
+        return "".join(plaintext).split("\n")
+
+    def split_lines(self, prgm_data, chunk_size):
+        """
+        Finds where program data can be split into chunks of whole lines.
+        A chunk starts right after a newline token, and a newline byte is
+        only used if it can't be the second byte of a two byte token, so
+        each chunk decompiles exactly as it would as part of the whole.
+
+        Parameters:
+            bytes prgm_data: The program data
+            int chunk_size: The smallest size of a chunk, in bytes
+        Returns:
+            Array[int]: The offsets the chunks after the first start at
+        """
+        single, double = self.table.get_dispatch()
+        boundaries = []
+        data_len = len(prgm_data)
+
+        position = prgm_data.find(NEWLINE, chunk_size - 1)
+        while position != -1 and position + 1 < data_len:
+            page = double[prgm_data[position-1]] if position > 0 else None
+            # A newline after a byte that leads a two byte token ending in
+            # the newline byte is ambiguous, so look for the next one.
+            if page is not None and NEWLINE in page:
+                position = prgm_data.find(NEWLINE, position + 1)
                 continue
 
-            # If the current byte is not in the tokens, see if we can add
-            # on the next byte to make it work. If so, use that, otherwise
-            # spit out an error but do the rest.
-            if curr_byte not in tokens.keys():
-                try:
-                    found_plaintext = tokens[curr_byte + prgm_data[byte_num+1]]
-                    plaintext.append(found_plaintext)
+            boundaries.append(position + 1)
+            position = prgm_data.find(NEWLINE, position + chunk_size)
+
+        return boundaries
+
+    def size_report(self, prgm_data, name="PROGRAM"):
+        """
+        Reports what a compiled program costs, see SizeReport.
+
+        Parameters:
+            bytes prgm_data: The program data, as bytes or a list of bytes
+            string name: The name of the program
+        Returns:
+            SizeReport
+        """
+        return SizeReport(name, self.tokenize(prgm_data))
+
+    def tokenize(self, prgm_data):
+        """
+        Splits program data into its tokens without building any
+        plaintext. Bytes that can't be decoded are returned as a single
+        byte token with no plaintext.
+
+        Parameters:
+            bytes prgm_data: The program data, as bytes or a list of bytes
+        Returns:
+            Generator[(int, bytes, string)]: offset, token bytes and plaintext
+        """
+        prgm_data = _as_bytes(prgm_data)
+        single, double = self.table.get_dispatch()
+        data_len = len(prgm_data)
+
+        byte_num = 0
+        # Iterate until we hit the end of the program data
+        while byte_num < data_len:
+            lead = prgm_data[byte_num]
+            page = double[lead]
+            # If the current byte leads any two byte tokens, see if the next
+            # byte makes one of them. If not, use the current byte alone.
+            # We only need to worry about up to 2 bytes.
+            if page is not None and byte_num + 1 < data_len:
+                found_plaintext = page.get(prgm_data[byte_num+1])
+                if found_plaintext is not None:
+                    yield byte_num, prgm_data[byte_num:byte_num+2], found_plaintext
                     byte_num += 2
-                except:
-                    print("Could not decode " + str(curr_byte))
-                    byte_num += 1
+                    continue
 
-        return "".join(plaintext).split("\n")
+            yield byte_num, prgm_data[byte_num:byte_num+1], single[lead]
+            byte_num += 1
+
+def _as_bytes(prgm_data):
+    """
+    Returns program data, which may be a list of bytes or a view, as bytes.
+    """
+    if isinstance(prgm_data, bytes):
+        return prgm_data
+    if isinstance(prgm_data, list):
+        return b"".join(prgm_data)
+    return bytes(prgm_data)
+
+# A compiler per model for each process of decompile_parallel
+_chunk_compilers = dict()
+
+def _decompile_chunk(job):
+    """
+    Decompiles one chunk for decompile_parallel, in a worker process.
+
+    Returns:
+        (string, Array[tuple]): The plaintext of the chunk, and the offset,
+            value, line and column of each problem found in it
+    """
+    model, policy, chunk = job
+
+    compiler = _chunk_compilers.get(model)
+    if compiler is None:
+        compiler = _chunk_compilers[model] = PrgmCompiler(model)
+
+    chunk_file = TIPrgmFile()
+    chunk_file.prgmdata = chunk
+    diagnostics = Diagnostics(policy)
+    try:
+        text = "\n".join(compiler.decompile(chunk_file, diagnostics))
+    except TokenError:
+        # The first problem is raised again once the chunks are stitched
+        # back together, so what was decompiled doesn't matter.
+        text = ""
+
+    found = [(d.offset, d.value, d.line, d.column) for d in diagnostics]
+    return text, found
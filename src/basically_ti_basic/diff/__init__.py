@@ -0,0 +1,539 @@
+"""
+description: Compares compiled programs token by token, straight from their
+    program data, and builds binary patches that turn one program into
+    another without decompiling either.
+
+    Programs are first compared line by line, with each distinct line
+    reduced to a number, and only the lines that changed are compared
+    token by token. Both passes use Myers' linear space diff, so memory
+    stays proportional to the size of the programs.
+
+    A patch is
+
+        TIDP, a version byte
+        the length and crc32 of the old program data
+        the length and crc32 of the new program data
+        operations, each one of
+            0x01 skip copy   copy bytes of the old program data, starting
+                             skip bytes after the end of the last copy
+            0x02 size bytes  insert new bytes
+
+    with every number but the checksums stored as a variable length integer.
+"""
+from basically_ti_basic.compiler import PrgmCompiler, NEWLINE
+import struct
+import zlib
+
+PATCH_MAGIC = b"TIDP"
+PATCH_VERSION = 1
+
+# How far the search for a shortest edit script goes before settling for
+# a good one instead, which keeps very different programs quick to compare
+MAX_COST = 256
+
+# Changed lines are only compared token by token if there are at most this
+# many tokens on each side, bigger rewrites are replaced whole
+MAX_REFINE = 4096
+
+# Matching runs shorter than this are cheaper to insert than to copy
+MIN_COPY = 4
+
+_COPY = 0x01
+_INSERT = 0x02
+
+class PatchError(Exception):
+
+    """
+    Raised when a patch is damaged or doesn't belong to the program it's
+    applied to.
+    """
+
+class PrgmDiffer(object):
+
+    """
+    Compares the program data of compiled programs at the boundaries of
+    their tokens.
+    """
+
+    def __init__(self, model=None):
+        """
+        Parameters:
+            string model: The calculator model whose tokens to use
+        """
+        self._compiler = PrgmCompiler(model)
+
+    def tokens(self, prgm_data):
+        """
+        Splits program data into its tokens.
+
+        Parameters:
+            bytes prgm_data: The program data
+        Returns:
+            Array[bytes]: The bytes of each token, in order
+        """
+        return [token for offset, token, text in self._compiler.tokenize(prgm_data)]
+
+    def diff(self, old_data, new_data):
+        """
+        Compares the tokens of two programs.
+
+        Parameters:
+            bytes old_data: The old program data
+            bytes new_data: The new program data
+        Returns:
+            Array[(string, int, int, int, int)]: How to turn the old tokens
+                into the new ones, as difflib.SequenceMatcher.get_opcodes
+                describes them, indexed by token
+        """
+        old_tokens = self.tokens(old_data)
+        new_tokens = self.tokens(new_data)
+        return self._diff_tokens(old_tokens, new_tokens)
+
+    def changes(self, old_data, new_data):
+        """
+        Compares the tokens of two programs, as plaintext.
+
+        Parameters:
+            bytes old_data: The old program data
+            bytes new_data: The new program data
+        Returns:
+            Array[(string, string, string)]: For each change, its tag
+                ('replace', 'delete' or 'insert'), the old plaintext and
+                the new plaintext
+        """
+        old_tokens = self.tokens(old_data)
+        new_tokens = self.tokens(new_data)
+
+        changes = []
+        for tag, i1, i2, j1, j2 in self._diff_tokens(old_tokens, new_tokens):
+            if tag != 'equal':
+                changes.append(
+                    (tag, self._text(old_tokens[i1:i2]), self._text(new_tokens[j1:j2])))
+        return changes
+
+    def make_patch(self, old_data, new_data):
+        """
+        Builds a patch that turns one program into another. Changes are
+        found at token boundaries, so a patch never splits a token.
+
+        Parameters:
+            bytes old_data: The old program data
+            bytes new_data: The new program data
+        Returns:
+            bytes: The patch
+        """
+        old_data = bytes(old_data)
+        new_data = bytes(new_data)
+        old_tokens = self.tokens(old_data)
+        new_tokens = self.tokens(new_data)
+        old_offsets = _offsets(old_tokens)
+        new_offsets = _offsets(new_tokens)
+
+        patch = bytearray(PATCH_MAGIC)
+        patch.append(PATCH_VERSION)
+        _put_varint(patch, len(old_data))
+        patch += zlib.crc32(old_data).to_bytes(4, 'little')
+        _put_varint(patch, len(new_data))
+        patch += zlib.crc32(new_data).to_bytes(4, 'little')
+
+        # Each run of the new program is copied from the old one or
+        # inserted, and runs too short to be worth a copy are inserted
+        runs = []
+        for tag, i1, i2, j1, j2 in self._diff_tokens(old_tokens, new_tokens):
+            new_start, new_end = new_offsets[j1], new_offsets[j2]
+            if tag == 'equal' and new_end - new_start >= MIN_COPY:
+                runs.append([_COPY, old_offsets[i1], new_start, new_end])
+            elif new_start == new_end:
+                continue
+            elif runs and runs[-1][0] == _INSERT:
+                runs[-1][3] = new_end
+            else:
+                runs.append([_INSERT, None, new_start, new_end])
+
+        copied_to = 0
+        for op, old_start, new_start, new_end in runs:
+            patch.append(op)
+            if op == _COPY:
+                _put_varint(patch, old_start - copied_to)
+                _put_varint(patch, new_end - new_start)
+                copied_to = old_start + new_end - new_start
+            else:
+                _put_varint(patch, new_end - new_start)
+                patch += new_data[new_start:new_end]
+
+        return bytes(patch)
+
+    def diff_files(self, old_file, new_file):
+        """
+        Compares the tokens of two .8Xp files, as plaintext.
+
+        Returns:
+            Array[(string, string, string)]: See changes
+        """
+        return self.changes(read_program(old_file), read_program(new_file))
+
+    def _diff_tokens(self, old_tokens, new_tokens):
+        """
+        Compares two lists of tokens, first line by line and then token by
+        token within the lines that changed.
+        """
+        old_lines = _lines(old_tokens)
+        new_lines = _lines(new_tokens)
+
+        # Each distinct line becomes a number, which is quicker to compare
+        ids = dict()
+        old_ids = [ids.setdefault(line, len(ids)) for line in _line_keys(old_tokens, old_lines)]
+        new_ids = [ids.setdefault(line, len(ids)) for line in _line_keys(new_tokens, new_lines)]
+
+        blocks = []
+        for tag, i1, i2, j1, j2 in _opcodes(old_ids, new_ids):
+            old_start, old_end = old_lines[i1], old_lines[i2]
+            new_start, new_end = new_lines[j1], new_lines[j2]
+            if tag == 'equal':
+                blocks.append((old_start, new_start, old_end - old_start))
+                continue
+
+            if old_end - old_start > MAX_REFINE or new_end - new_start > MAX_REFINE:
+                continue
+
+            for i, j, size in _matching_blocks(
+                    old_tokens[old_start:old_end], new_tokens[new_start:new_end]):
+                blocks.append((old_start + i, new_start + j, size))
+
+        return _blocks_to_opcodes(blocks, len(old_tokens), len(new_tokens))
+
+    def _text(self, tokens):
+        """
+        Returns the plaintext of a list of tokens, with a placeholder for
+        any that aren't in the token table.
+        """
+        table = self._compiler.table.get_tokens()
+        return "".join(
+            table.get(token, "[?" + token.hex().upper() + "]") for token in tokens)
+
+def apply_patch(old_data, patch):
+    """
+    Applies a patch to program data. This only copies bytes, it doesn't
+    need to know anything about tokens.
+
+    Parameters:
+        bytes old_data: The program data the patch was made against
+        bytes patch: The patch
+    Returns:
+        bytes: The new program data
+    """
+    old_data = bytes(old_data)
+    patch = bytes(patch)
+
+    if patch[:4] != PATCH_MAGIC:
+        raise PatchError("Not a patch.")
+    if len(patch) < 5 or patch[4] != PATCH_VERSION:
+        raise PatchError("Unsupported patch version.")
+
+    try:
+        position = 5
+        old_length, position = _get_varint(patch, position)
+        old_crc = int.from_bytes(patch[position:position + 4], 'little')
+        new_length, position = _get_varint(patch, position + 4)
+        new_crc = int.from_bytes(patch[position:position + 4], 'little')
+        position += 4
+
+        if old_length != len(old_data) or old_crc != zlib.crc32(old_data):
+            raise PatchError("The patch was made against a different program.")
+
+        new_data = bytearray()
+        copied_to = 0
+        while position < len(patch):
+            op = patch[position]
+            if op == _COPY:
+                skip, position = _get_varint(patch, position + 1)
+                size, position = _get_varint(patch, position)
+                start = copied_to + skip
+                new_data += old_data[start:start + size]
+                copied_to = start + size
+            elif op == _INSERT:
+                size, position = _get_varint(patch, position + 1)
+                new_data += patch[position:position + size]
+                position += size
+            else:
+                raise PatchError("Unknown patch operation " + hex(op) + ".")
+    except IndexError:
+        raise PatchError("The patch is truncated.")
+
+    if len(new_data) != new_length or zlib.crc32(new_data) != new_crc:
+        raise PatchError("The patched program doesn't match the patch's checksum.")
+
+    return bytes(new_data)
+
+def patch_file(old_file, patch, new_file):
+    """
+    Applies a patch to a .8Xp file and writes the result as a new .8Xp file.
+    The new file keeps the header of the old one (its name, comment and
+    flags) with the sizes and checksum brought up to date.
+
+    Parameters:
+        string old_file: The .8Xp file the patch was made against
+        bytes patch: The patch
+        string new_file: The .8Xp file to write
+    """
+    from basically_ti_basic.files import TIPrgmHeader
+
+    with open(old_file, "rb") as inStream:
+        raw = inStream.read()
+
+    header = TIPrgmHeader(raw)
+    start, end = header.programSpan(len(raw))
+    new_data = apply_patch(raw[start:end], patch)
+
+    variable_header = header.variableHeaderLength
+    data_length = len(new_data) + 2
+    if data_length > 0xFFFF:
+        raise PatchError("The patched program is too big for a .8Xp file.")
+
+    contents = bytearray(raw[:start]) + new_data
+    # Sizes can only be brought up to date in a header that has them
+    # where they're expected
+    if header.isConsistent(len(raw)):
+        # The data length sits in the variable header and again before the data
+        struct.pack_into('<H', contents, 57, data_length)
+        struct.pack_into('<H', contents, 57 + variable_header, data_length)
+        struct.pack_into('<H', contents, 59 + variable_header, len(new_data))
+        struct.pack_into('<H', contents, 53, len(contents) - 55)
+    contents += struct.pack('<H', sum(contents[55:]) & 0xFFFF)
+
+    with open(new_file, "wb") as outFile:
+        outFile.write(contents)
+
+def read_program(filename):
+    """
+    Reads the program data of a .8Xp file.
+
+    Parameters:
+        string filename: The .8Xp file
+    Returns:
+        bytes: The program data
+    """
+    from basically_ti_basic.files import TIPrgmHeader
+
+    with open(filename, "rb") as inStream:
+        raw = inStream.read()
+
+    start, end = TIPrgmHeader(raw).programSpan(len(raw))
+    return raw[start:end]
+
+def _offsets(tokens):
+    """
+    Returns the byte offset of each token, and of the end of the last one.
+    """
+    offsets = [0]
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+    return offsets
+
+def _lines(tokens):
+    """
+    Returns the index of the first token of each line, and the number of
+    tokens.
+    """
+    newline = bytes((NEWLINE,))
+    starts = [0]
+    for index, token in enumerate(tokens):
+        if token == newline:
+            starts.append(index + 1)
+    if starts[-1] != len(tokens):
+        starts.append(len(tokens))
+    return starts
+
+def _line_keys(tokens, starts):
+    """
+    Returns the bytes of each line. Decoding starts over after every
+    newline, so lines with the same bytes have the same tokens.
+    """
+    return [b"".join(tokens[start:end]) for start, end in zip(starts, starts[1:])]
+
+def _opcodes(a, b):
+    """
+    Returns the opcodes of the shortest edit script between two sequences.
+    """
+    return _blocks_to_opcodes(_matching_blocks(a, b), len(a), len(b))
+
+def _blocks_to_opcodes(blocks, a_len, b_len):
+    """
+    Turns runs of matching elements into difflib style opcodes.
+    """
+    opcodes = []
+    i = j = 0
+    for a_start, b_start, size in blocks + [(a_len, b_len, 0)]:
+        if i < a_start and j < b_start:
+            opcodes.append(('replace', i, a_start, j, b_start))
+        elif i < a_start:
+            opcodes.append(('delete', i, a_start, j, j))
+        elif j < b_start:
+            opcodes.append(('insert', i, i, j, b_start))
+
+        if size:
+            if opcodes and opcodes[-1][0] == 'equal':
+                opcodes[-1] = ('equal', opcodes[-1][1], a_start + size, opcodes[-1][3], b_start + size)
+            else:
+                opcodes.append(('equal', a_start, a_start + size, b_start, b_start + size))
+        i, j = a_start + size, b_start + size
+
+    return opcodes
+
+def _matching_blocks(a, b):
+    """
+    Finds the longest common subsequence of two sequences with Myers'
+    divide and conquer algorithm, which needs memory linear in their
+    length.
+
+    Returns:
+        Array[(int, int, int)]: The runs of matching elements, as the index
+            in a, the index in b and the length of the run, in order
+    """
+    matches = []
+    pending = [(0, len(a), 0, len(b))]
+    while pending:
+        a_lo, a_hi, b_lo, b_hi = pending.pop()
+
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            matches.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            matches.append((a_hi, b_hi))
+
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+
+        split = _middle_snake(a, b, a_lo, a_hi, b_lo, b_hi)
+        if split is None:
+            continue
+
+        x, y = split
+        pending.append((a_lo, x, b_lo, y))
+        pending.append((x, a_hi, y, b_hi))
+
+    matches.sort()
+
+    blocks = []
+    for i, j in matches:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([i, j, 1])
+
+    return [tuple(block) for block in blocks]
+
+def _middle_snake(a, b, a_lo, a_hi, b_lo, b_hi):
+    """
+    Runs Myers' search from both ends of two ranges at once until the paths
+    meet, and returns the point they meet at, which is on a shortest edit
+    script between them. Returns None if the ranges have nothing in common.
+
+    After MAX_COST steps it gives up on finding the shortest script and
+    returns the furthest point the front search got to instead.
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    delta = n - m
+    odd = delta % 2 != 0
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    length = 2 * max_d + 3
+
+    # The furthest x reached on each diagonal, from the front and the back
+    forward = [-1] * length
+    backward = [-1] * length
+    forward[offset + 1] = 0
+    backward[offset + 1] = 0
+
+    # Diagonals that ran off the edge of the grid aren't searched again
+    forward_start = forward_end = backward_start = backward_end = 0
+
+    for d in range(max_d + 1):
+        for k in range(-d + forward_start, d + 1 - forward_end, 2):
+            index = offset + k
+            if k == -d or (k != d and forward[index - 1] < forward[index + 1]):
+                x = forward[index + 1]
+            else:
+                x = forward[index - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[index] = x
+
+            if x > n:
+                forward_end += 2
+            elif y > m:
+                forward_start += 2
+            elif odd:
+                other = offset + delta - k
+                if 0 <= other < length and backward[other] != -1:
+                    if x >= n - backward[other]:
+                        return a_lo + x, b_lo + y
+
+        for k in range(-d + backward_start, d + 1 - backward_end, 2):
+            index = offset + k
+            if k == -d or (k != d and backward[index - 1] < backward[index + 1]):
+                x = backward[index + 1]
+            else:
+                x = backward[index - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_hi - x - 1] == b[b_hi - y - 1]:
+                x += 1
+                y += 1
+            backward[index] = x
+
+            if x > n:
+                backward_end += 2
+            elif y > m:
+                backward_start += 2
+            elif not odd:
+                other = offset + delta - k
+                if 0 <= other < length and forward[other] != -1:
+                    forward_x = forward[other]
+                    forward_y = forward_x - (other - offset)
+                    if forward_x >= n - x:
+                        return a_lo + forward_x, b_lo + forward_y
+
+        if d >= MAX_COST:
+            best = None
+            for k in range(-d, d + 1, 2):
+                x = forward[offset + k]
+                y = x - k
+                if 0 <= x <= n and 0 <= y <= m and (best is None or x + y > sum(best)):
+                    best = (x, y)
+            if best is None or best == (n, m):
+                return None
+            return a_lo + best[0], b_lo + best[1]
+
+    return None
+
+def _put_varint(buffer, value):
+    """
+    Appends an unsigned number to a bytearray, seven bits to a byte.
+    """
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def _get_varint(buffer, position):
+    """
+    Reads an unsigned number written by _put_varint.
+
+    Returns:
+        (int, int): The number and the position after it
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
@@ -9,13 +9,399 @@ TODO:
     figure out why when reading the file, the first byte
     goes missing
 """
+import mmap
+import struct
+
+# Single byte objects for every value, shared between all of the lists
+# of bytes built from a file
+_BYTES = [bytes((i,)) for i in range(256)]
+
+class TIPrgmHeader(object):
+    """
+    A lazily parsed view over the header of a .8Xp file. Fields are only
+    decoded from the underlying buffer when they are accessed, so building
+    one costs nothing more than reading the first SIZE bytes of the file.
+
+    The layout follows the TI-83+ link protocol guide:
+
+        0   8   signature, **TI83F*
+        8   3   further signature bytes, [SUB][NEWLINE][NUL]
+        11  42  comment
+        53  2   length of the data section
+        55  2   length of the variable header (11 or 13)
+        57  2   length of the variable data
+        59  1   variable type
+        60  8   variable name
+        68  1   version (only with a 13 byte variable header)
+        69  1   flags (only with a 13 byte variable header)
+        +0  2   length of the variable data, again
+        +2  2   length of the program tokens
+    """
+    __slots__=('_buffer',)
+
+    # The number of bytes needed to parse every field of the header
+    SIZE = 74
+
+    # Variable type ids that show up in .8X? files
+    TYPES = {
+        0x00: 'Real',
+        0x01: 'List',
+        0x02: 'Matrix',
+        0x03: 'Equation',
+        0x04: 'String',
+        0x05: 'Program',
+        0x06: 'Protected Program',
+        0x07: 'Picture',
+        0x08: 'GDB',
+        0x0C: 'Complex',
+        0x0D: 'Complex List',
+        0x15: 'AppVar',
+        0x17: 'Group',
+        }
+
+    def __init__(self, buffer):
+        """
+        Wraps a buffer holding (at least) the start of a .8Xp file
+
+        Arguments:
+            buffer (bytes): the first bytes of a .8Xp file
+        """
+        if len(buffer) < TIPrgmHeader.SIZE:
+            raise RuntimeError("File is too short to be a .8xp file.")
+
+        self._buffer = bytes(buffer[:TIPrgmHeader.SIZE])
+
+    @classmethod
+    def fromFile(cls, filename):
+        """
+        Reads only the header of a .8xp file, leaving the program data
+        on disk
+
+        Arguments:
+            filename (str): the filename of a .8xp file to open, inc extension
+
+        Returns:
+            header (TIPrgmHeader): the parsed header
+        """
+        with open(filename, "rb") as inStream:
+            return cls(inStream.read(TIPrgmHeader.SIZE))
+
+    def _word(self, offset):
+        # A variable header length other than 11 or 13 can put a field
+        # past the end of the header
+        if offset + 2 > len(self._buffer):
+            raise RuntimeError("The header has a field past its end, at offset " + str(offset) + ".")
+        return struct.unpack_from('<H', self._buffer, offset)[0]
+
+    @property
+    def signature(self):
+        """ The file signature, **TI83F* for a valid file """
+        return self._buffer[:8].decode('ascii', 'replace')
+
+    @property
+    def comment(self):
+        """ The comment, with the NUL padding removed """
+        return self._buffer[11:53].split(b'\x00')[0].decode('ascii', 'replace')
+
+    @property
+    def dataLength(self):
+        """ The length of the data section following the file header """
+        return self._word(53)
+
+    @property
+    def variableHeaderLength(self):
+        """ The length of the variable header, 11 or 13 bytes """
+        return self._word(55)
+
+    @property
+    def variableDataLength(self):
+        """ The length of the variable data, including its size word """
+        return self._word(57)
+
+    @property
+    def typeId(self):
+        """ The numeric variable type """
+        return self._buffer[59]
+
+    @property
+    def type(self):
+        """ The name of the variable type """
+        return TIPrgmHeader.TYPES.get(self.typeId, 'Unknown')
+
+    @property
+    def name(self):
+        """ The variable name, with the NUL padding removed """
+        return self._buffer[60:68].split(b'\x00')[0].decode('ascii', 'replace')
+
+    @property
+    def version(self):
+        """ The variable version, 0 if the header does not carry one """
+        if self.variableHeaderLength < 13:
+            return 0
+        return self._buffer[68]
+
+    @property
+    def flags(self):
+        """ The variable flags, 0 if the header does not carry them """
+        if self.variableHeaderLength < 13:
+            return 0
+        return self._buffer[69]
+
+    @property
+    def archived(self):
+        """ Whether the variable is flagged as archived """
+        return bool(self.flags & 0x80)
+
+    @property
+    def programLength(self):
+        """ The number of bytes of program tokens """
+        return self._word(59 + self.variableHeaderLength)
+
+    @property
+    def dataOffset(self):
+        """ The offset into the file at which the program tokens start """
+        return 61 + self.variableHeaderLength
+
+    def isConsistent(self, fileSize):
+        """
+        Checks that the header describes a file of the given size: a valid
+        signature, an 11 or 13 byte variable header and program tokens that
+        fit ahead of the checksum. The headers written by
+        TIPrgmFile.writeOut aren't, their fields don't line up.
+
+        Arguments:
+            fileSize (int): the size of the whole file
+        Returns:
+            consistent (boolean): whether the header can be trusted
+        """
+        return self.isValid() and \
+            self.variableHeaderLength in (11, 13) and \
+            self.dataOffset + self.programLength <= fileSize - 2
+
+    def programSpan(self, fileSize):
+        """
+        Finds the program tokens of a file. They're where the header says
+        if it's consistent with the file, otherwise they're taken to run
+        from SIZE up to the two byte checksum.
+
+        Arguments:
+            fileSize (int): the size of the whole file
+        Returns:
+            span (tuple): the offsets the tokens start and end at
+        """
+        if self.isConsistent(fileSize):
+            return self.dataOffset, self.dataOffset + self.programLength
+
+        return TIPrgmHeader.SIZE, max(TIPrgmHeader.SIZE, fileSize - 2)
+
+    def isValid(self):
+        """
+        Checks the signature bytes of the header
+
+        Returns:
+            valid (boolean): a boolean value indicating if the header is valid
+        """
+        return self._buffer[:11] == b'**TI83F*\x1a\n\x00'
+
+    def __str__(self):
+        """
+        Returns a string representation of the header, with a ? for the
+        length if the header doesn't say where it is
+        """
+        length = "?"
+        if self.isValid() and self.variableHeaderLength in (11, 13):
+            length = self.programLength
+        return "{0} {1} ({2} bytes)".format(self.type, self.name, length)
+
+
+class TIVarEntry(object):
+    """
+    One variable in a TI variable file, such as a program in a group. The
+    data is a view into the file the entry was read from, so nothing is
+    copied until it's decompiled or written out.
+    """
+    __slots__=('offset', 'typeId', 'name', 'version', 'flags', 'data', 'dataOffset')
+
+    # Variable types whose data starts with a two byte length followed
+    # by program tokens
+    PROGRAM_TYPES = (0x05, 0x06)
+
+    def __init__(self, offset, typeId, name, version, flags, data, dataOffset):
+        self.offset = offset
+        self.typeId = typeId
+        self.name = name
+        self.version = version
+        self.flags = flags
+        self.data = data
+        self.dataOffset = dataOffset
+
+    @property
+    def type(self):
+        """ The name of the variable type """
+        return TIPrgmHeader.TYPES.get(self.typeId, 'Unknown')
+
+    @property
+    def archived(self):
+        """ Whether the variable is flagged as archived """
+        return bool(self.flags & 0x80)
+
+    @property
+    def prgmdata(self):
+        """
+        The program tokens of a program entry, as a view, so the entry can be
+        handed to PrgmCompiler.decompile like a TIPrgmFile. None for other
+        variable types.
+        """
+        if self.typeId not in TIVarEntry.PROGRAM_TYPES or len(self.data) < 2:
+            return None
+
+        size = struct.unpack_from('<H', self.data, 0)[0]
+        return self.data[2:2 + size]
+
+    def __str__(self):
+        """
+        Returns a string representation of the entry
+        """
+        return "{0} {1} ({2} bytes)".format(self.type, self.name, len(self.data))
+
+class TIVarContainer(object):
+    """
+    Reads the variables of a TI variable file that may hold many of them,
+    such as a .8Xg group (a .8Xp is a container holding one). Backups hold
+    an image of the calculator's memory rather than variables, and are
+    refused.
+    The file is memory mapped and its entries are found lazily as they're
+    iterated over, so only the parts that are used are ever read.
+
+    The views held by the entries are only valid while the container is
+    open; copy anything that needs to outlive it.
+    """
+
+    # Length of the file header, ahead of the first variable entry
+    HEADER_SIZE = 55
+
+    # Variable type of a backup's memory image, which has a nine byte
+    # variable header
+    BACKUP_TYPE = 0x13
+
+    def __init__(self, filename):
+        """
+        Maps a file into memory and checks its header
+
+        Arguments:
+            filename (str): the filename of the file to open, inc extension
+        """
+        self._file = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise RuntimeError("File is too short to be a TI variable file.")
+
+        self._view = memoryview(self._map)
+        if len(self._view) < TIVarContainer.HEADER_SIZE + 2 or \
+                self._view[:8] != b'**TI83F*':
+            self.close()
+            raise RuntimeError("File is not a TI variable file.")
+
+        try:
+            self.header = TIPrgmHeader(self._view[:TIPrgmHeader.SIZE])
+        except RuntimeError:
+            self.close()
+            raise
+
+        offset = TIVarContainer.HEADER_SIZE
+        if len(self._view) >= offset + 5 and \
+                struct.unpack_from('<H', self._view, offset)[0] == 9 and \
+                self._view[offset + 4] == TIVarContainer.BACKUP_TYPE:
+            self.close()
+            raise RuntimeError("File is a backup, which holds a memory image rather than variables.")
+
+    def entries(self):
+        """
+        Iterates over the variable entries of the file
+
+        Returns:
+            entries (generator): a TIVarEntry for each variable
+        """
+        view = self._view
+        offset = TIVarContainer.HEADER_SIZE
+        # The data section is followed by a two byte checksum
+        end = min(offset + self.header.dataLength, len(view) - 2)
+
+        while offset + 4 <= end:
+            headerLength, dataLength = struct.unpack_from('<HH', view, offset)
+            varHeader = offset + 2
+            dataStart = varHeader + headerLength + 2
+            if dataStart + dataLength > end or headerLength < 11:
+                raise RuntimeError(
+                    "Variable entry at offset " + str(offset) + " runs past the end of the file.")
+
+            name = bytes(view[varHeader + 3:varHeader + 11]).split(b'\x00')[0]
+            if headerLength >= 13:
+                version = view[varHeader + 11]
+                flags = view[varHeader + 12]
+            else:
+                version = 0
+                flags = 0
+
+            yield TIVarEntry(
+                offset,
+                view[varHeader + 2],
+                name.decode('ascii', 'replace'),
+                version,
+                flags,
+                view[dataStart:dataStart + dataLength],
+                dataStart
+                )
+
+            offset = dataStart + dataLength
+
+    def find(self, name):
+        """
+        Finds a variable by name, reading no further than it
+
+        Arguments:
+            name (str): the variable name
+        Returns:
+            entry (TIVarEntry): the variable, or None if there isn't one
+        """
+        for entry in self.entries():
+            if entry.name == name:
+                return entry
+
+        return None
+
+    def close(self):
+        """
+        Unmaps the file. If views into it are still being held on to, the
+        mapping is left for the garbage collector.
+        """
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __iter__(self):
+        return self.entries()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
 
 class TIPrgmFile(object):
     """
     Defines a data object to hold sections of a TI-Basic
     program file
     """
-    __slots__=('metadata', 'prgmdata', 'footer')
+    __slots__=('metadata', 'prgmdata', 'footer', 'header')
 
     def __init__(self, fname=None):
         """
@@ -33,10 +419,11 @@ class TIPrgmFile(object):
             self.metadata = None
             self.prgmdata = None
             self.footer = None
+            self.header = None
 
     def read(self, filename):
         """
-        Reads a TI-Basic .8xp file byte by byte
+        Reads a TI-Basic .8xp file
         and populates the fields of the data object that
         represents it
 
@@ -48,13 +435,21 @@ class TIPrgmFile(object):
 
         """
 
-        # Reads the file into an array of bytes
-        fileContents = []
+        # Reads the file into an array of bytes. The first byte isn't
+        # part of the array, see the TODO above.
         with open(filename, "rb") as inStream:
-            byte = inStream.read(1)
-            while byte:
-                byte = inStream.read(1)
-                fileContents.append(byte)
+            raw = inStream.read()
+
+        fileContents = [_BYTES[byte] for byte in raw[1:]]
+        if raw:
+            fileContents.append(b'')
+
+        # The header keeps the first byte, which is missing from the
+        # metadata list
+        try:
+            self.header = TIPrgmHeader(raw)
+        except RuntimeError:
+            self.header = None
 
         # Attempts to extract the metadata and raises an error
         # if the array is too short to contain any
@@ -71,15 +466,21 @@ class TIPrgmFile(object):
             self.footer = None
 
         else:
-            self.prgmdata = fileContents[73:len(fileContents)-3]
+            start, end = TIPrgmHeader.SIZE, len(raw) - 2
+            if self.header is not None:
+                start, end = self.header.programSpan(len(raw))
+            # fileContents is missing the first byte, so it's one behind
+            self.prgmdata = fileContents[start-1:end-1]
             self.footer = fileContents[len(fileContents)-3:len(fileContents)]
 
-    def writeOut(self, filename):
+    def writeOut(self, filename, name=None):
         """
         Writes a .8xp TI-Basic file to disk as bytes
 
         Arguments:
            filename (str): the name of the file to write
+           name (str, optional): the program name for the header, made
+               from the filename by default
 
         Returns:
             fileWritten (boolean): a boolean value of whether or not the file
@@ -87,7 +488,8 @@ class TIPrgmFile(object):
         """
 
         # Add the .8xp extension to the filename
-        name = filename.split(".")[0].upper()
+        if name is None:
+            name = filename.split(".")[0].upper()
         self._createMetadata(name)
 
         with open(filename, "wb") as outFile:
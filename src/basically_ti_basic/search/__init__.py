@@ -0,0 +1,315 @@
+"""
+description: Searches compiled programs for commands without decompiling
+    them. Queries are compiled into token sequences with the same tokenizer
+    as PrgmCompiler.compile and matched all at once by an Aho-Corasick
+    automaton walking the program's tokens, so a match always starts and
+    ends on a token boundary.
+
+    Only the lines whose bytes contain a query are tokenized at all; they
+    are found with bytes.find, and programs that don't contain any of the
+    queries are skipped without being tokenized.
+"""
+from basically_ti_basic.compiler import PrgmCompiler, Diagnostics, NEWLINE
+import bisect
+import os
+
+class SearchHit(object):
+
+    """
+    A match of a query in a program.
+    """
+
+    __slots__ = ('filename', 'program', 'pattern', 'offset', 'line', 'text')
+
+    def __init__(self, filename, program, pattern, offset, line, text):
+        """
+        Parameters:
+            string filename: The file the program is in
+            string program: The name of the program
+            string pattern: The query that matched
+            int offset: Where the match starts in the program data
+            int line: The line of the match, from 1
+            string text: The decompiled line
+        """
+        self.filename = filename
+        self.program = program
+        self.pattern = pattern
+        self.offset = offset
+        self.line = line
+        self.text = text
+
+    def __str__(self):
+        return "{0}:{1}:{2}: {3}".format(self.filename, self.program, self.line, self.text)
+
+class ProgramSearcher(object):
+
+    """
+    Finds any of a set of queries in the program data of compiled programs.
+    """
+
+    # Candidates closer than this many bytes share a run of lines
+    MERGE_DISTANCE = 256
+
+    def __init__(self, patterns, model=None):
+        """
+        Compiles the queries and builds the automaton that matches them.
+
+        Parameters:
+            Array[string] patterns: The queries, as TI-Basic text, e.g. 'Output(3,'
+            string model: The calculator model whose tokens to use
+        Raises:
+            TokenError: If a query has text that isn't a token
+        """
+        self._compiler = PrgmCompiler(model)
+        # The files search_paths couldn't read, as (filename, reason)
+        self.unreadable = []
+        self.patterns = []
+        sequences = []
+        for pattern in patterns:
+            tokens = self._compiler.compile([pattern], Diagnostics('raise')).prgmdata
+            if tokens:
+                self.patterns.append(pattern)
+                sequences.append(tokens)
+
+        # The bytes of each query, to find the lines that might match
+        self._needles = [b"".join(tokens) for tokens in sequences]
+        self._build(sequences)
+
+        # Newline bytes after these pairs' first byte may be the second
+        # byte of a two byte token rather than a newline
+        single, double = self._compiler.table.get_dispatch()
+        self._ambiguous = [
+            bytes((lead, NEWLINE))
+            for lead, page in enumerate(double)
+            if page is not None and NEWLINE in page
+            ]
+        self._double = double
+
+    def _build(self, sequences):
+        """
+        Builds the Aho-Corasick automaton over token sequences. State 0 is
+        the root; each state has its transitions by token, the state to fall
+        back to when no transition matches, and the queries ending there as
+        (index, length in bytes).
+        """
+        from collections import deque
+
+        self._goto = [dict()]
+        self._fail = [0]
+        self._out = [[]]
+
+        for index, tokens in enumerate(sequences):
+            state = 0
+            for token in tokens:
+                following = self._goto[state].get(token)
+                if following is None:
+                    following = len(self._goto)
+                    self._goto.append(dict())
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][token] = following
+                state = following
+            self._out[state].append((index, len(self._needles[index])))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(token, 0)
+                self._out[following] = self._out[following] + self._out[self._fail[following]]
+
+    def search(self, prgm_data, filename=None, program=None):
+        """
+        Searches the program data of one program.
+
+        Parameters:
+            bytes prgm_data: The program data
+            string filename: The file the program is in, for the hits
+            string program: The name of the program, for the hits
+        Returns:
+            Array[SearchHit]: The matches, in order
+        """
+        prgm_data = bytes(prgm_data)
+
+        candidates = []
+        for index, needle in enumerate(self._needles):
+            position = prgm_data.find(needle)
+            while position != -1:
+                candidates.append((position, position + len(needle)))
+                position = prgm_data.find(needle, position + 1)
+
+        if not candidates:
+            return []
+        candidates.sort()
+
+        # Each candidate is searched along with the rest of the lines it's
+        # on, and candidates close together share a run of lines
+        segments = []
+        for position, end in candidates:
+            if segments and position < segments[-1][1] + ProgramSearcher.MERGE_DISTANCE:
+                if end > segments[-1][1]:
+                    segments[-1][1] = self._line_end(prgm_data, end)
+            else:
+                segments.append(
+                    [self._line_start(prgm_data, position), self._line_end(prgm_data, end)])
+
+        hits = []
+        line = 1
+        counted_to = 0
+        for start, end in segments:
+            line += self._count_lines(prgm_data, counted_to, start)
+            counted_to = start
+            hits.extend(self._search_lines(prgm_data, start, end, line, filename, program))
+
+        return hits
+
+    def _search_lines(self, prgm_data, start, end, line, filename, program):
+        """
+        Runs the automaton over whole lines of program data.
+
+        Parameters:
+            bytes prgm_data: The program data
+            int start: Where the first line starts
+            int end: Where the last line ends
+            int line: The number of the first line
+        Returns:
+            Array[SearchHit]: The matches, in order
+        """
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+
+        tokens = list(self._compiler.tokenize(prgm_data[start:end]))
+
+        found = []
+        # The index of the first token and the offset of each line
+        line_tokens = [0]
+        line_starts = [0]
+        state = 0
+        for number, (offset, token, plaintext) in enumerate(tokens):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+
+            for index, length in out[state]:
+                found.append((index, offset + len(token) - length))
+
+            if plaintext == "\n":
+                line_tokens.append(number + 1)
+                line_starts.append(offset + 1)
+        line_tokens.append(len(tokens) + 1)
+
+        texts = dict()
+        hits = []
+        for index, offset in found:
+            number = bisect.bisect_right(line_starts, offset) - 1
+            if number not in texts:
+                texts[number] = "".join(
+                    plaintext if plaintext is not None else "[?" + token.hex().upper() + "]"
+                    for _, token, plaintext in tokens[line_tokens[number]:line_tokens[number + 1] - 1])
+            hits.append(SearchHit(
+                filename, program, self.patterns[index], start + offset,
+                line + number, texts[number]))
+
+        return hits
+
+    def _line_start(self, prgm_data, position):
+        """
+        Returns where the line holding a position starts. A newline that
+        might be the second byte of a two byte token is passed over, so
+        the line may start earlier, but always on a token boundary.
+        """
+        found = prgm_data.rfind(NEWLINE, 0, position)
+        while found > 0 and self._double[prgm_data[found - 1]] is not None and \
+                NEWLINE in self._double[prgm_data[found - 1]]:
+            found = prgm_data.rfind(NEWLINE, 0, found)
+        return found + 1
+
+    def _line_end(self, prgm_data, position):
+        """
+        Returns where the line holding the byte before a position ends,
+        passing over newlines that might be part of a two byte token.
+        """
+        found = prgm_data.find(NEWLINE, max(position - 1, 0))
+        while found > 0 and self._double[prgm_data[found - 1]] is not None and \
+                NEWLINE in self._double[prgm_data[found - 1]]:
+            found = prgm_data.find(NEWLINE, found + 1)
+        return len(prgm_data) if found == -1 else found + 1
+
+    def _count_lines(self, prgm_data, start, end):
+        """
+        Counts the newlines between two line starts. Newline bytes are
+        counted directly unless one of them might be part of a two byte
+        token, in which case the tokens are counted instead.
+        """
+        if any(prgm_data.find(pair, start, end) != -1 for pair in self._ambiguous):
+            return sum(
+                1 for offset, token, plaintext in self._compiler.tokenize(prgm_data[start:end])
+                if plaintext == "\n")
+        return prgm_data.count(NEWLINE, start, end)
+
+    def search_file(self, filename):
+        """
+        Searches the programs in a .8Xp or group file.
+
+        Parameters:
+            string filename: The file to search
+        Returns:
+            Array[SearchHit]: The matches, in order
+        """
+        from basically_ti_basic.files import TIPrgmHeader, TIVarContainer
+
+        if filename.lower().endswith('.8xp'):
+            with open(filename, "rb") as inStream:
+                raw = inStream.read()
+            header = TIPrgmHeader(raw)
+            start, end = header.programSpan(len(raw))
+            return self.search(raw[start:end], filename, header.name)
+
+        hits = []
+        with TIVarContainer(filename) as container:
+            for entry in container:
+                prgmdata = entry.prgmdata
+                if prgmdata is None:
+                    continue
+                hits.extend(self.search(prgmdata, filename, entry.name))
+                prgmdata.release()
+
+        return hits
+
+    def search_paths(self, paths):
+        """
+        Searches files, and the .8Xp and group files in directories.
+        Files that can't be read are skipped and added to unreadable.
+
+        Parameters:
+            Array[string] paths: The files and directories to search
+        Returns:
+            Generator[SearchHit]: The matches, file by file
+        """
+        for path in paths:
+            if not os.path.isdir(path):
+                for hit in self._search_readable(path):
+                    yield hit
+                continue
+
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fname in sorted(files):
+                    if os.path.splitext(fname)[1].lower() in ('.8xp', '.8xg'):
+                        for hit in self._search_readable(os.path.join(root, fname)):
+                            yield hit
+
+    def _search_readable(self, filename):
+        """
+        Searches a file, noting it in unreadable instead if it can't be read.
+        """
+        try:
+            return self.search_file(filename)
+        except (OSError, RuntimeError) as e:
+            self.unreadable.append((filename, str(e)))
+            return []
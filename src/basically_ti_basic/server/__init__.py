@@ -0,0 +1,294 @@
+"""
+description: A long running worker that keeps the compiler and token tables
+    loaded and converts files on request, so editors and build systems don't
+    pay for a new interpreter on every conversion.
+
+    Requests and responses are single lines of JSON. A request looks like
+
+        {"id": 1, "op": "decompile", "input": "/abs/FIBO.8Xp", "output": "stdout"}
+
+    and is answered with
+
+        {"id": 1, "ok": true, "output": "..."}
+
+    or, if something went wrong,
+
+        {"id": 1, "ok": false, "error": "..."}
+
+    The ops are "compile", "decompile" and "ping". Compile and decompile
+    take an optional "model" naming the calculator model whose tokens to use,
+    and decompile an optional "entry" naming the program to decompile from a
+    group file. Compile takes an optional "name" for the program,
+    which is otherwise made from the output path. Both take an optional "on_error" policy, see
+    basically_ti_basic.compiler.Diagnostics; the problems found are
+    returned in "diagnostics", with a one line "summary".
+    Paths should be absolute, since the worker doesn't share the client's
+    working directory.
+"""
+import json
+import os
+import socket
+import sys
+
+# The worker side is imported inside the functions that use it, so that the
+# command line client can forward requests without loading the compiler.
+
+# How long the client waits for a worker to accept a request, and then
+# to answer it, in seconds
+CONNECT_TIMEOUT = 1
+RESPONSE_TIMEOUT = 60
+
+def default_socket():
+    """
+    Returns the path of the socket the worker listens on by default,
+    one per user, or None where there are no Unix sockets.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    directory = os.environ.get('XDG_RUNTIME_DIR')
+    if directory is None:
+        import tempfile
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, 'basically-ti-basic-{0}.sock'.format(os.getuid()))
+
+def _owned(path):
+    """
+    Returns whether a path belongs to the current user.
+    """
+    return os.stat(path).st_uid == os.getuid()
+
+class PrgmWorker(object):
+
+    """
+    Handles compile and decompile requests with a compiler and token
+    tables that stay loaded between requests.
+    """
+
+    def __init__(self):
+        self._compilers = dict()
+        # Build the lookup tables now rather than on the first request
+        self._compiler(None)
+
+    def _compiler(self, model):
+        """
+        Returns the compiler for a calculator model, creating it (and the
+        lookup tables of its token table) the first time it's asked for.
+        """
+        from basically_ti_basic.compiler import PrgmCompiler
+
+        compiler = self._compilers.get(model)
+        if compiler is None:
+            compiler = PrgmCompiler(model)
+            compiler.table.get_trie()
+            compiler.table.get_dispatch()
+            self._compilers[model] = compiler
+
+        return compiler
+
+    def handle(self, request):
+        """
+        Runs a single request.
+
+        Parameters:
+            dict request: The decoded request
+        Returns:
+            dict: The response
+        """
+        from basically_ti_basic.compiler import Diagnostics
+
+        response = {'id': request.get('id')}
+        try:
+            default_policy = 'raise' if request.get('op') == 'compile' else 'skip'
+            diagnostics = Diagnostics(request.get('on_error') or default_policy)
+            response['output'] = self._run(request, diagnostics)
+            response['ok'] = True
+            if diagnostics:
+                response['summary'] = diagnostics.summary(request.get('input'))
+                response['diagnostics'] = [str(d) for d in diagnostics]
+        except Exception as e:
+            response['ok'] = False
+            response['error'] = str(e)
+
+        return response
+
+    def handle_line(self, line):
+        """
+        Runs a single request given as a line of JSON.
+
+        Parameters:
+            string line: The request
+        Returns:
+            string: The response as a line of JSON
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return json.dumps({'id': None, 'ok': False, 'error': str(e)}) + "\n"
+
+        return json.dumps(self.handle(request)) + "\n"
+
+    def _run(self, request, diagnostics):
+        op = request.get('op')
+        inputfile = request.get('input')
+        outputfile = request.get('output', 'stdout')
+        compiler = self._compiler(request.get('model'))
+
+        if op == 'ping':
+            return 'pong'
+
+        if op == 'decompile':
+            decompiled = self._decompile(
+                compiler, inputfile, request.get('entry'), diagnostics)
+            if outputfile == 'stdout':
+                return "\n".join(decompiled)
+            with open(outputfile, 'w') as out:
+                for line in decompiled:
+                    out.write(line+"\n")
+            return None
+
+        if op == 'compile':
+            if outputfile == 'stdout':
+                raise RuntimeError("Compiling needs an output file.")
+            with open(inputfile, 'r') as f:
+                file_lines = f.readlines()
+            compiler.compile(file_lines, diagnostics).writeOut(outputfile, request.get('name'))
+            return None
+
+        raise RuntimeError("Unknown op: " + str(op))
+
+    def _decompile(self, compiler, inputfile, entry, diagnostics):
+        from basically_ti_basic.files import TIPrgmFile, TIVarContainer
+
+        if entry is None:
+            return compiler.decompile(TIPrgmFile(inputfile), diagnostics)
+
+        with TIVarContainer(inputfile) as container:
+            tifile = container.find(entry)
+            if tifile is None or tifile.prgmdata is None:
+                raise RuntimeError("No program named " + entry + " in " + inputfile)
+            return compiler.decompile(tifile, diagnostics)
+
+def serve_socket(path=None):
+    """
+    Listens for requests on a Unix socket until interrupted. Each
+    connection is handled on its own thread.
+
+    Parameters:
+        string path: The socket to listen on, default_socket() by default
+    """
+    import socketserver
+
+    class SocketHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                response = self.server.worker.handle_line(line.decode('utf-8'))
+                self.wfile.write(response.encode('utf-8'))
+                self.wfile.flush()
+
+    class SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError("The worker needs Unix sockets, which this platform doesn't have.")
+
+    if path is None:
+        path = default_socket()
+
+    if os.path.exists(path):
+        if not _owned(path):
+            raise RuntimeError(path + " belongs to another user")
+        # Don't take over a socket that another worker is answering on
+        if forward({'op': 'ping'}, path) is not None:
+            raise RuntimeError("A worker is already listening on " + path)
+        os.unlink(path)
+
+    # Only this user may connect to the socket
+    umask = os.umask(0o077)
+    try:
+        server = SocketServer(path, SocketHandler)
+    finally:
+        os.umask(umask)
+    server.worker = PrgmWorker()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def serve_stdio(instream, outstream, workers=None):
+    """
+    Answers requests read from a stream, one JSON request per line, until
+    the stream ends. Requests are handled concurrently, so responses may
+    come back in a different order than the requests; use the ids to
+    match them up. Anything else printed while the requests are handled,
+    such as warnings, goes to standard error so that it can't get mixed
+    into the responses.
+
+    Parameters:
+        file instream: The stream to read requests from
+        file outstream: The stream to write responses to
+        int workers: The number of requests to handle at once
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import contextlib
+    import threading
+
+    worker = PrgmWorker()
+    lock = threading.Lock()
+
+    def respond(line):
+        response = worker.handle_line(line)
+        with lock:
+            outstream.write(response)
+            outstream.flush()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for line in instream:
+                if line.strip():
+                    pool.submit(respond, line)
+
+def forward(request, path=None):
+    """
+    Sends a request to a running worker.
+
+    Parameters:
+        dict request: The request
+        string path: The socket the worker listens on
+    Returns:
+        dict: The response, or None if no worker is listening or it
+            doesn't answer in time
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    if path is None:
+        path = default_socket()
+
+    # Another user could have put a socket where ours would be, to be
+    # sent our paths and answer with output of their choosing
+    if not os.path.exists(path) or not _owned(path):
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CONNECT_TIMEOUT)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+
+    client.settimeout(RESPONSE_TIMEOUT)
+    try:
+        with client, client.makefile('rwb') as stream:
+            stream.write((json.dumps(request) + "\n").encode('utf-8'))
+            stream.flush()
+            response = stream.readline()
+    except socket.timeout:
+        return None
+
+    if not response:
+        return None
+
+    return json.loads(response.decode('utf-8'))
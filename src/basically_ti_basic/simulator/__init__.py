@@ -0,0 +1,790 @@
+"""
+description: Runs compiled TI-Basic programs on the PC, to measure and
+    regression test them off the calculator. The simulator executes the
+    token stream itself, dispatching on token ids, and counts the tokens
+    executed on each line of the program.
+
+    It covers the control flow (If, Then, Else, For, While, Repeat, End,
+    Goto, Lbl, IS>(, DS>(, Pause, Stop, Return), the real variables A-Z and
+    theta, Ans, arithmetic, comparisons and logic, the common math
+    functions, and the home screen (ClrHome, Disp, Output(, Input, Prompt)
+    through a headless display.
+
+    Blocks are matched to their End once, when the program is loaded, so
+    jumping out of a loop with Goto doesn't leak memory like it does on
+    the calculator.
+"""
+from basically_ti_basic.compiler import PrgmCompiler, NEWLINE
+import math
+import random
+
+# Token ids, the token's bytes as a big endian number
+_STORE = 0x04
+_OPEN = 0x10
+_CLOSE = 0x11
+_QUOTE = 0x2A
+_COMMA = 0x2B
+_FACTORIAL = 0x2D
+_DOT = 0x3A
+_COLON = 0x3E
+_NEWLINE = NEWLINE
+_THETA = 0x5B
+_ANS = 0x72
+_NEGATE = 0xB0
+_PI = 0xAC
+_RAND = 0xAB
+_GETKEY = 0xAD
+_SQUARE = 0x0D
+_CUBE = 0x0F
+_INVERSE = 0x0C
+
+_IF = 0xCE
+_THEN = 0xCF
+_ELSE = 0xD0
+_WHILE = 0xD1
+_REPEAT = 0xD2
+_FOR = 0xD3
+_END = 0xD4
+_RETURN = 0xD5
+_LBL = 0xD6
+_GOTO = 0xD7
+_PAUSE = 0xD8
+_STOP = 0xD9
+_ISG = 0xDA
+_DSL = 0xDB
+_INPUT = 0xDC
+_PROMPT = 0xDD
+_DISP = 0xDE
+_OUTPUT = 0xE0
+_CLRHOME = 0xE1
+
+_OPENERS = (_THEN, _WHILE, _REPEAT, _FOR)
+
+# Binary operators by precedence, higher binds tighter. A negation sign
+# between two values subtracts, since plaintext uses '-' for both.
+_BINARY = {
+    0x3C: (1, lambda a, b: int(bool(a) or bool(b))),
+    0x3D: (1, lambda a, b: int(bool(a) != bool(b))),
+    0x40: (2, lambda a, b: int(bool(a) and bool(b))),
+    0x6A: (3, lambda a, b: int(a == b)),
+    0x6B: (3, lambda a, b: int(a < b)),
+    0x6C: (3, lambda a, b: int(a > b)),
+    0x6D: (3, lambda a, b: int(a <= b)),
+    0x6E: (3, lambda a, b: int(a >= b)),
+    0x6F: (3, lambda a, b: int(a != b)),
+    0x70: (4, lambda a, b: a + b),
+    0x71: (4, lambda a, b: a - b),
+    _NEGATE: (4, lambda a, b: a - b),
+    0x82: (5, lambda a, b: a * b),
+    0x83: (5, None),
+    0xF0: (7, None),
+    }
+_MULTIPLY = 5
+_NEGATION = 6
+
+# Results the calculator can hold stay below this, and 69! is the
+# largest factorial under it
+_LIMIT = 1e100
+_FACTORIAL_LIMIT = 69
+
+# Functions whose token includes the opening parenthesis
+_FUNCTIONS = {
+    0xB1: lambda x: math.floor(x),
+    0xB2: abs,
+    0xB8: lambda x: int(not x),
+    0xB9: lambda x: math.trunc(x),
+    0xBA: lambda x: x - math.trunc(x),
+    0xBC: math.sqrt,
+    0xBE: math.log,
+    0xBF: math.exp,
+    0xC0: math.log10,
+    0xC1: lambda x: 10.0 ** x,
+    0xC2: math.sin,
+    0xC4: math.cos,
+    0xC6: math.tan,
+    0x19: max,
+    0x1A: min,
+    }
+
+class SimulatorError(Exception):
+
+    """
+    Raised when a program hits an error, like the calculator's ERR: screen.
+    """
+
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = "line {0}: {1}".format(line, message)
+        super(SimulatorError, self).__init__(message)
+        self.line = line
+
+class StepLimitError(SimulatorError):
+
+    """
+    Raised when a program runs for more tokens than it's allowed to.
+    """
+
+class HomeScreen(object):
+
+    """
+    A headless home screen. Keeps what would be on the screen, and a log
+    of everything displayed, for checking a program's output.
+    """
+
+    ROWS = 8
+    COLUMNS = 16
+
+    def __init__(self):
+        self.log = []
+        self.clear()
+
+    def clear(self):
+        self.rows = [" " * HomeScreen.COLUMNS for _ in range(HomeScreen.ROWS)]
+        self.cursor = 0
+
+    def disp(self, text, right=False):
+        """
+        Displays a line at the cursor, scrolling if the screen is full.
+        Numbers are right aligned, like on the calculator.
+        """
+        self.log.append(text)
+        if self.cursor == HomeScreen.ROWS:
+            self.rows = self.rows[1:] + [" " * HomeScreen.COLUMNS]
+            self.cursor -= 1
+
+        text = text[:HomeScreen.COLUMNS]
+        if right:
+            self.rows[self.cursor] = text.rjust(HomeScreen.COLUMNS)
+        else:
+            self.rows[self.cursor] = text.ljust(HomeScreen.COLUMNS)
+        self.cursor += 1
+
+    def output(self, row, column, text):
+        """
+        Writes text at a row and column, from 1, wrapping onto the rows
+        below and stopping at the bottom of the screen.
+        """
+        self.log.append(text)
+        position = (row - 1) * HomeScreen.COLUMNS + column - 1
+        for char in text:
+            if position >= HomeScreen.ROWS * HomeScreen.COLUMNS:
+                break
+            r, c = divmod(position, HomeScreen.COLUMNS)
+            self.rows[r] = self.rows[r][:c] + char + self.rows[r][c + 1:]
+            position += 1
+
+    def __str__(self):
+        return "\n".join(self.rows)
+
+class PrgmSimulator(object):
+
+    """
+    Runs programs token by token.
+    """
+
+    def __init__(self, model=None, max_steps=1000000, inputs=None, seed=0):
+        """
+        Parameters:
+            string model: The calculator model whose tokens to use
+            int max_steps: The most tokens a run may execute
+            Array[number] inputs: The answers to Input and Prompt, in order
+            int seed: The seed of rand and randInt(
+        """
+        self._compiler = PrgmCompiler(model)
+        self.max_steps = max_steps
+        self.inputs = list(inputs or [])
+        self.seed = seed
+
+    def run(self, prgm_data):
+        """
+        Runs a program from the start until it ends or stops.
+
+        Parameters:
+            bytes prgm_data: The program data, as bytes or a list of bytes
+        Returns:
+            HomeScreen: The display, as the program left it
+        Raises:
+            SimulatorError: If the program hits an error
+            StepLimitError: If the program runs for more than max_steps tokens
+        """
+        self._load(prgm_data)
+
+        self.display = HomeScreen()
+        self.variables = dict()
+        self.ans = 0
+        self.steps = 0
+        self.line_counts = dict()
+        self._random = random.Random(self.seed)
+        self._loops = dict()
+        self._pending_inputs = list(self.inputs)
+
+        self._pc = 0
+        try:
+            while self._pc < len(self._ids):
+                self._statement()
+        except _Halt:
+            pass
+
+        return self.display
+
+    def profile(self):
+        """
+        Returns the tokens executed on each line by the last run, the
+        busiest line first.
+
+        Returns:
+            Array[(int, int)]: Line numbers, from 1, and token counts
+        """
+        return sorted(self.line_counts.items(), key=lambda item: (-item[1], item[0]))
+
+    def _load(self, prgm_data):
+        """
+        Splits a program into token ids and finds its statements, labels
+        and blocks.
+        """
+        self._ids = []
+        self._lines = []
+        self._texts = []
+        line = 1
+        for offset, token, plaintext in self._compiler.tokenize(prgm_data):
+            self._ids.append(int.from_bytes(token, 'big'))
+            self._lines.append(line)
+            self._texts.append(plaintext)
+            if plaintext == "\n":
+                line += 1
+
+        ids = self._ids
+        # Where each statement starts, and where the one after it starts
+        self._next = dict()
+        self._labels = dict()
+        self._match = dict()
+        self._elses = dict()
+
+        starts = []
+        position = 0
+        in_string = False
+        start = 0
+        for position, token in enumerate(ids):
+            if token == _QUOTE:
+                in_string = not in_string
+            elif token == _STORE:
+                in_string = False
+            elif token == _NEWLINE or (token == _COLON and not in_string):
+                in_string = False
+                starts.append(start)
+                self._next[start] = position + 1
+                start = position + 1
+        if start < len(ids):
+            starts.append(start)
+            self._next[start] = len(ids)
+
+        blocks = []
+        for start in starts:
+            token = ids[start]
+            if token in _OPENERS:
+                blocks.append(start)
+            elif token == _ELSE and blocks:
+                self._elses[blocks[-1]] = start
+                self._match[start] = blocks[-1]
+            elif token == _END and blocks:
+                opener = blocks.pop()
+                self._match[opener] = start
+                self._match[start] = opener
+            elif token == _LBL:
+                self._labels[self._label(start + 1)] = start
+
+    def _label(self, position):
+        """
+        Reads the one or two letter or digit name of a label.
+        """
+        name = []
+        while position < len(self._ids) and len(name) < 2 and \
+                (0x30 <= self._ids[position] <= 0x39 or 0x41 <= self._ids[position] <= _THETA):
+            name.append(self._ids[position])
+            position += 1
+        return tuple(name)
+
+    def _error(self, message):
+        position = min(self._pc, len(self._ids) - 1)
+        raise SimulatorError(message, self._lines[position] if position >= 0 else None)
+
+    def _peek(self):
+        if self._pc < len(self._ids):
+            return self._ids[self._pc]
+        return None
+
+    def _take(self):
+        """
+        Executes the next token, counting it against its line.
+        """
+        pc = self._pc
+        if pc >= len(self._ids):
+            self._error("ERR:SYNTAX")
+
+        self.steps += 1
+        if self.steps > self.max_steps:
+            raise StepLimitError(
+                "ran for more than {0} tokens".format(self.max_steps), self._lines[pc])
+
+        line = self._lines[pc]
+        self.line_counts[line] = self.line_counts.get(line, 0) + 1
+        self._pc = pc + 1
+        return self._ids[pc]
+
+    def _expect(self, token):
+        if self._peek() != token:
+            self._error("ERR:SYNTAX")
+        self._take()
+
+    def _close(self):
+        """
+        Takes a closing parenthesis, which can be left out at the end of a
+        statement.
+        """
+        if self._peek() == _CLOSE:
+            self._take()
+
+    def _end_statement(self):
+        token = self._peek()
+        if token is None:
+            return
+        if token not in (_COLON, _NEWLINE):
+            self._error("ERR:SYNTAX")
+        self._take()
+
+    def _jump_after(self, start):
+        """
+        Continues with the statement after the one starting at start.
+        """
+        self._pc = self._next.get(start, len(self._ids))
+
+    def _statement(self):
+        start = self._pc
+        token = self._peek()
+
+        if token in (_COLON, _NEWLINE):
+            self._take()
+            return
+
+        handler = _STATEMENTS.get(token)
+        if handler is not None:
+            handler(self, start)
+            return
+
+        value = self._expression()
+        if self._peek() == _STORE:
+            self._take()
+            self._store(value)
+        self.ans = value
+        self._end_statement()
+
+    def _store(self, value):
+        target = self._take()
+        if not (0x41 <= target <= _THETA):
+            self._error("ERR:SYNTAX")
+        if isinstance(value, str):
+            self._error("ERR:DATA TYPE")
+        self.variables[target] = value
+
+    # Statements
+
+    def _if(self, start):
+        self._take()
+        condition = self._expression()
+        self._end_statement()
+
+        following = self._pc
+        if following < len(self._ids) and self._ids[following] == _THEN:
+            if condition:
+                return
+            # Skip to the Else, or past the End
+            target = self._elses.get(following, self._match.get(following))
+            if target is None:
+                self._error("ERR:SYNTAX")
+            self._jump_after(target)
+        elif not condition:
+            self._jump_after(following)
+
+    def _then(self, start):
+        self._take()
+        self._end_statement()
+
+    def _else(self, start):
+        # Reached at the end of a true If block, skip past its End
+        self._take()
+        end = self._match.get(self._match.get(start))
+        if end is None:
+            self._error("ERR:SYNTAX")
+        self._jump_after(end)
+
+    def _while(self, start):
+        self._take()
+        condition = self._expression()
+        self._end_statement()
+        if not condition:
+            end = self._match.get(start)
+            if end is None:
+                self._error("ERR:SYNTAX")
+            self._jump_after(end)
+
+    def _repeat(self, start):
+        # The condition is only checked at the End
+        self._take()
+        self._jump_after(start)
+
+    def _for(self, start):
+        self._take()
+        if self._peek() == _OPEN:
+            self._take()
+        variable = self._take()
+        if not (0x41 <= variable <= _THETA):
+            self._error("ERR:SYNTAX")
+        self._expect(_COMMA)
+        begin = self._expression()
+        self._expect(_COMMA)
+        finish = self._expression()
+        step = 1
+        if self._peek() == _COMMA:
+            self._take()
+            step = self._expression()
+        self._close()
+        self._end_statement()
+
+        if step == 0:
+            self._error("ERR:INCREMENT")
+        # The end and step are only evaluated when the loop starts
+        self._loops[start] = (variable, finish, step)
+        self.variables[variable] = begin
+        if (step > 0 and begin > finish) or (step < 0 and begin < finish):
+            end = self._match.get(start)
+            if end is None:
+                self._error("ERR:SYNTAX")
+            self._jump_after(end)
+
+    def _end(self, start):
+        self._take()
+        self._end_statement()
+        opener = self._match.get(start)
+        if opener is None:
+            self._error("ERR:SYNTAX")
+
+        token = self._ids[opener]
+        if token == _WHILE:
+            self._pc = opener
+        elif token == _REPEAT:
+            after = self._pc
+            self._pc = opener + 1
+            condition = self._expression()
+            if condition:
+                self._pc = after
+            else:
+                self._jump_after(opener)
+        elif token == _FOR:
+            # Step the variable and loop back unless it went past the end
+            variable, finish, step = self._loops[opener]
+            value = self.variables.get(variable, 0) + step
+            self.variables[variable] = value
+            if (step < 0 and value >= finish) or (step > 0 and value <= finish):
+                self._jump_after(opener)
+
+    def _lbl(self, start):
+        self._take()
+        self._pc = self._next.get(start, len(self._ids))
+
+    def _goto(self, start):
+        self._take()
+        name = self._label(self._pc)
+        target = self._labels.get(name)
+        if target is None:
+            self._error("ERR:LABEL")
+        for _ in name:
+            self._take()
+        self._pc = target
+
+    def _increment_skip(self, start):
+        step = 1 if self._ids[start] == _ISG else -1
+        self._take()
+        variable = self._take()
+        if not (0x41 <= variable <= _THETA):
+            self._error("ERR:SYNTAX")
+        self._expect(_COMMA)
+        limit = self._expression()
+        self._close()
+        self._end_statement()
+
+        value = self.variables.get(variable, 0) + step
+        self.variables[variable] = value
+        if (step > 0 and value > limit) or (step < 0 and value < limit):
+            self._jump_after(self._pc)
+
+    def _pause(self, start):
+        self._take()
+        if self._peek() not in (None, _COLON, _NEWLINE):
+            value = self._expression()
+            self.display.disp(_format(value), not isinstance(value, str))
+        self._end_statement()
+
+    def _stop(self, start):
+        self._take()
+        raise _Halt()
+
+    def _disp(self, start):
+        self._take()
+        while self._peek() not in (None, _COLON, _NEWLINE):
+            value = self._expression()
+            self.display.disp(_format(value), not isinstance(value, str))
+            if self._peek() != _COMMA:
+                break
+            self._take()
+        self._end_statement()
+
+    def _output(self, start):
+        self._take()
+        row = self._expression()
+        self._expect(_COMMA)
+        column = self._expression()
+        self._expect(_COMMA)
+        value = self._expression()
+        self._close()
+        self._end_statement()
+
+        if not (1 <= row <= HomeScreen.ROWS and 1 <= column <= HomeScreen.COLUMNS):
+            self._error("ERR:DOMAIN")
+        self.display.output(int(row), int(column), _format(value))
+
+    def _clrhome(self, start):
+        self._take()
+        self.display.clear()
+        self._end_statement()
+
+    def _input(self, start):
+        token = self._take()
+        prompt = None
+        if token == _INPUT and self._peek() == _QUOTE:
+            prompt = self._expression()
+            self._expect(_COMMA)
+
+        while True:
+            variable = self._take()
+            if not (0x41 <= variable <= _THETA):
+                self._error("ERR:SYNTAX")
+            if not self._pending_inputs:
+                self._error("ERR:NO INPUT LEFT")
+            value = self._pending_inputs.pop(0)
+            name = self._texts[self._pc - 1]
+            self.display.disp((prompt if prompt is not None else name + "=?") + _format(value))
+            self.variables[variable] = value
+            if token != _PROMPT or self._peek() != _COMMA:
+                break
+            self._take()
+        self._end_statement()
+
+    # Expressions
+
+    def _expression(self, precedence=0):
+        value = self._unary()
+        while True:
+            token = self._peek()
+            operator = _BINARY.get(token)
+            if operator is not None:
+                binds, apply = operator
+                if binds < precedence:
+                    return value
+                self._take()
+                # ^ is left associative on the calculator, like the others
+                right = self._expression(binds + 1)
+                value = self._apply(token, apply, value, right)
+            elif token is not None and _MULTIPLY >= precedence and self._starts_value(token):
+                # Values next to each other are multiplied
+                value = self._apply(0x82, None, value, self._expression(_MULTIPLY + 1))
+            else:
+                return value
+
+    def _apply(self, token, apply, left, right):
+        if isinstance(left, str) or isinstance(right, str):
+            if token == 0x70 and isinstance(left, str) and isinstance(right, str):
+                return left + right
+            if token in (0x6A, 0x6F) and isinstance(left, str) and isinstance(right, str):
+                return _BINARY[token][1](left, right)
+            self._error("ERR:DATA TYPE")
+
+        try:
+            if token == 0x83:
+                return self._checked(_number(left / right))
+            if token == 0xF0:
+                # Floats keep huge powers from being worked out exactly
+                return self._checked(_number(float(left) ** right))
+            if token == 0x82:
+                return self._checked(left * right)
+            return self._checked(apply(left, right))
+        except ZeroDivisionError:
+            self._error("ERR:DIVIDE BY 0")
+        except OverflowError:
+            self._error("ERR:OVERFLOW")
+        except (ValueError, TypeError):
+            self._error("ERR:DOMAIN")
+
+    def _checked(self, value):
+        """
+        Raises the calculator's error for a result it can't hold: a
+        complex number in real mode, or one of 1e100 or more.
+        """
+        if isinstance(value, complex):
+            self._error("ERR:NONREAL ANS")
+        if isinstance(value, (int, float)) and abs(value) >= _LIMIT:
+            self._error("ERR:OVERFLOW")
+        return value
+
+    def _starts_value(self, token):
+        return 0x30 <= token <= 0x39 or token == _DOT or 0x41 <= token <= _THETA or \
+            token in (_OPEN, _ANS, _PI, _RAND, _GETKEY, 0xBB0A) or token in _FUNCTIONS
+
+    def _unary(self):
+        if self._peek() == _NEGATE:
+            self._take()
+            value = self._expression(_NEGATION)
+            if isinstance(value, str):
+                self._error("ERR:DATA TYPE")
+            return -value
+
+        value = self._primary()
+        while True:
+            token = self._peek()
+            if token == _SQUARE:
+                self._take()
+                value = self._apply(0x82, None, value, value)
+            elif token == _CUBE:
+                self._take()
+                value = self._apply(0xF0, None, value, 3)
+            elif token == _INVERSE:
+                self._take()
+                value = self._apply(0x83, None, 1, value)
+            elif token == _FACTORIAL:
+                self._take()
+                if isinstance(value, str) or value < 0 or value != int(value):
+                    self._error("ERR:DOMAIN")
+                if value > _FACTORIAL_LIMIT:
+                    self._error("ERR:OVERFLOW")
+                value = _number(float(math.factorial(int(value))))
+            else:
+                return value
+
+    def _primary(self):
+        token = self._take()
+
+        if 0x30 <= token <= 0x39 or token == _DOT:
+            digits = [self._texts[self._pc - 1]]
+            while self._peek() is not None and (0x30 <= self._peek() <= 0x39 or self._peek() == _DOT):
+                self._take()
+                digits.append(self._texts[self._pc - 1])
+            try:
+                return _number(float("".join(digits)))
+            except ValueError:
+                self._error("ERR:SYNTAX")
+
+        if 0x41 <= token <= _THETA:
+            return self.variables.get(token, 0)
+
+        if token == _ANS:
+            return self.ans
+
+        if token == _OPEN:
+            value = self._expression()
+            self._close()
+            return value
+
+        if token == _QUOTE:
+            text = []
+            while self._peek() not in (None, _QUOTE, _STORE, _NEWLINE):
+                self._take()
+                text.append(self._texts[self._pc - 1] or "")
+            if self._peek() == _QUOTE:
+                self._take()
+            return "".join(text)
+
+        if token == _PI:
+            return math.pi
+
+        if token == _RAND:
+            return self._random.random()
+
+        if token == _GETKEY:
+            return 0
+
+        if token == 0xBB0A:
+            low, high = self._arguments(2)
+            return self._random.randint(int(low), int(high))
+
+        function = _FUNCTIONS.get(token)
+        if function is not None:
+            if token in (0x19, 0x1A):
+                arguments = self._arguments(2)
+            else:
+                arguments = self._arguments(1)
+            if any(isinstance(argument, str) for argument in arguments):
+                self._error("ERR:DATA TYPE")
+            try:
+                return self._checked(_number(function(*arguments)))
+            except OverflowError:
+                self._error("ERR:OVERFLOW")
+            except ValueError:
+                self._error("ERR:DOMAIN")
+
+        self._pc -= 1
+        self._error("ERR:SYNTAX at " + repr(self._texts[self._pc] or hex(token)))
+
+    def _arguments(self, count):
+        """
+        Reads the arguments of a function whose token opened the parenthesis.
+        """
+        arguments = [self._expression()]
+        while len(arguments) < count:
+            self._expect(_COMMA)
+            arguments.append(self._expression())
+        self._close()
+        return arguments
+
+class _Halt(Exception):
+    """
+    Unwinds the simulator when a program stops.
+    """
+
+def _number(value):
+    """
+    Keeps whole numbers as ints, so they compare and display exactly.
+    """
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return int(value)
+    return value
+
+def _format(value):
+    """
+    Formats a value the way the home screen shows it.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int) and abs(value) < 1e10:
+        return str(value)
+    return "{0:.10g}".format(value)
+
+_STATEMENTS = {
+    _IF: PrgmSimulator._if,
+    _THEN: PrgmSimulator._then,
+    _ELSE: PrgmSimulator._else,
+    _WHILE: PrgmSimulator._while,
+    _REPEAT: PrgmSimulator._repeat,
+    _FOR: PrgmSimulator._for,
+    _END: PrgmSimulator._end,
+    _RETURN: PrgmSimulator._stop,
+    _LBL: PrgmSimulator._lbl,
+    _GOTO: PrgmSimulator._goto,
+    _PAUSE: PrgmSimulator._pause,
+    _STOP: PrgmSimulator._stop,
+    _ISG: PrgmSimulator._increment_skip,
+    _DSL: PrgmSimulator._increment_skip,
+    _INPUT: PrgmSimulator._input,
+    _PROMPT: PrgmSimulator._input,
+    _DISP: PrgmSimulator._disp,
+    _OUTPUT: PrgmSimulator._output,
+    _CLRHOME: PrgmSimulator._clrhome,
+    }
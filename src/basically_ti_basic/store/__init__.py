@@ -0,0 +1,258 @@
+"""
+description: Stores many revisions of TI-Basic programs with each distinct
+    piece of code stored only once. Program tokens are split at line
+    boundaries into content-defined chunks, so an edit only changes the
+    chunks around it and every revision shares the rest with the others.
+
+    The store is a directory:
+
+        objects/<sha1>          zlib compressed chunks of program tokens
+        versions/<sha1>.json    the header, footer and chunk list of a version
+        programs/<NAME>.json    the versions of a program, oldest first
+"""
+from basically_ti_basic.compiler import PrgmCompiler
+from basically_ti_basic.diff import PrgmDiffer
+from basically_ti_basic.files import TIPrgmHeader
+from urllib.parse import quote, unquote
+import hashlib
+import json
+import os
+import zlib
+
+class ProgramStore(object):
+
+    """
+    A deduplicating store of program revisions.
+    """
+
+    # A chunk ends after a line whose hash has these bits clear, so chunks
+    # average about 16 lines past the minimum size below.
+    CHUNK_MASK = 0xF
+    MIN_CHUNK = 256
+    MAX_CHUNK = 4096
+
+    def __init__(self, directory, model=None):
+        """
+        Opens a store, creating its directory if it doesn't exist.
+
+        Parameters:
+            string directory: The directory of the store
+            string model: The calculator model whose tokens to use
+        """
+        self.directory = directory
+        self._compiler = PrgmCompiler(model)
+        self._differ = PrgmDiffer(model)
+        for sub in ('objects', 'versions', 'programs'):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+
+    def put(self, filename, name=None):
+        """
+        Adds a .8Xp file to the store as the newest version of its program.
+
+        Parameters:
+            string filename: The .8Xp file
+            string name: The program name, defaults to the name in the header
+        Returns:
+            string: The id of the version
+        """
+        with open(filename, "rb") as inStream:
+            raw = inStream.read()
+
+        header = TIPrgmHeader(raw)
+        if name is None:
+            name = header.name
+
+        start, end = header.programSpan(len(raw))
+        prgm_data = raw[start:end]
+
+        chunks = []
+        for chunk in self.chunk(prgm_data):
+            chunk_id = hashlib.sha1(chunk).hexdigest()
+            path = self._object_path(chunk_id)
+            if not os.path.exists(path):
+                self._write(path, zlib.compress(chunk))
+            chunks.append(chunk_id)
+
+        version = {
+            'name': name,
+            'header': raw[:start].hex(),
+            'footer': raw[end:].hex(),
+            'size': len(raw),
+            'chunks': chunks
+            }
+        version_id = hashlib.sha1(json.dumps(version, sort_keys=True).encode('ascii')).hexdigest()
+        self._write(self._version_path(version_id), json.dumps(version).encode('ascii'))
+
+        versions = self.versions(name)
+        if not versions or versions[-1] != version_id:
+            versions.append(version_id)
+            self._write(self._program_path(name), json.dumps(versions).encode('ascii'))
+
+        return version_id
+
+    def get(self, version_id):
+        """
+        Rebuilds a version of a program.
+
+        Parameters:
+            string version_id: The id of the version
+        Returns:
+            bytes: The contents of the .8Xp file
+        """
+        version = self._version(version_id)
+        return bytes.fromhex(version['header']) + \
+            self.program_data(version_id) + \
+            bytes.fromhex(version['footer'])
+
+    def program_data(self, version_id):
+        """
+        Rebuilds only the program tokens of a version of a program.
+
+        Parameters:
+            string version_id: The id of the version
+        Returns:
+            bytes: The program tokens
+        """
+        version = self._version(version_id)
+        return self._data(version['chunks'])
+
+    def restore(self, version_id, filename):
+        """
+        Writes a version of a program out as a .8Xp file.
+        """
+        self._write(filename, self.get(version_id))
+
+    def versions(self, name):
+        """
+        Returns the version ids of a program, oldest first.
+        """
+        path = self._program_path(name)
+        if not os.path.exists(path):
+            return []
+
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def programs(self):
+        """
+        Returns the names of the programs in the store.
+        """
+        return sorted(
+            unquote(os.path.splitext(fname)[0])
+            for fname in os.listdir(os.path.join(self.directory, 'programs'))
+            )
+
+    def diff(self, old_id, new_id):
+        """
+        Compares two versions at the token level. Chunks the versions share
+        are skipped without being read, only the chunks that differ are
+        tokenized and compared.
+
+        Parameters:
+            string old_id: The id of the old version
+            string new_id: The id of the new version
+        Returns:
+            Array[(string, string, string)]: For each change, its tag
+                ('replace', 'delete' or 'insert'), the old plaintext and
+                the new plaintext
+        """
+        import difflib
+
+        old_chunks = self._version(old_id)['chunks']
+        new_chunks = self._version(new_id)['chunks']
+
+        changes = []
+        matcher = difflib.SequenceMatcher(None, old_chunks, new_chunks, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag != 'equal':
+                changes.extend(self._differ.changes(
+                    self._data(old_chunks[i1:i2]), self._data(new_chunks[j1:j2])))
+
+        return changes
+
+    def patch(self, old_id, new_id):
+        """
+        Builds a binary patch from one version's program data to another's,
+        see basically_ti_basic.diff.
+        """
+        return self._differ.make_patch(
+            self.program_data(old_id), self.program_data(new_id))
+
+    def stats(self):
+        """
+        Returns how much space the store saves.
+
+        Returns:
+            dict: The total size of every stored version ('logical') and
+                the size of the store's files on disk ('stored')
+        """
+        logical = 0
+        for fname in os.listdir(os.path.join(self.directory, 'versions')):
+            with open(os.path.join(self.directory, 'versions', fname), 'r') as f:
+                logical += json.load(f)['size']
+
+        stored = 0
+        for root, dirs, files in os.walk(self.directory):
+            for fname in files:
+                stored += os.path.getsize(os.path.join(root, fname))
+
+        return {'logical': logical, 'stored': stored}
+
+    def chunk(self, prgm_data):
+        """
+        Splits program tokens into content-defined chunks of whole lines.
+        Whether a chunk ends after a line depends only on that line, so
+        the chunks of two revisions line up again right after an edit.
+
+        Parameters:
+            bytes prgm_data: The program tokens
+        Returns:
+            Array[bytes]: The chunks
+        """
+        chunks = []
+        chunk_start = 0
+        starts = [0] + self._compiler.split_lines(prgm_data, 1)
+        ends = starts[1:] + [len(prgm_data)]
+        for start, end in zip(starts, ends):
+            size = end - chunk_start
+            if size >= ProgramStore.MAX_CHUNK or (
+                    size >= ProgramStore.MIN_CHUNK and
+                    zlib.crc32(prgm_data[start:end]) & ProgramStore.CHUNK_MASK == 0):
+                chunks.append(prgm_data[chunk_start:end])
+                chunk_start = end
+
+        if chunk_start < len(prgm_data):
+            chunks.append(prgm_data[chunk_start:])
+
+        return chunks
+
+    def _data(self, chunk_ids):
+        return b"".join(self._chunk(chunk_id) for chunk_id in chunk_ids)
+
+    def _chunk(self, chunk_id):
+        with open(self._object_path(chunk_id), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def _version(self, version_id):
+        with open(self._version_path(version_id), 'r') as f:
+            return json.load(f)
+
+    def _object_path(self, chunk_id):
+        return os.path.join(self.directory, 'objects', chunk_id)
+
+    def _version_path(self, version_id):
+        return os.path.join(self.directory, 'versions', version_id + '.json')
+
+    def _program_path(self, name):
+        # Names come from headers and may hold anything, such as a '/'
+        return os.path.join(self.directory, 'programs', quote(name, safe='') + '.json')
+
+    def _write(self, path, data):
+        """
+        Writes a file of the store, through a temporary file so a reader
+        never sees half of it.
+        """
+        partial = path + '.partial'
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
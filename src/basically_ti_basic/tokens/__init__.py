@@ -1,12 +1,154 @@
+class TokenTable(object):
+
+    """
+    The tokens of one calculator model. A table is an overlay of the tokens
+    its model adds on top of a parent table, so the definitions for the
+    shared tokens are only written down once. The lookup structures for
+    compiling and decompiling are built the first time they're needed and
+    then shared by everything that uses the table.
+    """
+
+    def __init__(self, name, tokens, parent=None):
+        """
+        Parameters:
+            string name: The model name, e.g. "TI-84+"
+            dict tokens: The tokens this model adds, bytes to plaintext
+            TokenTable parent: The table this one is layered over
+        """
+        self.name = name
+        self.parent = parent
+        self._overlay = tokens
+        self._tokens = None
+        self._inverse = None
+        self._longest = None
+        self._trie = None
+        self._dispatch = None
+
+    def get_tokens(self):
+        """
+        Returns the full table of this model, bytes to plaintext.
+        """
+        if self._tokens is None:
+            if self.parent is None:
+                self._tokens = self._overlay
+            else:
+                merged = dict(self.parent.get_tokens())
+                merged.update(self._overlay)
+                self._tokens = merged
+
+        return self._tokens
+
+    def get_inverse_tokens(self):
+        """
+        Returns the full table of this model flipped, plaintext to bytes.
+        """
+        if self._inverse is None:
+            tokens = self.get_tokens()
+            flipped = dict()
+            for key in tokens:
+                flipped[tokens[key]] = key
+            self._inverse = flipped
+
+        return self._inverse
+
+    def get_longest_token(self):
+        """
+        Returns the length of the longest plaintext token.
+        """
+        if self._longest is None:
+            self._longest = max(len(k) for k in self.get_inverse_tokens())
+
+        return self._longest
+
+    def get_trie(self):
+        """
+        Returns the plaintext of the tokens as a trie of nested dicts, one
+        level per character. The token bytes of a node that ends a token
+        are stored under the key None.
+        """
+        if self._trie is None:
+            trie = dict()
+            for text, token in self.get_inverse_tokens().items():
+                node = trie
+                for char in text:
+                    node = node.setdefault(char, dict())
+                node[None] = token
+            self._trie = trie
+
+        return self._trie
+
+    def get_dispatch(self):
+        """
+        Returns the tokens indexed by their lead byte, for decompiling.
+
+        Returns:
+            (Array[string], Array[dict]): Indexed by the value of the lead
+                byte, the plaintext of the one byte token and a dict of
+                second byte values to the plaintext of the two byte tokens.
+                Either may be None.
+        """
+        if self._dispatch is None:
+            single = [None] * 256
+            double = [None] * 256
+            for token, text in self.get_tokens().items():
+                if len(token) == 1:
+                    single[token[0]] = text
+                else:
+                    if double[token[0]] is None:
+                        double[token[0]] = dict()
+                    double[token[0]][token[1]] = text
+            self._dispatch = (single, double)
+
+        return self._dispatch
+
+def register_table(table):
+    """
+    Makes a token table available to get_table under its model name.
+    """
+    _tables[_model_key(table.name)] = table
+
+def get_table(model=None):
+    """
+    Returns the token table of a calculator model.
+
+    Parameters:
+        string model: The model name, e.g. "TI-84+". Defaults to the TI-83.
+    Returns:
+        TokenTable
+    """
+    if model is None:
+        return _tables[_model_key(DEFAULT_MODEL)]
+
+    try:
+        return _tables[_model_key(model)]
+    except KeyError:
+        raise ValueError("Unknown calculator model: " + str(model) + ", known models: " + ", ".join(get_models()))
+
+def get_models():
+    """
+    Returns the names of the registered models.
+    """
+    return [table.name for table in _tables.values()]
+
+def _model_key(model):
+    return model.upper().replace(" ", "")
+
 def get_tokens():
-    return _tokens
+    return get_table().get_tokens()
 
 def get_inverse_tokens():
-    flipped = dict()
-    for key in _tokens:
-        flipped[_tokens[key]] = key
+    return get_table().get_inverse_tokens()
+
+def get_longest_token():
+    """
+    Returns the length of the longest plaintext token, which is where
+    the greedy match in the compiler starts from.
+    """
+    return get_table().get_longest_token()
+
+DEFAULT_MODEL = 'TI-83'
 
-    return flipped
+_tables = dict()
 
 _tokens = dict([
     (b'\x01', '>DMS'),
@@ -104,7 +246,9 @@ _tokens = dict([
     (b'\x38', '8'),
     (b'\x39', '9'),
     (b'\x5B', '[theta]'),
-    # System variables (incomplete: TODO)
+    # System variables: matrices, lists, equations, pictures, graph
+    # databases, statistics and window settings. Most of the ones commented
+    # out share their plaintext with other tokens
     (b'\x5C\x00', '[A]'),
     (b'\x5C\x01', '[B]'),
     (b'\x5C\x02', '[C]'),
@@ -255,7 +399,55 @@ _tokens = dict([
     (b'\x63\x05', 'V_nStart'),
     (b'\x63\x06', 'U_(n-1)'),
     (b'\x63\x07', 'V_(n-1)'),
-    # \x63\xx values are not complete
+    (b'\x63\x08', 'ZU_nStart'),
+    (b'\x63\x09', 'ZV_nStart'),
+    (b'\x63\x0A', 'Xmin'),
+    (b'\x63\x0B', 'Xmax'),
+    (b'\x63\x0C', 'Ymin'),
+    (b'\x63\x0D', 'Ymax'),
+    (b'\x63\x0E', 'Tmin'),
+    (b'\x63\x0F', 'Tmax'),
+    (b'\x63\x10', '[theta]min'),
+    (b'\x63\x11', '[theta]max'),
+    (b'\x63\x12', 'ZXmin'),
+    (b'\x63\x13', 'ZXmax'),
+    (b'\x63\x14', 'ZYmin'),
+    (b'\x63\x15', 'ZYmax'),
+    (b'\x63\x16', 'Z[theta]min'),
+    (b'\x63\x17', 'Z[theta]max'),
+    (b'\x63\x18', 'ZTmin'),
+    (b'\x63\x19', 'ZTmax'),
+    (b'\x63\x1A', 'TblStart'),
+    (b'\x63\x1B', 'PlotStart'),
+    (b'\x63\x1C', 'ZPlotStart'),
+    (b'\x63\x1D', 'nMax'),
+    (b'\x63\x1E', 'ZnMax'),
+    (b'\x63\x1F', 'nMin'),
+    (b'\x63\x20', 'ZnMin'),
+    (b'\x63\x21', '[Delta]Tbl'),
+    (b'\x63\x22', 'Tstep'),
+    (b'\x63\x23', '[theta]step'),
+    (b'\x63\x24', 'ZTstep'),
+    (b'\x63\x25', 'Z[theta]step'),
+    (b'\x63\x26', '[Delta]X'),
+    (b'\x63\x27', '[Delta]Y'),
+    (b'\x63\x28', 'XFact'),
+    (b'\x63\x29', 'YFact'),
+    (b'\x63\x2A', 'TblInput'),
+    # Unsupported as-is, clashes with the variable N
+    #(b'\x63\x2B', 'N'),
+    (b'\x63\x2C', 'I%'),
+    (b'\x63\x2D', 'PV'),
+    (b'\x63\x2E', 'PMT'),
+    (b'\x63\x2F', 'FV'),
+    (b'\x63\x30', 'P/Y'),
+    (b'\x63\x31', 'C/Y'),
+    (b'\x63\x32', 'W_nStart'),
+    (b'\x63\x33', 'ZW_nStart'),
+    (b'\x63\x34', 'PlotStep'),
+    (b'\x63\x35', 'ZPlotStep'),
+    (b'\x63\x36', 'Xres'),
+    (b'\x63\x37', 'ZXres'),
     (b'\x64', 'Radian'),
     (b'\x65', 'Degree'),
     (b'\x66', 'Normal'),
@@ -346,7 +538,7 @@ _tokens = dict([
     (b'\xA7', 'Tangent('),
     (b'\xA8', 'DrawInv '),
     (b'\xA9', 'DrawF '),
-    # System variables (TODO)
+    # Strings
     (b'\xAA\x00', 'Str1'),
     (b'\xAA\x01', 'Str2'),
     (b'\xAA\x02', 'Str3'),
@@ -373,7 +565,9 @@ _tokens = dict([
     (b'\xB8', 'not('),
     (b'\xB9', 'iPart('),
     (b'\xBA', 'fPart('),
-    # BB tokens (two-byte), Incomplete TODO
+    # BB tokens (two-byte) the TI-83 has. \xBB\x10-\xBB\x6C are in the
+    # TI-83+ overlay below, and the accented letters and symbols at
+    # \xBB\x6D-\xBB\xAF and \xBB\xCB-\xBB\xF5 aren't supported
     (b'\xBB\x00', 'npv('),
     (b'\xBB\x01', 'irr('),
     (b'\xBB\x02', 'bal('),
@@ -489,3 +683,195 @@ _tokens = dict([
     (b'\xFE', 'Scatter'),
     (b'\xFF', 'LinReg(ax+b) '),
     ])
+
+# Tokens added by the TI-83+, on top of the TI-83 tokens above
+_ti83plus_tokens = dict([
+    (b'\xBB\x10', 'normalcdf('),
+    (b'\xBB\x11', 'invNorm('),
+    (b'\xBB\x12', 'tcdf('),
+    (b'\xBB\x13', '[chi]2cdf('),
+    (b'\xBB\x14', 'Fcdf('),
+    (b'\xBB\x15', 'binompdf('),
+    (b'\xBB\x16', 'binomcdf('),
+    (b'\xBB\x17', 'poissonpdf('),
+    (b'\xBB\x18', 'poissoncdf('),
+    (b'\xBB\x19', 'geometpdf('),
+    (b'\xBB\x1A', 'geometcdf('),
+    (b'\xBB\x1B', 'normalpdf('),
+    (b'\xBB\x1C', 'tpdf('),
+    (b'\xBB\x1D', '[chi]2pdf('),
+    (b'\xBB\x1E', 'Fpdf('),
+    (b'\xBB\x1F', 'randNorm('),
+    (b'\xBB\x20', 'tvm_Pmt'),
+    (b'\xBB\x21', 'tvm_I%'),
+    (b'\xBB\x22', 'tvm_PV'),
+    (b'\xBB\x23', 'tvm_N'),
+    (b'\xBB\x24', 'tvm_FV'),
+    (b'\xBB\x25', 'conj('),
+    (b'\xBB\x26', 'real('),
+    (b'\xBB\x27', 'imag('),
+    (b'\xBB\x28', 'angle('),
+    (b'\xBB\x29', 'cumSum('),
+    (b'\xBB\x2A', 'expr('),
+    (b'\xBB\x2B', 'length('),
+    (b'\xBB\x2C', '[Delta]List('),
+    (b'\xBB\x2D', 'ref('),
+    (b'\xBB\x2E', 'rref('),
+    (b'\xBB\x2F', '>Rect'),
+    (b'\xBB\x30', '>Polar'),
+    # Bracketed so it doesn't clash with the lowercase e
+    (b'\xBB\x31', '[e]'),
+    (b'\xBB\x32', 'SinReg '),
+    (b'\xBB\x33', 'Logistic '),
+    (b'\xBB\x34', 'LinRegTTest '),
+    (b'\xBB\x35', 'ShadeNorm('),
+    (b'\xBB\x36', 'Shade_t('),
+    (b'\xBB\x37', 'Shade[chi]2('),
+    (b'\xBB\x38', 'ShadeF('),
+    (b'\xBB\x39', 'Matr>list('),
+    (b'\xBB\x3A', 'List>matr('),
+    (b'\xBB\x3B', 'Z-Test('),
+    (b'\xBB\x3C', 'T-Test '),
+    (b'\xBB\x3D', '2-SampZTest('),
+    (b'\xBB\x3E', '1-PropZTest('),
+    (b'\xBB\x3F', '2-PropZTest('),
+    (b'\xBB\x40', '[chi]2-Test('),
+    (b'\xBB\x41', 'ZInterval '),
+    (b'\xBB\x42', '2-SampZInt('),
+    (b'\xBB\x43', '1-PropZInt('),
+    (b'\xBB\x44', '2-PropZInt('),
+    (b'\xBB\x45', 'GraphStyle('),
+    (b'\xBB\x46', '2-SampTTest '),
+    (b'\xBB\x47', '2-SampFTest '),
+    (b'\xBB\x48', 'TInterval '),
+    (b'\xBB\x49', '2-SampTInt '),
+    (b'\xBB\x4A', 'SetUpEditor '),
+    (b'\xBB\x4B', 'Pmt_End'),
+    (b'\xBB\x4C', 'Pmt_Bgn'),
+    (b'\xBB\x4D', 'Real'),
+    (b'\xBB\x4E', 're^[theta]i'),
+    (b'\xBB\x4F', 'a+bi'),
+    (b'\xBB\x50', 'ExprOn'),
+    (b'\xBB\x51', 'ExprOff'),
+    (b'\xBB\x52', 'ClrAllLists'),
+    (b'\xBB\x53', 'GetCalc('),
+    (b'\xBB\x54', 'DelVar '),
+    (b'\xBB\x55', 'Equ>String('),
+    (b'\xBB\x56', 'String>Equ('),
+    (b'\xBB\x57', 'Clear Entries'),
+    (b'\xBB\x58', 'Select('),
+    (b'\xBB\x59', 'ANOVA('),
+    (b'\xBB\x5A', 'ModBoxplot'),
+    (b'\xBB\x5B', 'NormProbPlot'),
+    # \xBB\x5C-\xBB\x63 are unused
+    (b'\xBB\x64', 'G-T'),
+    (b'\xBB\x65', 'ZoomFit'),
+    (b'\xBB\x66', 'DiagnosticOn'),
+    (b'\xBB\x67', 'DiagnosticOff'),
+    (b'\xBB\x68', 'Archive '),
+    (b'\xBB\x69', 'UnArchive '),
+    (b'\xBB\x6A', 'Asm('),
+    (b'\xBB\x6B', 'AsmComp('),
+    (b'\xBB\x6C', 'AsmPrgm'),
+    ])
+
+# Tokens added by the TI-84+ (EF tokens, two-byte), on top of the TI-83+
+_ti84plus_tokens = dict([
+    (b'\xEF\x00', 'setDate('),
+    (b'\xEF\x01', 'setTime('),
+    (b'\xEF\x02', 'checkTmr('),
+    (b'\xEF\x03', 'setDtFmt('),
+    (b'\xEF\x04', 'setTmFmt('),
+    (b'\xEF\x05', 'timeCnv('),
+    (b'\xEF\x06', 'dayOfWk('),
+    (b'\xEF\x07', 'getDtStr('),
+    (b'\xEF\x08', 'getTmStr('),
+    (b'\xEF\x09', 'getDate'),
+    (b'\xEF\x0A', 'getTime'),
+    (b'\xEF\x0B', 'startTmr'),
+    (b'\xEF\x0C', 'getDtFmt'),
+    (b'\xEF\x0D', 'getTmFmt'),
+    (b'\xEF\x0E', 'isClockOn'),
+    (b'\xEF\x0F', 'ClockOff'),
+    (b'\xEF\x10', 'ClockOn'),
+    (b'\xEF\x11', 'OpenLib('),
+    (b'\xEF\x12', 'ExecLib'),
+    (b'\xEF\x13', 'invT('),
+    (b'\xEF\x14', '[chi]2GOF-Test('),
+    (b'\xEF\x15', 'LinRegTInt '),
+    (b'\xEF\x16', 'Manual-Fit '),
+    (b'\xEF\x17', 'ZQuadrant1'),
+    (b'\xEF\x18', 'ZFrac1/2'),
+    (b'\xEF\x19', 'ZFrac1/3'),
+    (b'\xEF\x1A', 'ZFrac1/4'),
+    (b'\xEF\x1B', 'ZFrac1/5'),
+    (b'\xEF\x1C', 'ZFrac1/8'),
+    (b'\xEF\x1D', 'ZFrac1/10'),
+    # MathPrint tokens (OS 2.53MP and up). \xEF\x1E-\xEF\x2D aren't
+    # typed into programs, so they have no plaintext here
+    (b'\xEF\x2E', '[n/d]'),
+    (b'\xEF\x2F', '[Un/d]'),
+    (b'\xEF\x30', '>n/d<>Un/d'),
+    (b'\xEF\x31', '>F<>D'),
+    (b'\xEF\x32', 'remainder('),
+    (b'\xEF\x33', '[Summ]('),
+    (b'\xEF\x34', 'logBASE('),
+    (b'\xEF\x35', 'randIntNoRep('),
+    (b'\xEF\x36', 'MATHPRINT'),
+    (b'\xEF\x38', 'CLASSIC'),
+    (b'\xEF\x39', 'n/d'),
+    (b'\xEF\x3A', 'Un/d'),
+    (b'\xEF\x3B', 'AUTO'),
+    (b'\xEF\x3C', 'DEC'),
+    (b'\xEF\x3D', 'FRAC'),
+    ])
+
+# Tokens added by the color models (TI-84+CSE and TI-84+CE): the colors,
+# the images and the home screen and graph screen settings, and the
+# commands added by the CE's OS 5.2
+_ti84pce_tokens = dict([
+    (b'\xEF\x41', 'BLUE'),
+    (b'\xEF\x42', 'RED'),
+    (b'\xEF\x43', 'BLACK'),
+    (b'\xEF\x44', 'MAGENTA'),
+    (b'\xEF\x45', 'GREEN'),
+    (b'\xEF\x46', 'ORANGE'),
+    (b'\xEF\x47', 'BROWN'),
+    (b'\xEF\x48', 'NAVY'),
+    (b'\xEF\x49', 'LTBLUE'),
+    (b'\xEF\x4A', 'YELLOW'),
+    (b'\xEF\x4B', 'WHITE'),
+    (b'\xEF\x4C', 'LTGRAY'),
+    (b'\xEF\x4D', 'MEDGRAY'),
+    (b'\xEF\x4E', 'GRAY'),
+    (b'\xEF\x4F', 'DARKGRAY'),
+    (b'\xEF\x50', 'Image1'),
+    (b'\xEF\x51', 'Image2'),
+    (b'\xEF\x52', 'Image3'),
+    (b'\xEF\x53', 'Image4'),
+    (b'\xEF\x54', 'Image5'),
+    (b'\xEF\x55', 'Image6'),
+    (b'\xEF\x56', 'Image7'),
+    (b'\xEF\x57', 'Image8'),
+    (b'\xEF\x58', 'Image9'),
+    (b'\xEF\x59', 'Image0'),
+    (b'\xEF\x5A', 'GridLine '),
+    (b'\xEF\x5B', 'BackgroundOn '),
+    # \xEF\x5C-\xEF\x63 are unused
+    (b'\xEF\x64', 'BackgroundOff'),
+    (b'\xEF\x65', 'GraphColor('),
+    (b'\xEF\x66', 'QuickPlot&Fit-EQ'),
+    (b'\xEF\x67', 'TextColor('),
+    (b'\xEF\x68', 'Asm84CPrgm'),
+    (b'\xEF\x6A', 'DetectAsymOn'),
+    (b'\xEF\x6B', 'DetectAsymOff'),
+    (b'\xEF\x6C', 'BorderColor '),
+    (b'\xEF\x96', 'Wait '),
+    (b'\xEF\x97', 'toString('),
+    (b'\xEF\x98', 'eval('),
+    ])
+
+register_table(TokenTable('TI-83', _tokens))
+register_table(TokenTable('TI-83+', _ti83plus_tokens, get_table('TI-83')))
+register_table(TokenTable('TI-84+', _ti84plus_tokens, get_table('TI-83+')))
+register_table(TokenTable('TI-84+CE', _ti84pce_tokens, get_table('TI-84+')))
@@ -0,0 +1,31 @@
+"""
+Shared by the tests: puts the package on the path and builds .8Xp files.
+"""
+import os
+import struct
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+def make_8xp(tokens, name=b'PROG', variable_header=13):
+    """
+    Returns the bytes of a .8Xp file laid out as a calculator writes it,
+    with an 11 or 13 byte variable header.
+    """
+    data = struct.pack('<HHB', variable_header, len(tokens) + 2, 0x05) + name.ljust(8, b'\x00')
+    if variable_header == 13:
+        data += b'\x00\x00'
+    data += struct.pack('<HH', len(tokens) + 2, len(tokens)) + tokens
+    header = b'**TI83F*\x1a\n\x00' + b'test'.ljust(42, b'\x00') + struct.pack('<H', len(data))
+    return header + data + struct.pack('<H', sum(data) & 0xFFFF)
+
+def write_8xp(directory, fname, tokens, name=b'PROG', variable_header=13):
+    """
+    Writes a .8Xp file built by make_8xp and returns its path.
+    """
+    path = os.path.join(directory, fname)
+    with open(path, 'wb') as f:
+        f.write(make_8xp(tokens, name, variable_header))
+    return path
@@ -0,0 +1,94 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from helpers import SRC, write_8xp
+from basically_ti_basic.batch import BatchDecompiler
+from basically_ti_basic.compiler import PrgmCompiler, Diagnostics
+from basically_ti_basic.files import TIPrgmFile
+
+LINES = ['ClrHome\n', 'Disp "HELLO",A\n', 'Output(3,1,"X")\n', 'For I,1,10\n', 'End\n']
+
+class BatchDecompilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.compiler = PrgmCompiler()
+        self.files = []
+        for number in range(12):
+            lines = [LINES[(number + i) % len(LINES)] for i in range(number + 3)]
+            tokens = b"".join(self.compiler.compile(lines).prgmdata)
+            self.files.append(write_8xp(
+                self.directory.name, 'P{0}.8Xp'.format(number), tokens,
+                variable_header=11 if number % 2 else 13))
+        # Written by TIPrgmFile.writeOut, whose header isn't laid out like
+        # a calculator's
+        path = os.path.join(self.directory.name, 'LEGACY.8Xp')
+        self.compiler.compile(LINES).writeOut(path)
+        self.files.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check(self, results):
+        self.assertEqual(len(results), len(self.files))
+        for filename, (name, lines, diagnostics) in zip(self.files, results):
+            self.assertEqual(name, filename)
+            expected = Diagnostics('skip')
+            self.assertEqual(lines, self.compiler.decompile(TIPrgmFile(filename), expected))
+            self.assertEqual(
+                [str(diagnostic) for diagnostic in diagnostics],
+                [str(diagnostic) for diagnostic in expected])
+
+    def test_matches_decompiling_each_file(self):
+        self.check(BatchDecompiler(workers=2).decompile_files(self.files))
+
+    def test_windows_of_a_small_output_arena(self):
+        arena = BatchDecompiler.OUTPUT_ARENA
+        BatchDecompiler.OUTPUT_ARENA = 200
+        try:
+            self.check(BatchDecompiler(workers=2).decompile_files(self.files))
+        finally:
+            BatchDecompiler.OUTPUT_ARENA = arena
+
+    def test_unreadable_file_does_not_stop_the_batch(self):
+        short = os.path.join(self.directory.name, 'SHORT.8Xp')
+        with open(short, 'wb') as f:
+            f.write(b'**TI83F*' + b'\x00' * 32)
+        results = BatchDecompiler(workers=2).decompile_files([short] + self.files)
+
+        name, lines, diagnostics = results[0]
+        self.assertEqual(name, short)
+        self.assertIsNone(lines)
+        self.assertIn("too short", diagnostics.summary())
+        self.check(results[1:])
+
+class BatchCommandTest(unittest.TestCase):
+
+    def test_same_names_in_different_directories(self):
+        compiler = PrgmCompiler()
+        with tempfile.TemporaryDirectory() as directory:
+            programs = os.path.join(directory, 'programs')
+            for subdirectory, text in (('a', 'Disp "A"\n'), ('b', 'Disp "B"\n')):
+                os.makedirs(os.path.join(programs, subdirectory))
+                tokens = b"".join(compiler.compile([text]).prgmdata)
+                write_8xp(os.path.join(programs, subdirectory), 'P.8Xp', tokens)
+            with open(os.path.join(programs, 'BAD.8Xp'), 'wb') as f:
+                f.write(b'\x00' * 40)
+
+            output = os.path.join(directory, 'text')
+            result = subprocess.run(
+                [sys.executable, '-m', 'basically_ti_basic', '--batch', '-j', '1', '-i', programs, '-o', output],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                env=dict(os.environ, PYTHONPATH=SRC))
+
+            self.assertEqual(result.returncode, 0)
+            self.assertIn('BAD.8Xp', result.stderr)
+            for subdirectory, text in (('a', 'Disp "A"\n'), ('b', 'Disp "B"\n')):
+                with open(os.path.join(output, subdirectory, 'P.txt')) as f:
+                    self.assertEqual(f.read(), text + "\n")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from helpers import write_8xp
+from basically_ti_basic.catalog import ProgramCatalog
+from basically_ti_basic.compiler import PrgmCompiler
+
+class ProgramCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.programs = os.path.join(self.directory.name, 'programs')
+        os.makedirs(os.path.join(self.programs, 'games'))
+        self.index = os.path.join(self.directory.name, 'index.json')
+        self.compiler = PrgmCompiler()
+
+        self.write('A.8Xp', ['ClrHome', 'Output(1,1,"A")', 'Output(2,1,"B")'], b'A')
+        self.write('B.8Xp', ['Disp "HELLO"'], b'B')
+        self.write(os.path.join('games', 'C.8Xp'), ['Output(1,1,"C")'] + ['Disp 1'] * 20, b'C')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, fname, lines, name):
+        tokens = b"".join(self.compiler.compile([line + "\n" for line in lines]).prgmdata)
+        return write_8xp(self.programs, fname, tokens, name)
+
+    def catalog(self, model=None):
+        catalog = ProgramCatalog(self.index, model)
+        files_read = catalog.update(self.programs)
+        catalog.save()
+        return catalog, files_read
+
+    def test_only_changed_files_are_read(self):
+        catalog, files_read = self.catalog()
+        self.assertEqual(files_read, 3)
+        self.assertEqual(self.catalog()[1], 0)
+
+        self.write('B.8Xp', ['Disp "HELLO"', 'Disp "AGAIN"'], b'B')
+        catalog, files_read = self.catalog()
+        self.assertEqual(files_read, 1)
+        self.assertEqual(
+            catalog.entries[os.path.abspath(os.path.join(self.programs, 'B.8Xp'))]['tokens']['Disp '], 2)
+
+    def test_deleted_files_are_dropped(self):
+        self.catalog()
+        os.remove(os.path.join(self.programs, 'games', 'C.8Xp'))
+        catalog, files_read = self.catalog()
+        self.assertEqual(files_read, 0)
+        self.assertEqual(sorted(entry['name'] for entry in catalog.entries.values()), ['A', 'B'])
+
+    def test_rebuilt_for_another_model(self):
+        self.catalog()
+        self.assertEqual(self.catalog('TI-83+')[1], 3)
+        self.assertEqual(self.catalog('TI-83+')[1], 0)
+
+    def test_rebuilt_from_corrupt_index(self):
+        for contents in ('{"version": 1, "entr', '[]', '{"version": 1, "model": null, "entries": []}'):
+            with open(self.index, 'w') as f:
+                f.write(contents)
+            catalog, files_read = self.catalog()
+            self.assertEqual(files_read, 3)
+            self.assertEqual(len(catalog.entries), 3)
+
+    def test_uses_and_largest(self):
+        catalog = self.catalog()[0]
+        self.assertEqual([entry['name'] for entry in catalog.uses('Output(')], ['A', 'C'])
+        self.assertEqual(catalog.uses('Pause '), [])
+        self.assertEqual([entry['name'] for entry in catalog.largest()], ['C', 'A', 'B'])
+        self.assertEqual([entry['name'] for entry in catalog.largest(1)], ['C'])
+
+if __name__ == '__main__':
+    unittest.main()
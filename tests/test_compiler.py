@@ -0,0 +1,179 @@
+import random
+import unittest
+
+import helpers
+from basically_ti_basic.compiler import PrgmCompiler, Diagnostics, LineCache, TokenError
+from basically_ti_basic.files import TIPrgmFile
+
+LINES = [
+    'ClrHome', 'Disp "HELLO",A', 'Output(3,1,"X")', 'For I,1,10', 'End',
+    '2-PropZTest(1,2,3,4', 'randInt(1,6)→D', 'If A>B:Then',
+    ]
+
+def program_file(prgm_data):
+    tifile = TIPrgmFile()
+    tifile.prgmdata = prgm_data
+    return tifile
+
+class ParallelDecompileTest(unittest.TestCase):
+
+    def setUp(self):
+        # On the TI-83+, 2-PropZTest( is BB 3F, ending in the newline byte
+        self.compiler = PrgmCompiler('TI-83+')
+        generator = random.Random(4)
+        lines = [generator.choice(LINES) + "\n" for _ in range(3000)]
+        self.prgm_data = b"".join(self.compiler.compile(lines).prgmdata)
+
+    def test_split_lines_starts_chunks_on_lines(self):
+        line_starts = set(
+            offset + 1 for offset, token, text in self.compiler.tokenize(self.prgm_data)
+            if text == "\n")
+        for chunk_size in (1, 7, 100, 4096):
+            boundaries = self.compiler.split_lines(self.prgm_data, chunk_size)
+            self.assertTrue(boundaries)
+            self.assertLessEqual(set(boundaries), line_starts)
+            for start, end in zip([0] + boundaries, boundaries):
+                self.assertGreaterEqual(end - start, chunk_size)
+
+    def test_split_lines_skips_two_byte_tokens(self):
+        token_ends = [
+            offset + 2 for offset, token, text in self.compiler.tokenize(self.prgm_data)
+            if token == b'\xBB\x3F']
+        self.assertTrue(token_ends)
+        boundaries = set(self.compiler.split_lines(self.prgm_data, 1))
+        self.assertFalse(boundaries & set(token_ends))
+
+    def test_matches_decompile(self):
+        # Bytes that aren't tokens, so there is something to record
+        prgm_data = self.prgm_data[:5000] + b'\xEF\xFF\x3F' + self.prgm_data[5000:]
+        expected = Diagnostics('skip')
+        lines = self.compiler.decompile(program_file(prgm_data), expected)
+
+        found = Diagnostics('skip')
+        self.assertEqual(
+            self.compiler.decompile_parallel(program_file(prgm_data), found, workers=2, chunk_size=1024),
+            lines)
+        self.assertEqual([str(d) for d in found], [str(d) for d in expected])
+        self.assertTrue(list(expected))
+
+class LineCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_line_is_dropped(self):
+        cache = LineCache(maxsize=2, max_line=4)
+        cache.put(b'\x31\x3F', '1')
+        cache.put(b'\x32\x3F', '2')
+        self.assertEqual(cache.get(memoryview(b'\x31\x3F')), '1')
+        cache.put(b'\x33\x3F', '3')
+        self.assertIsNone(cache.get(b'\x32\x3F'))
+        self.assertEqual(cache.get(b'\x33\x3F'), '3')
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (2, 1, 2))
+
+        cache.put(b'\x31\x32\x33\x34\x3F', 'too long')
+        self.assertIsNone(cache.get(b'\x31\x32\x33\x34\x3F'))
+        cache.clear()
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 0, 0))
+
+    def test_cached_decompile_matches(self):
+        generator = random.Random(5)
+        lines = [generator.choice(LINES) + "\n" for _ in range(500)]
+        prgm_data = b"".join(PrgmCompiler('TI-83+').compile(lines).prgmdata) + b'\xEF\xFF\x3F'
+        self.assertIn(b'\xBB\x3F', prgm_data)
+
+        expected = Diagnostics('skip')
+        plain = PrgmCompiler('TI-83+').decompile(program_file(prgm_data), expected)
+        self.assertIn('2-PropZTest(1,2,3,4', plain)
+
+        cache = LineCache(maxsize=4)
+        compiler = PrgmCompiler('TI-83+', cache)
+        for _ in range(2):
+            found = Diagnostics('skip')
+            self.assertEqual(compiler.decompile(program_file(prgm_data), found), plain)
+            self.assertEqual([str(d) for d in found], [str(d) for d in expected])
+        self.assertGreater(cache.hits, 0)
+
+    def test_two_byte_token_line_is_cached(self):
+        # 2-PropZTest( is BB 3F, so the line is only cached if the newline
+        # byte inside the token isn't taken for the end of the line
+        line = b'\xBB\x3F\x31\x2B\x32\x2B\x33\x2B\x34\x3F'
+        compiler = PrgmCompiler('TI-83+', LineCache())
+        decompiled = compiler.decompile(program_file(line * 3))
+        self.assertEqual(decompiled, ['2-PropZTest(1,2,3,4'] * 3 + [''])
+        self.assertEqual(compiler.line_cache.get(line), '2-PropZTest(1,2,3,4\n')
+        self.assertEqual(compiler.line_cache.hits, 3)
+
+class DiagnosticsTest(unittest.TestCase):
+
+    # ClrHome, then Disp "A with a byte that isn't a token after the A
+    DATA = b'\xE1\x3F\xDE\x2A\x41\xEF\x2A\x3F'
+    TEXT = ['ClrHome\n', 'Disp "A"€1\n']
+
+    def setUp(self):
+        self.compiler = PrgmCompiler()
+
+    def decompile(self, policy):
+        diagnostics = Diagnostics(policy)
+        return self.compiler.decompile(program_file(self.DATA), diagnostics), diagnostics
+
+    def compile(self, policy):
+        diagnostics = Diagnostics(policy)
+        return b"".join(self.compiler.compile(self.TEXT, diagnostics).prgmdata), diagnostics
+
+    def test_decompile_skip(self):
+        lines, diagnostics = self.decompile('skip')
+        self.assertEqual(lines, ['ClrHome', 'Disp "A"', ''])
+        self.assertEqual(
+            [(d.offset, d.value, d.line, d.column) for d in diagnostics],
+            [(5, b'\xEF', 2, 8)])
+        self.assertEqual(
+            [str(d) for d in diagnostics],
+            ['line 2, column 8 (offset 5): could not decode byte 0xEF'])
+        self.assertEqual(diagnostics.summary('P'), 'P: 1 problem, first at line 2, column 8')
+
+    def test_decompile_placeholder(self):
+        lines, diagnostics = self.decompile('placeholder')
+        self.assertEqual(lines, ['ClrHome', 'Disp "A[?EF]"', ''])
+        self.assertEqual(len(diagnostics), 1)
+
+    def test_decompile_raise(self):
+        with self.assertRaises(TokenError) as error:
+            self.decompile('raise')
+        diagnostic = error.exception.diagnostic
+        self.assertEqual((diagnostic.offset, diagnostic.value, diagnostic.line, diagnostic.column), (5, b'\xEF', 2, 8))
+        self.assertEqual(str(error.exception), str(diagnostic))
+
+    def test_compile_skip(self):
+        prgm_data, diagnostics = self.compile('skip')
+        self.assertEqual(prgm_data, b'\xE1\x3F\xDE\x2A\x41\x2A\x31\x3F')
+        self.assertEqual(
+            [(d.offset, d.value, d.line, d.column) for d in diagnostics],
+            [(16, '€', 2, 9)])
+        self.assertEqual(
+            [str(d) for d in diagnostics],
+            ["line 2, column 9 (offset 16): could not compile '€'"])
+
+    def test_compile_placeholder(self):
+        prgm_data, diagnostics = self.compile('placeholder')
+        # The ? token
+        self.assertEqual(prgm_data, b'\xE1\x3F\xDE\x2A\x41\x2A\xAF\x31\x3F')
+        self.assertEqual(len(diagnostics), 1)
+
+    def test_compile_raise(self):
+        with self.assertRaises(TokenError) as error:
+            self.compile('raise')
+        self.assertEqual(error.exception.diagnostic.value, '€')
+        # Raising is the default when compiling
+        with self.assertRaises(TokenError):
+            self.compiler.compile(self.TEXT)
+
+    def test_clean_program(self):
+        diagnostics = Diagnostics('raise')
+        self.compiler.decompile(program_file(b'\xE1\x3F'), diagnostics)
+        self.assertFalse(diagnostics)
+        self.assertEqual(diagnostics.summary(), 'no problems')
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Diagnostics('ignore')
+
+if __name__ == '__main__':
+    unittest.main()
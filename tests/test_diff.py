@@ -0,0 +1,152 @@
+import random
+import tempfile
+import unittest
+
+import helpers
+from helpers import write_8xp
+from basically_ti_basic import diff
+from basically_ti_basic.compiler import PrgmCompiler
+from basically_ti_basic.diff import PrgmDiffer, PatchError, apply_patch, patch_file, read_program
+
+LINES = [
+    'ClrHome', 'Disp "HELLO",A', 'Output(3,1,"X")', 'For I,1,10', 'End',
+    'A+B→C', '2-PropZTest(1,2,3,4', 'randInt(1,6)→D', 'If A>B:Then', 'Lbl A', 'Goto A',
+    ]
+
+def lcs_length(a, b):
+    lengths = [0] * (len(b) + 1)
+    for x in a:
+        previous = 0
+        for j, y in enumerate(b):
+            current = lengths[j + 1]
+            lengths[j + 1] = previous + 1 if x == y else max(lengths[j + 1], lengths[j])
+            previous = current
+    return lengths[-1]
+
+def rebuild(a, b, opcodes):
+    """
+    Rebuilds b from a and opcodes, taking only what the opcodes say is
+    equal from a.
+    """
+    result = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+            result.extend(a[i1:i2])
+        else:
+            result.extend(b[j1:j2])
+    return result
+
+class MatchingBlocksTest(unittest.TestCase):
+
+    def check_blocks(self, a, b, blocks):
+        last_a = last_b = 0
+        for i, j, size in blocks:
+            self.assertGreaterEqual(i, last_a)
+            self.assertGreaterEqual(j, last_b)
+            self.assertEqual(a[i:i + size], b[j:j + size])
+            last_a, last_b = i + size, j + size
+        self.assertEqual(rebuild(a, b, diff._opcodes(a, b)), list(b))
+
+    def test_common_subsequence_is_longest(self):
+        generator = random.Random(1)
+        for _ in range(500):
+            a = [generator.randrange(4) for _ in range(generator.randrange(30))]
+            b = [generator.randrange(4) for _ in range(generator.randrange(30))]
+            blocks = diff._matching_blocks(a, b)
+            self.check_blocks(a, b, blocks)
+            self.assertEqual(sum(size for i, j, size in blocks), lcs_length(a, b))
+
+    def test_cost_cutoff_still_gives_a_valid_script(self):
+        generator = random.Random(2)
+        cost = diff.MAX_COST
+        diff.MAX_COST = 3
+        try:
+            for _ in range(200):
+                a = [generator.randrange(6) for _ in range(generator.randrange(80))]
+                b = [generator.randrange(6) for _ in range(generator.randrange(80))]
+                self.check_blocks(a, b, diff._matching_blocks(a, b))
+        finally:
+            diff.MAX_COST = cost
+
+class PatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.compiler = PrgmCompiler()
+        self.differ = PrgmDiffer()
+        self.generator = random.Random(3)
+
+    def program(self, lines):
+        return b"".join(self.compiler.compile([line + "\n" for line in lines]).prgmdata)
+
+    def edited(self):
+        old = [self.generator.choice(LINES) for _ in range(self.generator.randrange(1, 60))]
+        new = list(old)
+        for _ in range(self.generator.randrange(6)):
+            position = self.generator.randrange(len(new) + 1)
+            if new and self.generator.random() < 0.5:
+                del new[position:position + self.generator.randrange(1, 4)]
+            else:
+                new[position:position] = [self.generator.choice(LINES)]
+        return self.program(old), self.program(new)
+
+    def test_round_trip(self):
+        for _ in range(200):
+            old, new = self.edited()
+            old_tokens = self.differ.tokens(old)
+            new_tokens = self.differ.tokens(new)
+            self.assertEqual(rebuild(old_tokens, new_tokens, self.differ.diff(old, new)), new_tokens)
+            self.assertEqual(apply_patch(old, self.differ.make_patch(old, new)), new)
+
+    def test_round_trip_past_the_cost_cutoff(self):
+        cost = diff.MAX_COST
+        diff.MAX_COST = 2
+        try:
+            for _ in range(50):
+                old, new = self.edited()
+                self.assertEqual(apply_patch(old, self.differ.make_patch(old, new)), new)
+            # A reversed program is the worst case for the search
+            lines = [line + " " + str(number) for number, line in enumerate(LINES * 20)]
+            old, new = self.program(lines), self.program(lines[::-1])
+            self.assertEqual(apply_patch(old, self.differ.make_patch(old, new)), new)
+        finally:
+            diff.MAX_COST = cost
+
+    def test_changes(self):
+        old = self.program(['ClrHome', 'Disp "HELLO",A', 'End'])
+        new = self.program(['ClrHome', 'Disp "HELLO",B', 'End'])
+        self.assertEqual(self.differ.changes(old, new), [('replace', 'A', 'B')])
+
+    def test_truncated_patches_are_refused(self):
+        old, new = self.edited()
+        patch = self.differ.make_patch(old, new)
+        for length in range(len(patch)):
+            with self.assertRaises(PatchError):
+                apply_patch(old, patch[:length])
+
+    def test_damaged_patches_are_refused(self):
+        old, new = self.edited()
+        patch = self.differ.make_patch(old, new)
+        for position in range(len(patch)):
+            damaged = bytearray(patch)
+            damaged[position] ^= 0xFF
+            with self.assertRaises(PatchError):
+                apply_patch(old, bytes(damaged))
+
+    def test_patch_for_another_program_is_refused(self):
+        old, new = self.edited()
+        with self.assertRaises(PatchError):
+            apply_patch(old + b'\x3F', self.differ.make_patch(old, new))
+
+    def test_patch_file(self):
+        old, new = self.edited()
+        with tempfile.TemporaryDirectory() as directory:
+            old_file = write_8xp(directory, 'OLD.8Xp', old, b'PROG', 11)
+            new_file = directory + '/NEW.8Xp'
+            patch_file(old_file, self.differ.make_patch(old, new), new_file)
+            self.assertEqual(read_program(new_file), new)
+            with open(new_file, 'rb') as f:
+                self.assertEqual(f.read(), helpers.make_8xp(new, b'PROG', 11))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from helpers import SRC, make_8xp, write_8xp
+from basically_ti_basic.files import TIPrgmFile, TIPrgmHeader, TIVarContainer
+
+TOKENS = b'\xE1\x3F\xDE\x2A\x48\x49\x2A\x3F'
+
+def make_var_file(data):
+    """
+    Returns the bytes of a TI variable file holding the given entries.
+    """
+    header = b'**TI83F*\x1a\n\x00' + b'test'.ljust(42, b'\x00') + struct.pack('<H', len(data))
+    return header + data + struct.pack('<H', sum(data) & 0xFFFF)
+
+def make_entry(typeId, name, data, variable_header=13):
+    """
+    Returns the bytes of one variable entry, with an 11 or 13 byte header.
+    """
+    entry = struct.pack('<HHB', variable_header, len(data), typeId) + name.ljust(8, b'\x00')
+    if variable_header == 13:
+        entry += b'\x00\x80'
+    return entry + struct.pack('<H', len(data)) + data
+
+class TIPrgmHeaderTest(unittest.TestCase):
+
+    def test_fields(self):
+        for variable_header in (11, 13):
+            raw = make_8xp(TOKENS, b'HELLO', variable_header)
+            header = TIPrgmHeader(raw)
+            self.assertTrue(header.isValid())
+            self.assertTrue(header.isConsistent(len(raw)))
+            self.assertEqual(header.name, 'HELLO')
+            self.assertEqual(header.type, 'Program')
+            self.assertEqual(header.variableHeaderLength, variable_header)
+            self.assertEqual(header.programLength, len(TOKENS))
+            self.assertEqual(header.programSpan(len(raw)), (header.dataOffset, len(raw) - 2))
+            self.assertEqual(str(header), "Program HELLO (8 bytes)")
+
+    def test_short_buffers_are_refused(self):
+        raw = make_8xp(TOKENS)
+        for size in (0, 55, 72, TIPrgmHeader.SIZE - 1):
+            with self.assertRaises(RuntimeError):
+                TIPrgmHeader(raw[:size])
+
+    def test_str(self):
+        self.assertEqual(str(TIPrgmHeader(make_8xp(TOKENS, b'HELLO'))), 'Program HELLO (8 bytes)')
+        raw = bytearray(make_8xp(TOKENS))
+        raw[:8] = b'NOTATIFL'
+        self.assertEqual(str(TIPrgmHeader(raw)), 'Program PROG (? bytes)')
+
+    def test_odd_variable_header_length(self):
+        raw = bytearray(make_8xp(TOKENS))
+        raw[55] = 200
+        header = TIPrgmHeader(raw)
+        with self.assertRaises(RuntimeError):
+            header.programLength
+        self.assertEqual(str(header), 'Program PROG (? bytes)')
+        self.assertFalse(header.isConsistent(len(raw)))
+        self.assertEqual(header.programSpan(len(raw)), (TIPrgmHeader.SIZE, len(raw) - 2))
+
+class TIPrgmFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reads_tokens_after_either_variable_header(self):
+        for variable_header in (11, 13):
+            path = write_8xp(self.directory.name, 'P.8Xp', TOKENS, variable_header=variable_header)
+            self.assertEqual(b"".join(TIPrgmFile(path).prgmdata), TOKENS)
+
+    def test_short_file_has_no_header(self):
+        path = os.path.join(self.directory.name, 'SHORT.8Xp')
+        with open(path, 'wb') as f:
+            f.write(make_8xp(TOKENS)[:72])
+        tifile = TIPrgmFile(path)
+        self.assertIsNone(tifile.header)
+        self.assertIsNone(tifile.prgmdata)
+
+class TIVarContainerTest(unittest.TestCase):
+
+    def test_program_entry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_8xp(directory, 'P.8Xp', TOKENS, b'HELLO')
+            with TIVarContainer(path) as container:
+                entries = list(container)
+                self.assertEqual([entry.name for entry in entries], ['HELLO'])
+                self.assertEqual(bytes(entries[0].prgmdata), TOKENS)
+
+    def test_group_entries(self):
+        program = struct.pack('<H', len(TOKENS)) + TOKENS
+        real = b'\x00\x80\x42\x00\x00\x00\x00\x00\x00'
+        data = make_entry(0x05, b'FIRST', program) + \
+            make_entry(0x00, b'A', real, 11) + \
+            make_entry(0x06, b'LAST', program, 11)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'G.8Xg')
+            with open(path, 'wb') as f:
+                f.write(make_var_file(data))
+            with TIVarContainer(path) as container:
+                entries = list(container)
+                self.assertEqual([entry.name for entry in entries], ['FIRST', 'A', 'LAST'])
+                self.assertEqual([entry.typeId for entry in entries], [0x05, 0x00, 0x06])
+                self.assertEqual([entry.archived for entry in entries], [True, False, False])
+                self.assertEqual(bytes(entries[0].prgmdata), TOKENS)
+                self.assertIsNone(entries[1].prgmdata)
+                self.assertEqual(bytes(entries[1].data), real)
+                self.assertEqual(bytes(entries[2].prgmdata), TOKENS)
+                self.assertEqual(container.find('LAST').offset, entries[2].offset)
+                self.assertIsNone(container.find('MISSING'))
+
+    def test_backup_is_refused(self):
+        blocks = (b'\x01' * 4, b'\x02' * 3, b'\x03' * 5)
+        data = struct.pack('<HHBHHHH', 9, len(blocks[0]), 0x13, len(blocks[1]), len(blocks[2]), 0x9D95, len(blocks[0]))
+        data += blocks[0] + struct.pack('<H', len(blocks[1])) + blocks[1] + struct.pack('<H', len(blocks[2])) + blocks[2]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'B.8Xb')
+            with open(path, 'wb') as f:
+                f.write(make_var_file(data))
+            with self.assertRaises(RuntimeError) as error:
+                TIVarContainer(path)
+            self.assertIn('backup', str(error.exception))
+
+            result = subprocess.run(
+                [sys.executable, '-m', 'basically_ti_basic', '--entries', '-i', path],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                env=dict(os.environ, PYTHONPATH=SRC))
+            self.assertEqual(result.returncode, 1)
+            self.assertNotIn('Traceback', result.stderr)
+            self.assertIn('backup', result.stderr)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import random
+import tempfile
+import unittest
+
+from helpers import write_8xp
+from basically_ti_basic.compiler import PrgmCompiler
+from basically_ti_basic.files import TIPrgmFile
+from basically_ti_basic.search import ProgramSearcher
+
+LINES = [
+    'ClrHome', 'Disp "HELLO",A', 'For I,1,10', 'End', 'A+B→C',
+    'Output(3,1,"X")', 'Output(4,4,"Y")',
+    # \xBB\x3F on the TI-83+: a 0x3F byte that isn't a newline, before,
+    # after and between matches
+    '2-PropZTest(1,2,3,4', '2-PropZTest(1:Output(3,1,"Z")', 'Output(3,2,A):2-PropZTest(2',
+    ]
+
+class ProgramSearcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.compiler = PrgmCompiler('TI-83+')
+        generator = random.Random(6)
+        self.files = []
+        for number in range(20):
+            lines = [generator.choice(LINES) + "\n" for _ in range(generator.randrange(1, 300))]
+            tokens = b"".join(self.compiler.compile(lines).prgmdata)
+            self.files.append(write_8xp(
+                self.directory.name, 'P{0:02}.8Xp'.format(number), tokens, b'P' + str(number).encode()))
+        self.assertTrue(any(b'\xBB\x3F' in b"".join(TIPrgmFile(f).prgmdata) for f in self.files))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def grep(self, patterns):
+        found = []
+        for filename in self.files:
+            for number, line in enumerate(self.compiler.decompile(TIPrgmFile(filename)), 1):
+                if any(pattern in line for pattern in patterns):
+                    found.append((filename, number, line))
+        return found
+
+    def search(self, patterns):
+        searcher = ProgramSearcher(patterns, 'TI-83+')
+        return sorted(set(
+            (hit.filename, hit.line, hit.text)
+            for hit in searcher.search_paths([self.directory.name])))
+
+    def test_matches_decompile_and_grep(self):
+        for patterns in (['Output(3,'], ['2-PropZTest(1'], ['End', 'Output(4,'], ['ClrHome']):
+            self.assertEqual(self.search(patterns), self.grep(patterns), patterns)
+
+    def test_without_merging_candidates(self):
+        distance = ProgramSearcher.MERGE_DISTANCE
+        ProgramSearcher.MERGE_DISTANCE = 0
+        try:
+            self.assertEqual(self.search(['Output(3,']), self.grep(['Output(3,']))
+        finally:
+            ProgramSearcher.MERGE_DISTANCE = distance
+
+    def test_hit_offsets_and_names(self):
+        searcher = ProgramSearcher(['Output(3,'], 'TI-83+')
+        for filename in self.files:
+            prgm_data = b"".join(TIPrgmFile(filename).prgmdata)
+            for hit in searcher.search_file(filename):
+                self.assertTrue(prgm_data.startswith(b'\xE0\x33\x2B', hit.offset))
+                self.assertEqual(hit.program, 'P' + filename[-6:-4].lstrip('0').rjust(1, '0'))
+
+    def test_unreadable_files_are_skipped(self):
+        short = os.path.join(self.directory.name, 'P00 SHORT.8Xp')
+        with open(short, 'wb') as f:
+            f.write(b'\x00' * 40)
+        searcher = ProgramSearcher(['Output(3,'], 'TI-83+')
+        hits = list(searcher.search_paths([self.directory.name]))
+        self.assertEqual(len(searcher.unreadable), 1)
+        self.assertEqual(searcher.unreadable[0][0], short)
+        self.assertEqual(len(hits), len(self.grep(['Output(3,'])))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from helpers import SRC
+from basically_ti_basic import server
+from basically_ti_basic.server import forward, serve_socket
+
+class StdioTest(unittest.TestCase):
+
+    def test_every_line_of_stdout_is_a_response(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'HELLO.txt')
+            with open(source, 'w') as f:
+                f.write('ClrHome\nDisp "HELLO"\n')
+
+            requests = "".join(
+                json.dumps({
+                    'id': number,
+                    'op': 'compile',
+                    'input': source,
+                    'output': os.path.join(directory, 'HELLO{0}.8Xp'.format(number))
+                    }) + "\n"
+                for number in range(4))
+
+            env = dict(os.environ, PYTHONPATH=SRC)
+            result = subprocess.run(
+                [sys.executable, '-m', 'basically_ti_basic', '--stdio'],
+                input=requests, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True, env=env, check=True)
+
+            for number in range(4):
+                self.assertTrue(os.path.exists(os.path.join(directory, 'HELLO{0}.8Xp'.format(number))))
+
+        responses = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual(sorted(response['id'] for response in responses), [0, 1, 2, 3])
+        self.assertTrue(all(response['ok'] for response in responses))
+        self.assertIn("WARNING", result.stderr)
+
+class WorkerCompileTest(unittest.TestCase):
+
+    def run_main(self, cwd, *args):
+        subprocess.run(
+            [sys.executable, '-m', 'basically_ti_basic'] + list(args),
+            cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=dict(os.environ, PYTHONPATH=SRC), check=True)
+
+    def test_worker_writes_the_same_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'hello.txt')
+            with open(source, 'w') as f:
+                f.write('ClrHome\nDisp "HELLO"\n')
+            path = os.path.join(directory, 'worker.sock')
+            for subdirectory in ('worker', 'local'):
+                os.mkdir(os.path.join(directory, subdirectory))
+
+            worker = subprocess.Popen(
+                [sys.executable, '-m', 'basically_ti_basic', '--serve', '--socket', path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                env=dict(os.environ, PYTHONPATH=SRC))
+            try:
+                deadline = time.time() + 10
+                while forward({'op': 'ping'}, path) is None:
+                    self.assertLess(time.time(), deadline, "The worker didn't start")
+                    time.sleep(0.05)
+                self.run_main(os.path.join(directory, 'worker'), '-c', '-i', source, '-o', 'HELLO.8Xp', '--socket', path)
+            finally:
+                worker.terminate()
+                worker.wait()
+            self.run_main(os.path.join(directory, 'local'), '-c', '-i', source, '-o', 'HELLO.8Xp', '--no-server')
+
+            with open(os.path.join(directory, 'worker', 'HELLO.8Xp'), 'rb') as f:
+                from_worker = f.read()
+            with open(os.path.join(directory, 'local', 'HELLO.8Xp'), 'rb') as f:
+                from_local = f.read()
+            self.assertEqual(from_worker, from_local)
+
+class SocketTest(unittest.TestCase):
+
+    def test_forward_ignores_missing_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(forward({'op': 'ping'}, os.path.join(directory, 'none.sock')))
+
+    def test_forward_gives_up_on_a_hung_worker(self):
+        import socket
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'hung.sock')
+            listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(path)
+            listener.listen(1)
+            timeout = server.RESPONSE_TIMEOUT
+            server.RESPONSE_TIMEOUT = 0.2
+            try:
+                self.assertIsNone(forward({'op': 'ping'}, path))
+            finally:
+                server.RESPONSE_TIMEOUT = timeout
+                listener.close()
+
+    def test_client_imports_stay_light(self):
+        result = subprocess.run(
+            [sys.executable, '-c',
+                'import sys, basically_ti_basic.server; print("tempfile" in sys.modules)'],
+            stdout=subprocess.PIPE, universal_newlines=True,
+            env=dict(os.environ, PYTHONPATH=SRC, XDG_RUNTIME_DIR='/tmp'), check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    @unittest.skipIf(os.getuid() != 0, "needs to create a file owned by another user")
+    def test_forward_ignores_socket_of_another_user(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'other.sock')
+            open(path, 'w').close()
+            os.chown(path, 12345, 12345)
+            self.assertIsNone(forward({'op': 'ping'}, path))
+            with self.assertRaises(RuntimeError):
+                serve_socket(path)
+
+if __name__ == '__main__':
+    unittest.main()
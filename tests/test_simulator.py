@@ -0,0 +1,91 @@
+import unittest
+
+import helpers
+from basically_ti_basic.compiler import PrgmCompiler
+from basically_ti_basic.simulator import PrgmSimulator, SimulatorError, StepLimitError
+
+class PrgmSimulatorTest(unittest.TestCase):
+
+    def run_program(self, lines, **kwargs):
+        prgm_data = PrgmCompiler().compile([line + "\n" for line in lines]).prgmdata
+        self.simulator = PrgmSimulator(**kwargs)
+        return self.simulator.run(prgm_data).log
+
+    def test_powers(self):
+        self.assertEqual(
+            self.run_program(['Disp 2^3', '3→A', 'Disp A^3', 'Disp 2^2', 'Disp 2^4', 'Disp 4^-1']),
+            ['8', '27', '4', '16', '0.25'])
+
+    def test_arithmetic(self):
+        self.assertEqual(
+            self.run_program(['Disp 1+2*3', 'Disp (1+2)*3', 'Disp 7/2', 'Disp -3+5', 'Disp 10–4–3', '2→B', 'Disp 3B', 'Disp 4!']),
+            ['7', '9', '3.5', '2', '3', '6', '24'])
+
+    def test_if_then_else(self):
+        self.assertEqual(
+            self.run_program([
+                '5→A',
+                'If A>3:Then', 'Disp "BIG"', 'Else', 'Disp "SMALL"', 'End',
+                'If A<3:Then', 'Disp "SMALL"', 'Else', 'Disp "NOT SMALL"', 'End',
+                'If A=5', 'Disp "FIVE"',
+                'If A=6', 'Disp "SIX"',
+                ]),
+            ['BIG', 'NOT SMALL', 'FIVE'])
+
+    def test_loops(self):
+        self.assertEqual(
+            self.run_program([
+                '0→A', 'Repeat A>=3', 'A+1→A', 'Disp A', 'End',
+                'For I,10,1,-3', 'Disp I', 'End',
+                '0→B', 'While B<2', 'B+1→B', 'End', 'Disp B',
+                ]),
+            ['1', '2', '3', '10', '7', '4', '1', '2'])
+
+    def test_goto_and_is_greater(self):
+        self.assertEqual(
+            self.run_program([
+                '0→A',
+                'Lbl A',
+                'IS>(A,2)', 'Goto A',
+                'Disp A',
+                'Goto B', 'Disp "SKIPPED"', 'Lbl B', 'Stop', 'Disp "STOPPED"',
+                ]),
+            ['3'])
+
+    def test_prompt_and_profile(self):
+        self.assertEqual(self.run_program(['Prompt A', 'Disp A*2'], inputs=[21]), ['A=?21', '42'])
+        self.assertEqual(self.simulator.variables[ord('A')], 21)
+        profile = self.simulator.profile()
+        self.assertEqual(sorted(line for line, count in profile), [1, 2])
+        self.assertEqual(sum(count for line, count in profile), self.simulator.steps)
+
+    def test_errors(self):
+        with self.assertRaises(SimulatorError) as error:
+            self.run_program(['ClrHome', 'Disp 1/0'])
+        self.assertEqual(error.exception.line, 2)
+        with self.assertRaises(StepLimitError):
+            self.run_program(['Lbl A', 'Goto A'], max_steps=100)
+
+    def assertCalculatorError(self, lines, message):
+        with self.assertRaises(SimulatorError) as error:
+            self.run_program(lines)
+        self.assertIn(message, str(error.exception))
+
+    def test_nonreal_result(self):
+        self.assertCalculatorError(['Disp (-8)^(1/3)'], "ERR:NONREAL ANS")
+
+    def test_overflow(self):
+        self.assertCalculatorError(['Disp 3!!!!'], "ERR:OVERFLOW")
+        self.assertCalculatorError(['Disp 70!'], "ERR:OVERFLOW")
+        self.assertCalculatorError(['Disp 10^(400)'], "ERR:OVERFLOW")
+        self.assertCalculatorError(['Disp 2^400'], "ERR:OVERFLOW")
+        self.assertCalculatorError(['Disp e^(1000)'], "ERR:OVERFLOW")
+        self.assertCalculatorError(['10^(50)→A', 'Disp A*A'], "ERR:OVERFLOW")
+
+    def test_largest_results(self):
+        self.assertEqual(
+            self.run_program(['Disp 69!', 'Disp 10^(99)', 'Disp 2^10', 'Disp 10^(5)*10^(6)']),
+            ['1.711224524e+98', '1e+99', '1024', '1e+11'])
+
+if __name__ == '__main__':
+    unittest.main()
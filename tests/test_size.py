@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from helpers import SRC, write_8xp
+from basically_ti_basic.compiler import PrgmCompiler, BudgetError
+
+class SizeReportTest(unittest.TestCase):
+
+    def test_sizes(self):
+        report = PrgmCompiler().size_report(
+            b"".join(PrgmCompiler().compile(['ClrHome\n', 'Disp "HELLO"\n']).prgmdata), 'HELLO')
+        self.assertEqual(report.size, 11)
+        self.assertEqual(report.ram_size, 11 + 9 + 5)
+        self.assertEqual(report.file_size, 11 + 76)
+        self.assertEqual(report.largest_lines(1), [(2, 9, 'Disp "HELLO"')])
+        self.assertEqual(report.largest_strings(), [(2, 7, '"HELLO"')])
+        report.check(25)
+        with self.assertRaises(BudgetError):
+            report.check(24)
+
+class BudgetCommandTest(unittest.TestCase):
+
+    def run_main(self, *args):
+        return subprocess.run(
+            [sys.executable, '-m', 'basically_ti_basic'] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+            env=dict(os.environ, PYTHONPATH=SRC))
+
+    def test_budget_checks_a_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tokens = b"".join(PrgmCompiler().compile(['Disp "HELLO"\n']).prgmdata)
+            write_8xp(directory, 'HELLO.8Xp', tokens, b'HELLO')
+
+            result = self.run_main('--budget', '1', '-i', directory)
+            self.assertEqual(result.returncode, 1)
+            self.assertIn('HELLO', result.stderr)
+
+            result = self.run_main('--budget', '1000', '-i', directory)
+            self.assertEqual(result.returncode, 0)
+
+    def test_budget_without_anything_to_check(self):
+        result = self.run_main('--budget', '1', '-d', '-i', 'FIBO.8Xp')
+        self.assertEqual(result.returncode, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import tempfile
+import unittest
+
+from helpers import write_8xp
+from basically_ti_basic.compiler import PrgmCompiler
+from basically_ti_basic.store import ProgramStore
+
+class ProgramStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ProgramStore(self.directory.name + '/store')
+        self.compiler = PrgmCompiler()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, fname, lines, name):
+        tokens = b"".join(self.compiler.compile(lines).prgmdata)
+        return write_8xp(self.directory.name, fname, tokens, name)
+
+    def test_versions_round_trip(self):
+        lines = ['Disp "LINE {0}"\n'.format(number) for number in range(400)]
+        old = self.write('OLD.8Xp', lines, b'PROG')
+        lines[200] = 'ClrHome\n'
+        new = self.write('NEW.8Xp', lines, b'PROG')
+
+        old_id = self.store.put(old)
+        new_id = self.store.put(new)
+        self.assertEqual(self.store.versions('PROG'), [old_id, new_id])
+        for version_id, path in ((old_id, old), (new_id, new)):
+            with open(path, 'rb') as f:
+                self.assertEqual(self.store.get(version_id), f.read())
+        self.assertEqual(
+            self.store.diff(old_id, new_id),
+            [('replace', 'Disp "LINE 200"', 'ClrHome')])
+
+    def test_names_are_not_paths(self):
+        path = self.write('SLASH.8Xp', ['ClrHome\n'], b'../A/B')
+        version_id = self.store.put(path)
+        self.assertEqual(self.store.programs(), ['../A/B'])
+        self.assertEqual(self.store.versions('../A/B'), [version_id])
+
+if __name__ == '__main__':
+    unittest.main()
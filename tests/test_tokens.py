@@ -0,0 +1,32 @@
+import unittest
+
+import helpers
+from basically_ti_basic.compiler import PrgmCompiler, Diagnostics
+from basically_ti_basic.tokens import get_models, get_table
+
+class TokenTableTest(unittest.TestCase):
+
+    def test_models_are_layered(self):
+        tokens = [set(get_table(model).get_tokens()) for model in ('TI-83', 'TI-83+', 'TI-84+', 'TI-84+CE')]
+        for smaller, bigger in zip(tokens, tokens[1:]):
+            self.assertLess(smaller, bigger)
+        self.assertEqual(set(get_models()), {'TI-83', 'TI-83+', 'TI-84+', 'TI-84+CE'})
+
+    def test_every_token_round_trips(self):
+        for model in get_models():
+            compiler = PrgmCompiler(model)
+            for token, plaintext in compiler.table.get_tokens().items():
+                if plaintext in ("\n", ":"):
+                    continue
+                compiled = compiler.compile([plaintext + "\n"], Diagnostics('raise'))
+                self.assertEqual(compiler.decompile(compiled), [plaintext, ""], (model, plaintext))
+
+    def test_color_commands(self):
+        compiler = PrgmCompiler('TI-84+CE')
+        compiled = compiler.compile(['TextColor(BLUE):Wait 1:eval(1)\n']).prgmdata
+        self.assertEqual(
+            b"".join(compiled),
+            b'\xEF\x67\xEF\x41\x11\x3E\xEF\x96\x31\x3E\xEF\x98\x31\x11\x3F')
+
+if __name__ == '__main__':
+    unittest.main()